@@ -0,0 +1,3 @@
+"""
+Benchmarks for the storage and middleware hot paths
+"""
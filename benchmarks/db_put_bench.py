@@ -0,0 +1,56 @@
+"""
+Compare keys/sec of DB.put (one commit per key) against DB.put_many
+
+usage: python -m benchmarks.db_put_bench [-n 2000] [--batch 1000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from src.services.storage.db_lmdb import DB
+
+
+def _items(n:int, tag:str):
+    return [(f"did:verity:bench:{tag}:{i}", f"cid_{i:064x}") for i in range(n)]
+
+
+def bench_put(db:DB, n:int) -> float:
+    """Time n single-key puts, returns keys/sec"""
+    items = _items(n, "put")
+    start = time.perf_counter()
+    for key, value in items:
+        db.put(key, value)
+    return n / (time.perf_counter() - start)
+
+
+def bench_put_many(db:DB, n:int, batch:int) -> float:
+    """Time n keys written in batches, returns keys/sec"""
+    items = _items(n, "many")
+    start = time.perf_counter()
+    for i in range(0, n, batch):
+        db.put_many(items[i:i + batch])
+    return n / (time.perf_counter() - start)
+
+
+def main():
+    """
+    Run both paths on a fresh temporary DB and print keys/sec
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=2000, help="number of keys per run")
+    parser.add_argument("--batch", type=int, default=1000, help="keys per put_many call")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "store.db"), index_path=os.path.join(tmpdir, "index.db"))
+        try:
+            single = bench_put(db, args.n)
+            many = bench_put_many(db, args.n, args.batch)
+        finally:
+            db.close()
+    print(f"put       : {single:12.0f} keys/sec")
+    print(f"put_many  : {many:12.0f} keys/sec (batch={args.batch})")
+    print(f"speedup   : {many / single:12.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Middleware encode/decode cost per call: dict round trips vs single pass
+
+Before, a response went bytes -> dict (resp.json()) -> model (model_validate) and a
+stored model went model -> dict (model_dump) -> request model -> JSON. Now responses
+are validated straight from the bytes (model_validate_json) and documents are
+serialized once into the request body. Payloads are a DID document and a signed
+claim as the demo produces them.
+
+usage: python -m benchmarks.decode_bench [-n 5000]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+from datetime import datetime
+from src.core.models import (DEMO, VerityClaim, IPFSStoreRequest, IPFSRetrieveResponse,
+                             DIDRegistryResolveResponse)
+from src.middleware.middleware import _store_body
+
+CLAIM = VerityClaim(
+    claim_id="claim_8f2c1d9a0b7e4c11",
+    issuer={"id": "did:verity:demo:election-commission", "signed_by": "#key-1"},
+    credential_subject={"id": "urn:uuid:target-content-123", "type": "ElectionResult",
+                        "title": "2024 Presidential Election - Final Tally",
+                        "summary": "The final certified results " * 8,
+                        "content_url": "https://elections.demo/results.pdf",
+                        "authority": "National Electoral Commission"},
+    content_hash="sha256:" + "ab" * 32, content_type="document",
+    platform_hashes={"twitter": {"perceptual_hash": "phash:1234abc", "format": "jpeg"}},
+    proof={"type": "EcdsaSecp256k1Signature2019", "created": "2024-01-20T14:30:00Z",
+           "verification_method": "did:verity:demo:election-commission#key-1",
+           "proof_value": "0x" + "cd" * 65})
+
+
+def _retrieve_body(model) -> bytes:
+    return IPFSRetrieveResponse(cid="bagaaiera" + "a" * 50, document=model.model_dump(mode="json"),
+                                retrieved_at=datetime.now()).model_dump_json().encode()
+
+
+RESOLVE = DIDRegistryResolveResponse(did=DEMO.id, doc_cid="bagaaiera" + "a" * 50,
+                                     status="success").model_dump_json().encode()
+
+
+def _cases() -> list[tuple[str, object, object]]:
+    cases = []
+    for name, model in (("did doc", DEMO), ("claim", CLAIM)):
+        body = _retrieve_body(model)
+        cases.append((f"store {name}",
+                      lambda m=model: IPFSStoreRequest(document=m.model_dump())
+                      .model_dump_json().encode(),
+                      lambda m=model: _store_body(m)))
+        cases.append((f"retrieve {name}",
+                      lambda b=body: IPFSRetrieveResponse.model_validate(json.loads(b.decode())),
+                      lambda b=body: IPFSRetrieveResponse.model_validate_json(b)))
+    cases.append(("resolve",
+                  lambda: DIDRegistryResolveResponse.model_validate(json.loads(RESOLVE.decode())),
+                  lambda: DIDRegistryResolveResponse.model_validate_json(RESOLVE)))
+    return cases
+
+
+def measure(func, n:int) -> tuple[float, float]:
+    """Return (usec/call, peak traced bytes/call), timed without tracing"""
+    func()
+    start = time.perf_counter()
+    for _ in range(n):
+        func()
+    usec = (time.perf_counter() - start) / n * 1e6
+    peak = 0
+    tracemalloc.start()
+    for _ in range(min(n, 500)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        func()
+        peak += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return usec, peak / min(n, 500)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=5000, help="calls per path")
+    args = parser.parse_args()
+    for name, before, after in _cases():
+        old_us, old_peak = measure(before, args.n)
+        new_us, new_peak = measure(after, args.n)
+        print(f"{name:>17}: {old_us:7.1f} -> {new_us:6.1f} us/call "
+              f"({old_us / new_us:4.1f}x)  peak {old_peak:7.0f} -> {new_peak:6.0f} B/call")
+
+
+if __name__ == "__main__":
+    main()
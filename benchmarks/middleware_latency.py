@@ -0,0 +1,71 @@
+"""
+Latency of one verification's middleware calls: new connection per call, pooled session,
+pooled session with the client caches
+
+A verification resolves the claim id, retrieves the claim, resolves the issuer DID and
+retrieves its DID document. Without --url a storage service is started on a temporary
+directory.
+
+usage: python -m benchmarks.middleware_latency [-n 300] [--url http://127.0.0.1:8080]
+"""
+import argparse
+import statistics
+import time
+import requests
+from src.middleware.middleware import MiddlewareClient
+from benchmarks.storage_server import storage_service
+
+
+def _seed(client:MiddlewareClient) -> tuple[str, str]:
+    diddoc = client.store({"id": "did:verity:bench", "verificationMethod": []}).cid
+    client.register("did:verity:bench", diddoc)
+    claim = client.store({"claim_id": "claim_bench", "issuer": {"id": "did:verity:bench"}}).cid
+    client.register("claim_bench", claim)
+    return "claim_bench", "did:verity:bench"
+
+
+def _unpooled(url:str, claim_id:str, did:str):
+    """The calls as the module functions made them before: requests.get opens a connection each"""
+    for key in (claim_id, did):
+        cid = requests.get(f"{url}/resolve/{key}", timeout=5).json()["doc_cid"]
+        requests.get(f"{url}/retrieve/{cid}", timeout=5).json()
+
+
+def _pooled(client:MiddlewareClient, claim_id:str, did:str):
+    for key in (claim_id, did):
+        client.retrieve(client.resolve(key).doc_cid)
+
+
+def _measure(label:str, verify, n:int):
+    verify()
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        verify()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    print(f"{label:<24} mean {statistics.mean(samples):7.2f} ms   "
+          f"p50 {samples[len(samples) // 2]:7.2f} ms   p99 {samples[int(len(samples) * 0.99)]:7.2f} ms")
+
+
+def main():
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=300, help="verifications per variant")
+    parser.add_argument("--url", default=None, help="running storage service")
+    args = parser.parse_args()
+    with storage_service(args.url) as url:
+        client = MiddlewareClient(base_url=url, cache=False)
+        cached = MiddlewareClient(base_url=url)
+        claim_id, did = _seed(client)
+        _measure("new connection per call", lambda: _unpooled(url, claim_id, did), args.n)
+        _measure("pooled session", lambda: _pooled(client, claim_id, did), args.n)
+        _measure("pooled session + cache", lambda: _pooled(cached, claim_id, did), args.n)
+        client.close()
+        cached.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Registrations/sec under many concurrent clients, group commit vs one commit per request
+
+In-process mode drives the /register endpoint of the storage app on a temporary DB.
+With --url, N client threads post to a running storage service instead.
+
+usage: python -m benchmarks.register_load [--clients 128] [-n 4000] [--url http://127.0.0.1:8080]
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from src.core.models import DIDRegistryRegisterRequest
+from src.services.storage import main as storage_main
+from src.services.storage.db_lmdb import DB
+
+
+async def _drive(handler, clients:int, n:int) -> float:
+    queue = iter(range(n))
+
+    async def client():
+        for i in queue:
+            await handler(DIDRegistryRegisterRequest(did=f"did:verity:load:{i}", doc_cid=f"cid_{i}"))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return n / (time.perf_counter() - start)
+
+
+def in_process(clients:int, n:int):
+    """Compare the coalesced endpoint with a per-request commit on the same DB"""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "store.db"), index_path=os.path.join(tmpdir, "index.db"))
+        storage_main.get_db = lambda: db
+
+        async def per_request(req):
+            await asyncio.to_thread(db.put, req.did, req.doc_cid)
+
+        try:
+            single = asyncio.run(_drive(per_request, clients, n))
+            grouped = asyncio.run(_drive(storage_main.register, clients, n))
+        finally:
+            db.close()
+    print(f"one commit per request: {single:10.0f} registrations/sec")
+    print(f"group commit          : {grouped:10.0f} registrations/sec "
+          f"(avg batch {storage_main.coalescer.stats()['avg_batch']:.1f})")
+
+
+def over_http(url:str, clients:int, n:int):
+    """Post n registrations to a running service from `clients` threads"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=clients)
+    session.mount("http://", adapter)
+
+    def post(i):
+        body = DIDRegistryRegisterRequest(did=f"did:verity:load:{i}", doc_cid=f"cid_{i}")
+        session.post(f"{url}/register", data=body.model_dump_json(),
+                     headers={"Content-Type": "application/json"}, timeout=30).raise_for_status()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        list(pool.map(post, range(n)))
+    print(f"{url}: {n / (time.perf_counter() - start):10.0f} registrations/sec "
+          f"with {clients} clients")
+
+
+def main():
+    """
+    Run the load test
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--clients", type=int, default=128, help="concurrent clients")
+    parser.add_argument("-n", type=int, default=4000, help="registrations")
+    parser.add_argument("--url", default=None, help="running storage service")
+    args = parser.parse_args()
+    if args.url:
+        over_http(args.url, args.clients, args.n)
+    else:
+        in_process(args.clients, args.n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Reads spread over several storage processes, and what happens when one dies
+
+Starts a primary and replicas sharing one directory, stores and registers documents
+through the primary, then resolves+retrieves them from concurrent threads with a
+single endpoint, round robin and least outstanding. Finally kills a replica: reads
+keep succeeding once its /health check ejects it.
+
+usage: python -m benchmarks.replicas [-n 400] [--replicas 2] [--threads 8]
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from src.middleware.middleware import MiddlewareClient
+from src.middleware.endpoints import ROUND_ROBIN, LEAST_OUTSTANDING
+from benchmarks.storage_server import storage_cluster
+
+
+def _seed(client:MiddlewareClient, n:int) -> list[str]:
+    dids = []
+    for i in range(n):
+        did = f"did:verity:replica:{i}"
+        client.register(did, client.store({"id": did, "n": i}).cid)
+        dids.append(did)
+    return dids
+
+
+def _read(client:MiddlewareClient, did:str):
+    client.retrieve(client.resolve(did).doc_cid)
+
+
+def _measure(label:str, client:MiddlewareClient, dids:list[str], threads:int):
+    with ThreadPoolExecutor(threads) as pool:
+        start = time.perf_counter()
+        list(pool.map(lambda did: _read(client, did), dids))
+        elapsed = time.perf_counter() - start
+    served = {url: s["requests"] for url, s in client.endpoint_stats().items()}
+    print(f"{label:>18}: {len(dids) / elapsed:8.0f} reads/s  requests per endpoint {served}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=400, help="DIDs read per run")
+    parser.add_argument("--replicas", type=int, default=2, help="replicas besides the primary")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent readers")
+    args = parser.parse_args()
+
+    with storage_cluster(args.replicas + 1) as procs:
+        urls = list(procs)
+        primary, replicas = urls[0], urls[1:]
+        seeder = MiddlewareClient(base_url=primary, cache=False)
+        dids = _seed(seeder, args.n)
+        seeder.close()
+        options = dict(cache=False, singleflight=False, pool_maxsize=args.threads,
+                       health_interval=None)
+        runs = [("primary only", MiddlewareClient(base_url=primary, **options)),
+                (ROUND_ROBIN, MiddlewareClient(base_url=primary, replicas=replicas,
+                                               balance=ROUND_ROBIN, **options)),
+                (LEAST_OUTSTANDING, MiddlewareClient(base_url=primary, replicas=replicas,
+                                                     balance=LEAST_OUTSTANDING, **options))]
+        for label, client in runs:
+            _measure(label, client, dids, args.threads)
+            client.close()
+
+        client = MiddlewareClient(base_url=primary, replicas=replicas, cache=False,
+                                  health_interval=0.2)
+        procs[replicas[0]].terminate()
+        procs[replicas[0]].wait()
+        time.sleep(0.5)
+        failed = 0
+        for did in dids:
+            try:
+                _read(client, did)
+            except Exception:  # pylint: disable=broad-except
+                failed += 1
+        stats = client.endpoint_stats()[replicas[0]]
+        print(f"replica killed: {failed} failed reads out of {len(dids)}, "
+              f"ejected={not stats['healthy']}")
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
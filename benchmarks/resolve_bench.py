@@ -0,0 +1,68 @@
+"""
+Allocations per /resolve request, model path vs raw zero-copy path
+
+Peak traced memory divided by the value size approximates how many copies
+of the value a request makes.
+
+usage: python -m benchmarks.resolve_bench [--size 65536] [-n 200]
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from src.services.storage import main as storage_main
+from src.services.storage.db_lmdb import DB
+
+
+def _model_path(did:str) -> bytes:
+    # what FastAPI does with the default path: value decoded, model built and dumped
+    return storage_main.resolve(did).model_dump_json().encode()
+
+
+def _raw_path(did:str) -> bytes:
+    return storage_main.resolve(did, raw=True).body
+
+
+def measure(func, did:str, n:int, size:int):
+    """Return (usec/request, peak bytes/request, copies/request)"""
+    func(did)
+    peak = 0
+    elapsed = 0.0
+    tracemalloc.start()
+    for _ in range(n):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        func(did)
+        elapsed += time.perf_counter() - start
+        peak += tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    return elapsed / n * 1e6, peak / n, peak / n / size
+
+
+def main():
+    """
+    Store one large value and resolve it through both paths
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=64 * 1024, help="value size in bytes")
+    parser.add_argument("-n", type=int, default=200, help="requests per path")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        # cache disabled so both paths read from LMDB
+        db = DB(path=os.path.join(tmpdir, "store.db"), index_path=os.path.join(tmpdir, "index.db"),
+                cache_bytes=0)
+        storage_main.get_db = lambda: db
+        did = "did:verity:bench:large"
+        db.put(did, "c" * args.size)
+        try:
+            for name, func in (("model", _model_path), ("raw", _raw_path)):
+                usec, peak, copies = measure(func, did, args.n, args.size)
+                print(f"{name:6}: {usec:9.1f} us/req {peak:12.0f} B peak/req {copies:5.1f} copies/req")
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
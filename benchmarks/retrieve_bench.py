@@ -0,0 +1,73 @@
+"""
+/retrieve cost per document size: the original route (parse, then FastAPI's
+response_model validation and dump) vs pre-framed raw bytes, both over HTTP
+
+usage: python -m benchmarks.retrieve_bench [-n 20]
+"""
+import argparse
+import json
+import logging
+import tempfile
+import time
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from src.core.models import IPFSStoreRequest, IPFSRetrieveResponse
+from src.services.storage import main as storage_main
+from src.services.storage.blobstore import FileBlobStore
+
+SIZES = {"1KB": 1024, "100KB": 100 * 1024, "10MB": 10 * 1024 * 1024}
+
+
+def _document(size:int) -> dict:
+    entry = {"id": "urn:uuid:0", "type": "ElectionResult", "value": "x" * 40}
+    count = max(1, size // 90)
+    return {"id": "did:verity:bench", "entries": [dict(entry, id=f"urn:uuid:{i}")
+                                                  for i in range(count)]}
+
+
+def _original_app(blobs:FileBlobStore) -> FastAPI:
+    """The /retrieve route before the framed path, reading the blob store's file"""
+    app = FastAPI()
+
+    @app.get("/retrieve/{cid}", response_model=IPFSRetrieveResponse)
+    def retrieve_cid(cid:str):
+        path = blobs.path(cid)
+        if path is None:
+            return IPFSRetrieveResponse(cid=cid, document={"0": ""}, exists=False)
+        with open(path, "r", encoding="utf-8") as f:
+            return IPFSRetrieveResponse(cid=cid, document=json.loads(f.read()), exists=True)
+    return app
+
+
+def _time(client:TestClient, cid:str, n:int) -> float:
+    client.get(f"/retrieve/{cid}").raise_for_status()
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get(f"/retrieve/{cid}")
+    return (time.perf_counter() - start) / n * 1000
+
+
+def main():
+    """
+    Store one document per size and time both retrieve paths
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=20, help="requests per size and path")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blobs = FileBlobStore(tmpdir)
+        storage_main.get_blobs = lambda: blobs
+        original = TestClient(_original_app(blobs))
+        framed_client = TestClient(storage_main.app)
+        for name, size in SIZES.items():
+            cid = storage_main.store_cid(IPFSStoreRequest(document=_document(size))).cid
+            n = max(1, args.n // 10) if size > 1024 * 1024 else args.n
+            model = _time(original, cid, n)
+            framed = _time(framed_client, cid, n)
+            print(f"{name:>6}: original {model:9.3f} ms  framed {framed:9.3f} ms  "
+                  f"speedup {model / framed:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
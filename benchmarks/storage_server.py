@@ -0,0 +1,82 @@
+"""
+A throwaway storage service for the HTTP benchmarks
+
+The service runs in its own process so it doesn't share the GIL with the client.
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+import requests
+
+# the app is imported from the repository root (it mounts static dirs relative to it),
+# then serves from the temporary directory so its DB and documents land there
+_LAUNCH = """
+import os, sys, uvicorn
+from src.services.storage.main import app
+os.chdir(sys.argv[1])
+uvicorn.run(app, host="127.0.0.1", port=int(sys.argv[2]), log_level="warning")
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_up(url:str):
+    for _ in range(200):
+        try:
+            requests.get(f"{url}/health", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.05)
+
+
+@contextmanager
+def storage_cluster(n:int, directory:Optional[str] = None) -> Iterator[dict[str, subprocess.Popen]]:
+    """
+    Yields {url: process} of n fresh services sharing one temporary directory,
+    the first is the primary, all stopped on exit
+
+    They open the same LMDB files and blob directory, like the workers of one
+    service, so a document stored through one is served by all.
+
+    :param n: number of storage processes
+    :param directory: serve from this directory instead of a temporary one
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpdir = directory or tmpdir
+        procs = {}
+        try:
+            for _ in range(n):
+                port = _free_port()
+                procs[f"http://127.0.0.1:{port}"] = subprocess.Popen(
+                    [sys.executable, "-c", _LAUNCH, tmpdir, str(port)], cwd=root)
+                # one at a time, the first creates the DB files
+                _wait_up(next(reversed(procs)))
+            yield procs
+        finally:
+            for proc in procs.values():
+                proc.terminate()
+                proc.wait()
+
+
+@contextmanager
+def storage_service(url:Optional[str] = None) -> Iterator[str]:
+    """
+    Yields url when given, else the URL of a fresh service stopped on exit
+
+    :param url: running storage service to use instead
+    """
+    if url:
+        yield url
+        return
+    with storage_cluster(1) as procs:
+        yield next(iter(procs))
@@ -0,0 +1,93 @@
+"""
+Middleware over loopback HTTP vs in-process calls into the storage service
+
+Each operation is timed through the HTTP clients (a storage service in its own
+process), the async client over httpx's ASGI transport (the app called in this
+process, still HTTP shaped) and the in-process clients (the service's DB and blob
+store called directly). The service and this process share one temporary directory,
+so all of them see the same data. Client caches are off. Async registrations wait
+for the service's group commit window.
+
+usage: python -m benchmarks.transport_bench [-n 2000]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+import httpx
+from src.middleware.middleware import MiddlewareClient
+from src.middleware.async_middleware import AsyncMiddlewareClient
+from src.middleware.inprocess import InProcessClient, AsyncInProcessClient
+from src.services.storage.main import app
+from benchmarks.storage_server import storage_cluster
+
+DID = "did:verity:transport"
+
+
+def _report(label:str, samples:list[float]):
+    samples.sort()
+    print(f"{label:>26}: median {statistics.median(samples) * 1e6:8.1f} us"
+          f"  p95 {samples[int(len(samples) * 0.95)] * 1e6:8.1f} us")
+
+
+def _ops(cid:str) -> dict:
+    return {"resolve": lambda c: c.resolve(DID),
+            "retrieve": lambda c: c.retrieve(cid),
+            "store": lambda c: c.store({"id": DID, "nonce": time.perf_counter_ns()}),
+            "register": lambda c: c.register(DID, cid)}
+
+
+def _sync(label:str, client, cid:str, n:int):
+    for op, call in _ops(cid).items():
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            call(client)
+            samples.append(time.perf_counter() - start)
+        _report(f"{label} {op}", samples)
+
+
+async def _async(label:str, client, cid:str, n:int):
+    for op, call in _ops(cid).items():
+        samples = []
+        for _ in range(n):
+            start = time.perf_counter()
+            await call(client)
+            samples.append(time.perf_counter() - start)
+        _report(f"{label} {op}", samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", type=int, default=2000, help="calls per operation")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmpdir, storage_cluster(1, tmpdir) as procs:
+        url = next(iter(procs))
+        # the in-process clients open the service's files from here
+        os.chdir(tmpdir)
+        http = MiddlewareClient(base_url=url, cache=False, singleflight=False)
+        cid = http.store({"id": DID}).cid
+        http.register(DID, cid)
+
+        _sync("http", http, cid, args.n)
+        http.close()
+        _sync("in-process", InProcessClient(), cid, args.n)
+
+        async def run():
+            asgi = AsyncMiddlewareClient(base_url="http://storage", cache=False,
+                                         singleflight=False,
+                                         transport=httpx.ASGITransport(app=app))
+            await _async("async asgi", asgi, cid, args.n)
+            await asgi.aclose()
+            await _async("async in-process", AsyncInProcessClient(), cid, args.n)
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Verifications/sec at 1, 10 and 100 concurrent clients, blocking vs asyncio middleware
+
+Each client runs verify_claim_chain in a loop on one event loop, like concurrent
+requests to the verifier. "blocking" wraps the requests based client so every
+lookup stalls the loop, as the verifier did before; "async" uses aretrieve/aresolve.
+Without --url a storage service is started on a temporary directory.
+
+usage: python -m benchmarks.verify_concurrency [--seconds 3] [--url http://127.0.0.1:8080]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from src.core.crypto import create_ethereum_account
+from src.core.models import DemoDIDDocument, VerificationMethod
+from src.middleware.async_middleware import AsyncMiddlewareClient, set_default_async_client
+from src.middleware.claim_utils import create_claim, sign_claim
+from src.middleware.middleware import MiddlewareClient
+from src.services.verifier import verifier
+from benchmarks.storage_server import storage_service
+
+LEVELS = (1, 10, 100)
+
+
+def _seed(client:MiddlewareClient) -> str:
+    """Store and register an issuer DID document and a claim it signed, returns the claim CID"""
+    account = create_ethereum_account()
+    did = "did:verity:bench:issuer"
+    doc = DemoDIDDocument(id=did, verification_method=[VerificationMethod(
+        id=f"{did}#key-1", controller=did, public_key_multibase=f"eth:{account.address}")])
+    client.register(did, client.store(doc).cid)
+    claim = sign_claim(create_claim(issuer_did=did, message="benchmark"),
+                       account.key.hex())
+    cid = client.store(claim).cid
+    client.register(claim.claim_id, cid)
+    return cid
+
+
+async def _run(claim_cid:str, clients:int, seconds:float) -> tuple[float, float]:
+    """Verifications/sec and the longest time the loop could not run anything else (ms)"""
+    done = 0
+    stall = 0.0
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        nonlocal done
+        while time.perf_counter() < deadline:
+            result = await verifier.verify_claim_chain(claim_cid, use_checksum=False)
+            assert result.verified, result.error_message
+            done += 1
+
+    async def ticker():
+        # what any other request handled by this loop would wait
+        nonlocal stall
+        while time.perf_counter() < deadline:
+            before = time.perf_counter()
+            await asyncio.sleep(0.001)
+            stall = max(stall, time.perf_counter() - before - 0.001)
+
+    start = time.perf_counter()
+    await asyncio.gather(ticker(), *(client() for _ in range(clients)))
+    return done / (time.perf_counter() - start), stall * 1000
+
+
+def _blocking(sync_client:MiddlewareClient):
+    """Make the verifier's lookups block the loop, as the requests based calls did"""
+    async def aretrieve(cid):
+        return sync_client.retrieve(cid)
+
+    async def aresolve(did):
+        return sync_client.resolve(did)
+
+    verifier.aretrieve, verifier.aresolve = aretrieve, aresolve
+
+
+async def _with_async_client(url:str, claim_cid:str, clients:int,
+                             seconds:float) -> tuple[float, float]:
+    client = AsyncMiddlewareClient(base_url=url, max_connections=max(LEVELS))
+    set_default_async_client(client)
+    try:
+        return await _run(claim_cid, clients, seconds)
+    finally:
+        await client.aclose()
+
+
+def main():
+    """
+    Run the benchmark
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=3.0, help="duration per level")
+    parser.add_argument("--url", default=None, help="running storage service")
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    with storage_service(args.url) as url:
+        sync_client = MiddlewareClient(base_url=url, pool_maxsize=max(LEVELS))
+        claim_cid = _seed(sync_client)
+        originals = verifier.aretrieve, verifier.aresolve
+        for clients in LEVELS:
+            rate, stall = asyncio.run(_with_async_client(url, claim_cid, clients, args.seconds))
+            _blocking(sync_client)
+            blocking, blocking_stall = asyncio.run(_run(claim_cid, clients, args.seconds))
+            verifier.aretrieve, verifier.aresolve = originals
+            print(f"{clients:4d} clients: blocking {blocking:6.0f} verifications/sec "
+                  f"(loop stalled up to {blocking_stall:6.1f} ms)   async {rate:6.0f} "
+                  f"verifications/sec (loop stalled up to {stall:6.1f} ms)")
+        sync_client.close()
+
+
+if __name__ == "__main__":
+    main()
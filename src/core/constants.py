@@ -6,7 +6,26 @@ from enum import Enum
 STORAGEPORT = 8080
 HOST = "http://127.0.0.1"
 ADDHOST = "127.0.0.1"
+# read replicas of the storage service (scheme://host:port): reads are spread over
+# them and HOST:STORAGEPORT, writes only go to HOST:STORAGEPORT
+STORAGEREPLICAS: list[str] = []
+# how reads are spread: "round_robin" or "least_outstanding"
+STORAGEBALANCE = "round_robin"
+# how the middleware reaches storage: "http", or "inprocess" to call the storage
+# service's DB and blob store directly when they are local (single node)
+STORAGETRANSPORT = "http"
 VERIFYPORT = 8000
+# "split" (store.db + index.db) or "single" (one environment, atomic commits)
+STORAGELAYOUT = "split"
+# storage service worker processes, they share the LMDB files
+STORAGEWORKERS = 1
+# /register group commit: wait up to REGISTERWINDOW seconds or REGISTERBATCH items
+REGISTERWINDOW = 0.002
+REGISTERBATCH = 256
+# most items accepted by one /register/batch or /resolve/batch call
+BATCHMAXITEMS = 1000
+# /store and /retrieve backend: "file" (one file per CID) or "pack" (segment files)
+BLOBBACKEND = "file"
 
 class ContentType(str, Enum):
     """Type of content being claimed."""
@@ -1,8 +1,10 @@
 """
 Cryptographic utilities for Ethereum signing and hashing.
 """
+import base64
+import json
 import secrets
-from typing import Union
+from typing import Any, Iterable, Union
 import uuid
 import hashlib
 from eth_account import Account
@@ -212,3 +214,196 @@ def decode_id(raw: str | int) -> int:
     if isinstance(raw, str):
         return int(raw)
     raise ValueError(f"Unsupported escrow_id type: {type(raw)}")
+
+
+# ---------- Content identifiers ----------
+CID_VERSION = 1
+CODEC_JSON = 0x0200         # multicodec "json"
+CODEC_RAW = 0x55            # multicodec "raw"
+CODEC_DAG_JSON = 0x0129     # multicodec "dag-json", Merkle DAG nodes
+MULTIHASH_SHA256 = 0x12
+MULTIBASE_BASE32 = "b"      # RFC4648 lowercase, no padding
+LEGACY_CID_PREFIX = "cid_"  # "cid_" + sha256 hex of the stored bytes
+
+_canonical_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"),
+                                      ensure_ascii=False, allow_nan=False)
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    n = shift = 0
+    while True:
+        if pos >= len(data):
+            raise ValueError("Truncated varint")
+        byte = data[pos]
+        n |= (byte & 0x7F) << shift
+        pos += 1
+        if not byte & 0x80:
+            return n, pos
+        shift += 7
+
+
+def iter_canonical_json(obj: Any) -> Iterable[bytes]:
+    """
+    Encode obj as canonical JSON (sorted keys, compact separators, UTF-8), chunk by chunk.
+
+    Args:
+        obj: JSON compatible object.
+
+    Returns:
+        Iterator of UTF-8 encoded chunks.
+    """
+    for chunk in _canonical_encoder.iterencode(obj):
+        yield chunk.encode()
+
+
+def canonical_json(obj: Any) -> bytes:
+    """
+    Canonical JSON bytes of obj, identical for logically identical documents.
+
+    Args:
+        obj: JSON compatible object.
+
+    Returns:
+        UTF-8 encoded JSON.
+    """
+    return b"".join(iter_canonical_json(obj))
+
+
+def cid_from_digest(digest: bytes, codec: int = CODEC_JSON) -> str:
+    """
+    Build a base32 CIDv1 string from a SHA256 digest.
+
+    Args:
+        digest: SHA256 digest.
+        codec: multicodec of the content.
+
+    Returns:
+        CID string, e.g. "bagaaiera...".
+    """
+    multihash = _varint(MULTIHASH_SHA256) + _varint(len(digest)) + digest
+    raw = _varint(CID_VERSION) + _varint(codec) + multihash
+    return MULTIBASE_BASE32 + base64.b32encode(raw).decode().lower().rstrip("=")
+
+
+def compute_cid(data: Union[bytes, Iterable[bytes]], codec: int = CODEC_RAW) -> str:
+    """
+    CIDv1 of data, hashed incrementally when given an iterable of chunks.
+
+    Args:
+        data: Bytes or iterable of byte chunks.
+        codec: multicodec of the content.
+
+    Returns:
+        CID string.
+    """
+    hasher = hashlib.sha256()
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        hasher.update(data)
+    else:
+        for chunk in data:
+            hasher.update(chunk)
+    return cid_from_digest(hasher.digest(), codec)
+
+
+def canonical_json_cid(obj: Any) -> tuple[str, bytearray]:
+    """
+    Serialize obj as canonical JSON and hash it in the same pass.
+    The chunks go straight into one buffer, the document is never held twice.
+
+    Args:
+        obj: JSON compatible object.
+
+    Returns:
+        Tuple of the CIDv1 string and the canonical JSON bytes.
+    """
+    hasher = hashlib.sha256()
+    buf = bytearray()
+    for chunk in iter_canonical_json(obj):
+        hasher.update(chunk)
+        buf += chunk
+    return cid_from_digest(hasher.digest(), CODEC_JSON), buf
+
+
+def decode_cid(cid: str) -> tuple[int, bytes]:
+    """
+    Codec and SHA256 digest of a CID, legacy "cid_" ids included.
+
+    Args:
+        cid: CID string.
+
+    Returns:
+        Tuple of codec (CODEC_RAW for legacy ids) and digest.
+
+    Raises:
+        ValueError: If cid is not a supported CID.
+    """
+    if cid.startswith(LEGACY_CID_PREFIX):
+        digest = bytes.fromhex(cid[len(LEGACY_CID_PREFIX):])
+        if len(digest) != hashlib.sha256().digest_size:
+            raise ValueError(f"Invalid legacy cid: {cid}")
+        return CODEC_RAW, digest
+    if not cid.startswith(MULTIBASE_BASE32):
+        raise ValueError(f"Unsupported multibase: {cid}")
+    body = cid[1:].upper()
+    try:
+        raw = base64.b32decode(body + "=" * (-len(body) % 8))
+    except ValueError as e:
+        raise ValueError(f"Invalid base32 cid: {cid}") from e
+    version, pos = _read_varint(raw, 0)
+    codec, pos = _read_varint(raw, pos)
+    hash_code, pos = _read_varint(raw, pos)
+    length, pos = _read_varint(raw, pos)
+    if version != CID_VERSION or hash_code != MULTIHASH_SHA256 or len(raw) - pos != length:
+        raise ValueError(f"Unsupported cid: {cid}")
+    return codec, raw[pos:]
+
+
+def is_cid(value: str) -> bool:
+    """True for a CIDv1 or a legacy "cid_" id."""
+    try:
+        decode_cid(value)
+        return True
+    except ValueError:
+        return False
+
+
+def is_document_cid(value: str) -> bool:
+    """True for the ids /store hands out: a CIDv1 of JSON or a legacy "cid_" id.
+
+    Raw chunks and dag-json nodes written by /store/stream are not JSON documents.
+    """
+    try:
+        codec, _ = decode_cid(value)
+    except ValueError:
+        return False
+    return value.startswith(LEGACY_CID_PREFIX) or codec == CODEC_JSON
+
+
+def verify_cid(cid: str, data: bytes) -> bool:
+    """
+    Check that data is the content addressed by cid.
+
+    Args:
+        cid: CID string, legacy "cid_" ids included.
+        data: Stored bytes.
+
+    Returns:
+        True if the digest of data matches the cid.
+    """
+    try:
+        _, digest = decode_cid(cid)
+    except ValueError:
+        return False
+    return hashlib.sha256(data).digest() == digest
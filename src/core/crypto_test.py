@@ -0,0 +1,51 @@
+"""
+Tests for canonical JSON and CID helpers
+"""
+import hashlib
+import json
+import pytest
+from .crypto import (canonical_json, canonical_json_cid, compute_cid, decode_cid,
+                     iter_canonical_json, is_cid, is_document_cid, verify_cid, CODEC_DAG_JSON,
+                     CODEC_JSON, CODEC_RAW)
+
+def test_canonical_json_ignores_key_order_and_whitespace():
+    assert canonical_json({"b": 1, "a": {"d": [1, 2], "c": "é"}}) == \
+        '{"a":{"c":"é","d":[1,2]},"b":1}'.encode()
+    assert canonical_json({"a": 1, "b": 2}) == canonical_json(json.loads('{ "b": 2,  "a": 1 }'))
+
+def test_canonical_json_rejects_nan():
+    with pytest.raises(ValueError):
+        canonical_json({"a": float("nan")})
+
+def test_canonical_json_cid_matches_one_shot_hash():
+    doc = {"items": [{"i": i, "v": "x" * 100} for i in range(1000)]}
+    cid, data = canonical_json_cid(doc)
+    assert bytes(data) == canonical_json(doc)
+    assert cid == compute_cid(canonical_json(doc), CODEC_JSON)
+    assert cid == compute_cid(iter_canonical_json(doc), CODEC_JSON)
+    assert cid.startswith("bagaaiera")
+
+def test_decode_cid_round_trip():
+    data = b"hello"
+    codec, digest = decode_cid(compute_cid(data))
+    assert codec == CODEC_RAW
+    assert digest == hashlib.sha256(data).digest()
+    assert verify_cid(compute_cid(data), data)
+    assert not verify_cid(compute_cid(data), b"other")
+
+def test_legacy_cids():
+    data = b'{"a": 1}'
+    legacy = "cid_" + hashlib.sha256(data).hexdigest()
+    assert is_cid(legacy)
+    assert verify_cid(legacy, data)
+    assert not is_cid("cid_abc")
+    assert not is_cid("claim_123")
+    assert not is_cid("b" + "a" * 10)
+
+def test_document_cids():
+    data = b'{"a": 1}'
+    assert is_document_cid(canonical_json_cid({"a": 1})[0])
+    assert is_document_cid("cid_" + hashlib.sha256(data).hexdigest())
+    assert not is_document_cid(compute_cid(data))
+    assert not is_document_cid(compute_cid(data, CODEC_DAG_JSON))
+    assert not is_document_cid("settings.txt")
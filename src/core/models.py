@@ -6,7 +6,7 @@ from datetime import datetime
 from typing import Optional, Dict, Any, List, cast
 from pydantic import BaseModel, ConfigDict, Field
 from .crypto import hexhash
-from .constants import ContentType
+from .constants import ContentType, BATCHMAXITEMS
 
 
 # ---------- DID Registry Service Models ----------
@@ -37,6 +37,37 @@ class DIDRegistryResolveResponse(BaseModel):
     status: str  # 'found', 'not_found', 'revoked'
     last_updated: Optional[datetime] = None
 
+class DIDRegistryRegisterBatchRequest(BaseModel):
+    """Many DID -> CID registrations committed in one transaction"""
+    items: List[DIDRegistryRegisterRequest] = Field(..., max_length=BATCHMAXITEMS)
+
+class DIDRegistryRegisterBatchResponse(BaseModel):
+    """One result per registration, in request order"""
+    results: List[DIDRegistryRegisterResponse] = Field(default_factory=list)
+    succeeded: int = 0
+    failed: int = 0
+
+class DIDRegistryResolveBatchRequest(BaseModel):
+    """Many DIDs resolved in one read transaction"""
+    dids: List[str] = Field(..., max_length=BATCHMAXITEMS)
+
+class DIDRegistryResolveBatchResponse(BaseModel):
+    """One result per DID, in request order"""
+    results: List[DIDRegistryResolveResponse] = Field(default_factory=list)
+    found: int = 0
+
+class DIDRegistryEntry(BaseModel):
+    """A single key of the registry and its CID"""
+    did: str
+    doc_cid: Optional[str] = None  # None when listing keys only
+
+class DIDRegistryListResponse(BaseModel):
+    """Page of registry keys sharing a prefix"""
+    prefix: str
+    entries: List[DIDRegistryEntry] = Field(default_factory=list)
+    # pass as `after` to fetch the next page, None on the last page
+    next: Optional[str] = None
+
 # ---------- IPFS Gateway Service Models ----------
 class IPFSStoreRequest(BaseModel):
     """Request to store a DID Document on the mock IPFS"""
@@ -50,6 +81,7 @@ class IPFSStoreResponse(BaseModel):
     cid: str
     size_bytes: int
     stored_at: datetime = Field(default_factory=datetime.now)
+    deduplicated: bool = False  # True if the same content was already stored
 
 class IPFSRetrieveRequest(BaseModel):
     """Request to retrieve a document by CID"""
@@ -62,6 +94,24 @@ class IPFSRetrieveResponse(BaseModel):
     retrieved_at: datetime = Field(default_factory=datetime.now)
     exists: bool = True  # False if CID not found
 
+class IPFSStoreBatchRequest(BaseModel):
+    """Many documents stored in one request"""
+    documents: List[Dict[str, Any]] = Field(..., max_length=BATCHMAXITEMS)
+
+class IPFSStoreBatchResponse(BaseModel):
+    """One result per document, in request order"""
+    results: List[IPFSStoreResponse] = Field(default_factory=list)
+    deduplicated: int = 0  # documents that were already stored
+
+class IPFSRetrieveBatchRequest(BaseModel):
+    """Many documents retrieved in one request"""
+    cids: List[str] = Field(..., max_length=BATCHMAXITEMS)
+
+class IPFSRetrieveBatchResponse(BaseModel):
+    """One result per CID, in request order, `exists` is False for unknown CIDs"""
+    results: List[IPFSRetrieveResponse] = Field(default_factory=list)
+    found: int = 0
+
 # ---------- DID Resolver Service Models ----------
 class DIDResolveRequest(BaseModel):
     """Main request to resolve a DID"""
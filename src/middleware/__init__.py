@@ -2,8 +2,18 @@
 Bridge frontend to backend
 """
 
-from .middleware import register, store, resolve, health, retrieve, requests
-from .claim_utils import pin_claim, create_claim, sign_claim, store_claim
+from .middleware import (register, store, resolve, health, retrieve, store_batch,
+                         retrieve_batch, requests, MiddlewareClient, default_client,
+                         set_default_client, CircuitOpenError)
+from .async_middleware import (aregister, aresolve, astore, aretrieve, astore_batch,
+                               aretrieve_batch, ahealth, AsyncMiddlewareClient,
+                               default_async_client, set_default_async_client)
+from .cache import ContentCache, ResolveCache
+from .endpoints import EndpointPool
+from .inprocess import InProcessClient, AsyncInProcessClient
+from .resilience import Backoff, Resilience
+from .singleflight import SingleFlight, AsyncSingleFlight
+from .claim_utils import pin_claim, create_claim, sign_claim, store_claim, store_claims
 
 __all__ = [
     "register",
@@ -11,9 +21,35 @@ __all__ = [
     "resolve",
     "health",
     "retrieve",
+    "store_batch",
+    "retrieve_batch",
+    "MiddlewareClient",
+    "default_client",
+    "set_default_client",
+    "CircuitOpenError",
+    "aregister",
+    "aresolve",
+    "astore",
+    "aretrieve",
+    "astore_batch",
+    "aretrieve_batch",
+    "ahealth",
+    "AsyncMiddlewareClient",
+    "default_async_client",
+    "set_default_async_client",
+    "ContentCache",
+    "ResolveCache",
+    "EndpointPool",
+    "InProcessClient",
+    "AsyncInProcessClient",
+    "Backoff",
+    "Resilience",
+    "SingleFlight",
+    "AsyncSingleFlight",
     "pin_claim",
     "create_claim",
     "sign_claim",
     "store_claim",
+    "store_claims",
     "requests"
 ]
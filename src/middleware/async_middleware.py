@@ -0,0 +1,330 @@
+"""
+Asyncio counterpart of the middleware API over a pooled httpx.AsyncClient
+
+Coroutines never block the event loop, so an async service (the verifier) can keep
+many lookups in flight at once.
+"""
+import asyncio
+import json
+import logging
+import time
+import weakref
+from typing import Awaitable, Callable, Optional, Sequence, Union
+import httpx
+from pydantic import BaseModel
+from src.core.models import (
+    DIDRegistryRegisterRequest,
+    DIDRegistryRegisterResponse,
+    DIDRegistryResolveResponse,
+    IPFSStoreResponse,
+    IPFSRetrieveResponse,
+    IPFSStoreBatchResponse,
+    IPFSRetrieveBatchRequest,
+    IPFSRetrieveBatchResponse
+)
+from src.core.constants import STORAGEBALANCE, STORAGETRANSPORT
+from .cache import ContentCache, ResolveCache
+from .endpoints import Endpoint, HEALTH_INTERVAL
+from .inprocess import AsyncInProcessClient
+from .resilience import Resilience
+from .singleflight import AsyncSingleFlight
+from .middleware import (_ClientBase, _JSON, _store_body, _store_batch_body, MiddlewareError,
+                         DEFAULT_TIMEOUT, DEFAULT_RETRIES, CONNECT_TIMEOUT, POOL_MAXSIZE)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMiddlewareClient(_ClientBase):
+    """Async client for the registry/IPFS services, one keep-alive pool per client.
+
+    httpx pools belong to the event loop they were first used on: use a client
+    from one loop only, `default_async_client` keeps one per loop.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, timeout: float = DEFAULT_TIMEOUT,
+                 connect_timeout: float = CONNECT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 max_connections: int = POOL_MAXSIZE,
+                 max_keepalive: Optional[int] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None, cache: bool = True,
+                 content_cache: Optional[ContentCache] = None,
+                 resolve_cache: Optional[ResolveCache] = None, singleflight: bool = True,
+                 resilience: Optional[Resilience] = None,
+                 replicas: Optional[Sequence[str]] = None, balance: str = STORAGEBALANCE,
+                 health_interval: Optional[float] = HEALTH_INTERVAL):
+        """
+        :param base_url: scheme://host:port of the primary storage service, taking the
+                         writes, from constants by default
+        :param timeout: read timeout in seconds, per call unless overridden
+        :param connect_timeout: seconds to establish a connection
+        :param retries: attempts per call
+        :param max_connections: connections open at once, further calls wait for one
+        :param max_keepalive: idle connections kept, max_connections by default
+        :param transport: httpx transport, the network by default
+        :param cache: cache retrieved documents and resolutions
+        :param content_cache: document cache to use, a memory ContentCache by default
+        :param resolve_cache: resolution cache to use, a ResolveCache by default
+        :param singleflight: concurrent identical resolve/retrieve calls share one request
+        :param resilience: backoff, circuit breaker and hedging policy, defaults when None
+        :param replicas: further endpoints serving reads, from constants with the default
+                         base_url
+        :param balance: how reads are spread, "round_robin" or "least_outstanding"
+        :param health_interval: seconds between /health checks ejecting failing
+                                endpoints from reads, None to only check on demand;
+                                the checks run on the loop of the first call
+        """
+        super().__init__(base_url, timeout, connect_timeout, retries, cache,
+                         content_cache, resolve_cache, resilience, replicas, balance,
+                         health_interval)
+        self._checker: Optional[asyncio.Task] = None
+        self.flights = AsyncSingleFlight() if singleflight else None
+        limits = httpx.Limits(max_connections=max_connections,
+                              max_keepalive_connections=max_keepalive or max_connections)
+        self.http = httpx.AsyncClient(limits=limits, transport=transport,
+                                      timeout=httpx.Timeout(timeout, connect=connect_timeout))
+
+    def _timeouts(self, timeout: Optional[float]) -> httpx.Timeout:
+        return httpx.Timeout(self._read_timeout(timeout), connect=self.connect_timeout)
+
+    async def _single(self, key: tuple[str, str], fetch):
+        if self.flights is None:
+            return await fetch()
+        result, shared = await self.flights.do(key, fetch)
+        # waiters get their own copy, the first caller keeps the original
+        return result.model_copy(deep=True) if shared else result
+
+    async def _send(self, url: str,
+                    send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """One request through the circuit breaker of url's endpoint."""
+        with self._guarded(url, httpx.HTTPError) as breaker:
+            resp = await send()
+        self._record(breaker, resp.status_code)
+        return resp
+
+    async def _timed(self, route: str,
+                     send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        start = time.perf_counter()
+        return self._observed(route, start, await send())
+
+    async def _hedged(self, route: str,
+                      send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Send, and once more if no answer came within the route's hedge delay.
+
+        The first successful response wins, the other request is cancelled.
+        """
+        delay = self.resilience.hedge_delay(route)
+        if delay is None:
+            return await self._timed(route, send)
+        first = asyncio.ensure_future(self._timed(route, send))
+        second = None
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result()
+            self.resilience.hedge_sent()
+            second = asyncio.ensure_future(self._timed(route, send))
+            pending = {first, second}
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.resilience.hedge_won()
+                        return task.result()
+            return first.result()
+        finally:
+            for task in (first, second):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def _start_checker(self):
+        if self.health_interval and self._checker is None:
+            self._checker = asyncio.get_running_loop().create_task(self._check_loop())
+
+    async def _post(self, key: str, payload: bytes, timeout: Optional[float] = None,
+                    read: bool = False) -> bytes:
+        """POST to the primary, with `read` to any healthy endpoint, returns the body"""
+        return await self._request(key, payload=payload, timeout=timeout, read=read)
+
+    async def _get(self, key: str, val: Optional[str] = None,
+                   timeout: Optional[float] = None, conditional: bool = False,
+                   hedge: bool = False, read: bool = False) -> bytes:
+        """GET from the primary, with `read` from any healthy endpoint, returns the body.
+
+        With `conditional` revalidate the last body seen through If-None-Match, with
+        `hedge` record the latency of the route and hedge slow calls.
+        """
+        return await self._request(key, val, timeout=timeout, conditional=conditional,
+                                   hedge=hedge, read=read)
+
+    async def _request(self, key: str, val: Optional[str] = None,
+                       payload: Optional[bytes] = None, timeout: Optional[float] = None,
+                       conditional: bool = False, hedge: bool = False,
+                       read: bool = False) -> bytes:
+        """GET, or POST payload, retried with backoff, returns the body"""
+        self._start_checker()
+        method = "GET" if payload is None else "POST"
+        path, headers, cached = self._prepare(key, val, payload, conditional)
+
+        async def send():
+            with self._on_endpoint(read, path) as url:
+                return await self._send(url, lambda: self._http(url, payload, headers, timeout))
+        for attempt in range(1, self.retries + 1):
+            logger.debug("%s %s attempt %d", method, path, attempt)
+            try:
+                resp = await (self._hedged(key, send) if hedge else send())
+                return self._body(resp, path, cached, conditional)
+            except httpx.HTTPError as e:
+                await asyncio.sleep(self._retry_delay(method, path, attempt, e))
+        raise MiddlewareError(f"{method} {path} not sent, retries is {self.retries}")
+
+    def _http(self, url: str, payload: Optional[bytes], headers: dict,
+              timeout: Optional[float]) -> Awaitable[httpx.Response]:
+        if payload is None:
+            return self.http.get(url, headers=headers, timeout=self._timeouts(timeout))
+        return self.http.post(url, content=payload, headers=headers,
+                              timeout=self._timeouts(timeout))
+
+    async def _probe(self, endpoint: Endpoint) -> bool:
+        try:
+            resp = await self.http.get(self._url("heal", base=endpoint.url),
+                                       timeout=self._timeouts(self.connect_timeout))
+            return self._health_ok(resp.status_code, resp.json())
+        except (httpx.HTTPError, ValueError):
+            return False
+
+    async def check_health(self) -> dict[str, bool]:
+        """Probe /health on every endpoint, eject failing ones from reads and
+        restore recovered ones."""
+        endpoints = self.endpoints.endpoints
+        results = await asyncio.gather(*(self._probe(e) for e in endpoints))
+        for endpoint, healthy in zip(endpoints, results):
+            self.endpoints.mark(endpoint, healthy)
+        return {e.url: healthy for e, healthy in zip(endpoints, results)}
+
+    async def _check_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_health()
+
+    async def register(self, did: str, cid: str, signature: Optional[str] = None,
+                       timeout: Optional[float] = None) -> DIDRegistryRegisterResponse:
+        """Register a DID -> CID mapping on the registry service."""
+        data = _JSON.dump_json(DIDRegistryRegisterRequest(did=did, doc_cid=cid,
+                                                          signature=signature))
+        try:
+            body = await self._post("reg", data, timeout=timeout)
+        finally:
+            self.invalidate(did)
+        return DIDRegistryRegisterResponse.model_validate_json(body)
+
+    async def resolve(self, did: str,
+                      timeout: Optional[float] = None) -> DIDRegistryResolveResponse:
+        """Resolve a DID to its current CID and metadata, cached for the resolve TTL."""
+        async def fetch():
+            body = await self._get("res", did, timeout=timeout, hedge=True, read=True)
+            return self._resolved(body)
+        cached = self._cached_resolution(did)
+        return cached if cached is not None else await self._single(("res", did), fetch)
+
+    async def store(self, model: Union[BaseModel, dict],
+                    timeout: Optional[float] = None) -> IPFSStoreResponse:
+        """Store a document (DID Document or claim) on the IPFS mock gateway."""
+        body = await self._post("str", _store_body(model), timeout=timeout)
+        return IPFSStoreResponse.model_validate_json(body)
+
+    async def retrieve(self, cid: str, timeout: Optional[float] = None) -> IPFSRetrieveResponse:
+        """Retrieve a stored document by CID, from the content cache when present,
+        revalidated with If-None-Match when seen before."""
+        async def fetch():
+            body = await self._get("ret", cid, timeout=timeout, conditional=True,
+                                   hedge=True, read=True)
+            return self._retrieved(body)
+        cached = self._cached_document(cid)
+        return cached if cached is not None else await self._single(("ret", cid), fetch)
+
+    async def store_batch(self, models: list[Union[BaseModel, dict]],
+                          timeout: Optional[float] = None) -> list[IPFSStoreResponse]:
+        """Store many documents with one request, results are in order."""
+        body = await self._post("strb", _store_batch_body(models), timeout=timeout)
+        return IPFSStoreBatchResponse.model_validate_json(body).results
+
+    async def retrieve_batch(self, cids: list[str],
+                             timeout: Optional[float] = None) -> list[IPFSRetrieveResponse]:
+        """Retrieve many documents with one request, results are in order."""
+        payload = _JSON.dump_json(IPFSRetrieveBatchRequest(cids=cids))
+        body = await self._post("retb", payload, timeout=timeout, read=True)
+        return IPFSRetrieveBatchResponse.model_validate_json(body).results
+
+    async def health(self, timeout: Optional[float] = None) -> bool:
+        """Checks the Health of backend"""
+        return json.loads(await self._get("heal", timeout=timeout))["status"] == 200
+
+    async def aclose(self):
+        """Close the pooled connections"""
+        if self._checker is not None:
+            self._checker.cancel()
+            self._checker = None
+        await self.http.aclose()
+
+
+AnyAsyncClient = Union[AsyncMiddlewareClient, AsyncInProcessClient]
+_defaults: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AnyAsyncClient]" = \
+    weakref.WeakKeyDictionary()
+
+
+def default_async_client() -> AnyAsyncClient:
+    """The client of the running event loop used by the module level coroutines,
+    in-process when STORAGETRANSPORT is "inprocess"."""
+    loop = asyncio.get_running_loop()
+    client = _defaults.get(loop)
+    if client is None:
+        client = _defaults[loop] = AsyncInProcessClient() if STORAGETRANSPORT == "inprocess" \
+            else AsyncMiddlewareClient()
+    return client
+
+
+def set_default_async_client(client: AnyAsyncClient) -> Optional[AnyAsyncClient]:
+    """Replace the running loop's default client, returns the previous one."""
+    loop = asyncio.get_running_loop()
+    previous = _defaults.get(loop)
+    _defaults[loop] = client
+    return previous
+
+
+async def aregister(did: str, cid: str, signature: Optional[str] = None,
+                    timeout: float = DEFAULT_TIMEOUT) -> DIDRegistryRegisterResponse:
+    """Async `register`."""
+    return await default_async_client().register(did, cid, signature=signature, timeout=timeout)
+
+
+async def aresolve(did: str, timeout: float = DEFAULT_TIMEOUT) -> DIDRegistryResolveResponse:
+    """Async `resolve`."""
+    return await default_async_client().resolve(did, timeout=timeout)
+
+
+async def astore(model: Union[BaseModel, dict],
+                 timeout: float = DEFAULT_TIMEOUT) -> IPFSStoreResponse:
+    """Async `store`."""
+    return await default_async_client().store(model, timeout=timeout)
+
+
+async def aretrieve(cid: str, timeout: float = DEFAULT_TIMEOUT) -> IPFSRetrieveResponse:
+    """Async `retrieve`."""
+    return await default_async_client().retrieve(cid, timeout=timeout)
+
+
+async def astore_batch(models: list[Union[BaseModel, dict]],
+                       timeout: float = DEFAULT_TIMEOUT) -> list[IPFSStoreResponse]:
+    """Async `store_batch`."""
+    return await default_async_client().store_batch(models, timeout=timeout)
+
+
+async def aretrieve_batch(cids: list[str],
+                          timeout: float = DEFAULT_TIMEOUT) -> list[IPFSRetrieveResponse]:
+    """Async `retrieve_batch`."""
+    return await default_async_client().retrieve_batch(cids, timeout=timeout)
+
+
+async def ahealth(timeout: float = DEFAULT_TIMEOUT) -> bool:
+    """Async `health`."""
+    return await default_async_client().health(timeout=timeout)
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import httpx
+import pytest
+
+from .async_middleware import (AsyncMiddlewareClient, aresolve, aretrieve, astore,
+                               default_async_client, set_default_async_client)
+from .middleware import CircuitOpenError, MiddlewareError
+from .resilience import Backoff, Resilience
+from src.core.models import DIDRegistryResolveResponse, IPFSStoreResponse
+
+
+def _client(handler, **kwargs):
+    return AsyncMiddlewareClient(base_url="http://storage", retries=2,
+                                 transport=httpx.MockTransport(handler), **kwargs)
+
+
+def test_store_resolve_retrieve():
+    doc = {"cid": "cid-a", "document": {"foo": "bar"}, "exists": True}
+
+    def handler(request):
+        if request.method == "POST":
+            assert json.loads(request.content)["document"] == {"foo": "bar"}
+            return httpx.Response(200, json={"cid": "cid-a", "size_bytes": 13})
+        if request.url.path.startswith("/resolve/"):
+            return httpx.Response(200, json={"did": "did:x", "doc_cid": "cid-a",
+                                             "status": "success"})
+        return httpx.Response(200, json=doc)
+
+    async def run():
+        set_default_async_client(_client(handler))
+        stored = await astore({"foo": "bar"})
+        resolved = await aresolve("did:x")
+        retrieved = await aretrieve(resolved.doc_cid)
+        await default_async_client().aclose()
+        return stored, resolved, retrieved
+
+    stored, resolved, retrieved = asyncio.run(run())
+    assert isinstance(stored, IPFSStoreResponse) and stored.cid == "cid-a"
+    assert isinstance(resolved, DIDRegistryResolveResponse)
+    assert retrieved.document == {"foo": "bar"}
+
+
+def test_retrieve_revalidates_with_etag():
+    sent = []
+    body = {"cid": "cid-e", "document": {"a": 1}, "retrieved_at": "2025-01-01T00:00:00",
+            "exists": True}
+
+    def handler(request):
+        sent.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == 'W/"cid-e"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=body, headers={"ETag": 'W/"cid-e"'})
+
+    async def run():
+        client = _client(handler, cache=False)
+        first = await client.retrieve("cid-e")
+        second = await client.retrieve("cid-e")
+        await client.aclose()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert sent == [None, 'W/"cid-e"']
+    assert first == second
+
+
+def test_failure_raises_after_retries():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url)
+        return httpx.Response(503)
+
+    async def run():
+        client = _client(handler)
+        try:
+            await client.resolve("did:down")
+        finally:
+            await client.aclose()
+
+    with pytest.raises(MiddlewareError):
+        asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_calls_run_concurrently():
+    in_flight = []
+    peak = []
+
+    async def handler(request):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.05)
+        in_flight.pop()
+        return httpx.Response(200, json={"did": "d", "doc_cid": "c", "status": "success"})
+
+    async def run():
+        client = _client(handler)
+        results = await asyncio.gather(*(client.resolve(f"did:{i}") for i in range(20)))
+        await client.aclose()
+        return results
+
+    assert len(asyncio.run(run())) == 20
+    assert max(peak) == 20
+
+
+def test_retrieve_and_resolve_are_cached():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url.path)
+        if request.url.path.startswith("/resolve/"):
+            return httpx.Response(200, json={"did": "did:x", "doc_cid": "cid-a",
+                                             "status": "success"})
+        return httpx.Response(200, json={"cid": "cid-a", "document": {"a": 1}, "exists": True})
+
+    async def run():
+        client = _client(handler)
+        for _ in range(3):
+            await client.retrieve((await client.resolve("did:x")).doc_cid)
+        await client.aclose()
+        return client.cache_stats()
+
+    stats = asyncio.run(run())
+    assert len(calls) == 2
+    assert stats["content"]["hits"] == 2 and stats["resolve"]["hits"] == 2
+
+
+def test_default_client_is_per_loop():
+    async def get():
+        return default_async_client()
+
+    first = asyncio.run(get())
+    second = asyncio.run(get())
+    assert first is not second
+
+
+def test_concurrent_resolves_share_one_request():
+    sent = []
+
+    async def handler(request):
+        sent.append(request.url.path)
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"did": "did:x", "doc_cid": "cid-a",
+                                         "status": "success"})
+
+    async def run(**kwargs):
+        client = _client(handler, cache=False, **kwargs)
+        results = await asyncio.gather(*(client.resolve("did:x") for _ in range(50)))
+        stats = client.flight_stats()
+        await client.aclose()
+        return results, stats
+
+    results, stats = asyncio.run(run())
+    assert len(sent) == 1
+    assert all(r.doc_cid == "cid-a" for r in results)
+    assert len({id(r) for r in results}) == 50
+    assert stats == {"calls": 50, "executions": 1, "collapsed": 49}
+
+    sent.clear()
+    results, stats = asyncio.run(run(singleflight=False))
+    assert len(sent) == 50 and stats is None
+
+
+def test_concurrent_retrieves_get_their_own_documents():
+    async def handler(request):
+        await asyncio.sleep(0.05)
+        return httpx.Response(200, json={"cid": "cid-s", "document": {"a": {"b": 1}},
+                                         "retrieved_at": "2025-01-01T00:00:00",
+                                         "exists": True})
+
+    async def run():
+        client = _client(handler, cache=False)
+        results = await asyncio.gather(*(client.retrieve("cid-s") for _ in range(5)))
+        await client.aclose()
+        return results
+
+    results = asyncio.run(run())
+    results[0].document["a"]["b"] = 2
+    assert all(r.document == {"a": {"b": 1}} for r in results[1:])
+
+
+def test_circuit_opens_and_fails_fast():
+    calls = []
+
+    def handler(request):
+        calls.append(request.url)
+        raise httpx.ConnectError("refused", request=request)
+
+    async def run():
+        policy = Resilience(backoff=Backoff(base=0), breaker_failures=2, breaker_reset=60)
+        client = _client(handler, cache=False, resilience=policy)
+        with pytest.raises(MiddlewareError):
+            await client.resolve("did:a")
+        with pytest.raises(CircuitOpenError):
+            await client.retrieve("cid-a")
+        await client.aclose()
+
+    asyncio.run(run())
+    assert len(calls) == 2
+
+
+def test_slow_read_is_hedged_and_loser_cancelled():
+    sent = []
+    cancelled = []
+
+    async def handler(request):
+        sent.append(request.url.path)
+        if len(sent) == 1:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+        return httpx.Response(200, json={"did": "did:h", "doc_cid": "cid-h",
+                                         "status": "success"})
+
+    async def run():
+        policy = Resilience(hedge_percentile=95, latency_min_samples=5)
+        for _ in range(5):
+            policy.observe("res", 0.01)
+        client = _client(handler, cache=False, resilience=policy)
+        resp = await asyncio.wait_for(client.resolve("did:h"), 1)
+        await asyncio.sleep(0)
+        stats = client.resilience_stats()
+        await client.aclose()
+        return resp, stats
+
+    resp, stats = asyncio.run(run())
+    assert resp.doc_cid == "cid-h" and len(sent) == 2 and cancelled == [1]
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+    # the cancelled loser is not a failure of the node
+    assert stats["breakers"]["http://storage"]["consecutive_failures"] == 0
+
+
+def test_reads_spread_over_replicas_and_unhealthy_are_ejected():
+    seen = []
+
+    def handler(request):
+        seen.append((request.method, request.url.host))
+        if request.url.path == "/health":
+            return httpx.Response(200 if request.url.host == "primary" else 503,
+                                  json={"status": 200})
+        if request.method == "POST":
+            return httpx.Response(200, json={"cid": "cid-r", "size_bytes": 1})
+        return httpx.Response(200, json={"did": "did:r", "doc_cid": "cid-r",
+                                         "status": "success"})
+
+    async def run():
+        client = AsyncMiddlewareClient(base_url="http://primary", replicas=["http://replica"],
+                                       cache=False, singleflight=False, health_interval=None,
+                                       transport=httpx.MockTransport(handler))
+        await asyncio.gather(*(client.resolve("did:r") for _ in range(4)))
+        await client.store({"a": 1})
+        spread = list(seen)
+        health = await client.check_health()
+        seen.clear()
+        await client.resolve("did:r")
+        await client.resolve("did:r")
+        await client.aclose()
+        return spread, health
+
+    spread, health = asyncio.run(run())
+    assert sorted(spread) == [("GET", "primary")] * 2 + [("GET", "replica")] * 2 + \
+        [("POST", "primary")]
+    assert health == {"http://primary": True, "http://replica": False}
+    assert seen == [("GET", "primary")] * 2
@@ -0,0 +1,191 @@
+"""
+Client side caches for the middleware clients
+
+CID content never changes, it is kept in a byte capped LRU (optionally backed by a
+directory so it survives restarts). DID -> CID mappings can change, they are kept
+for a short TTL and dropped when the client registers a new mapping.
+"""
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+from src.core.models import DIDRegistryResolveResponse
+
+CONTENT_CACHE_BYTES = 64 * 1024 * 1024
+RESOLVE_TTL = 10.0
+RESOLVE_CACHE_ENTRIES = 10_000
+
+
+def _hit_rate(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+class ContentCache:
+    """Size capped LRU of retrieve responses (JSON bytes) by CID.
+
+    With `path`, entries are also written to that directory and read back on a
+    memory miss. The directory is not size capped: content is immutable and
+    only ever grows by what this client retrieved.
+    """
+
+    def __init__(self, max_bytes: int = CONTENT_CACHE_BYTES, path: Optional[str] = None):
+        """
+        :param max_bytes: memory budget for cached bodies
+        :param path: directory persisting the cache, memory only when None
+        """
+        self.max_bytes = max_bytes
+        self.path = path
+        self.size_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: OrderedDict[str, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def _file(self, cid: str) -> Optional[str]:
+        # CIDs come from callers, never let one escape the directory
+        if not self.path:
+            return None
+        if not cid or cid.startswith(".") or os.sep in cid or (os.altsep and os.altsep in cid):
+            return None
+        return os.path.join(self.path, cid)
+
+    def get(self, cid: str) -> Optional[bytes]:
+        """The cached body of cid, None when not cached."""
+        with self._lock:
+            data = self._data.get(cid)
+            if data is not None:
+                self._data.move_to_end(cid)
+                self.hits += 1
+                return data
+        path = self._file(cid)
+        if path is not None:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._insert(cid, data)
+                return data
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, cid: str, data: bytes):
+        """Cache the body of cid, persisted when the cache has a path."""
+        with self._lock:
+            self._insert(cid, data)
+        path = self._file(cid)
+        if path is not None and not os.path.exists(path):
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    def _insert(self, cid: str, data: bytes):
+        if len(data) > self.max_bytes:
+            return
+        old = self._data.pop(cid, None)
+        if old is not None:
+            self.size_bytes -= len(old)
+        self._data[cid] = data
+        self.size_bytes += len(data)
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.size_bytes -= len(evicted)
+            self.evictions += 1
+
+    def discard(self, cid: str):
+        """Drop cid from memory and disk."""
+        with self._lock:
+            old = self._data.pop(cid, None)
+            if old is not None:
+                self.size_bytes -= len(old)
+        path = self._file(cid)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def clear(self):
+        """Drop every in-memory entry, persisted files are kept."""
+        with self._lock:
+            self._data.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> dict:
+        """Counters and occupancy."""
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self.size_bytes,
+                    "max_bytes": self.max_bytes, "hits": self.hits,
+                    "disk_hits": self.disk_hits, "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": _hit_rate(self.hits + self.disk_hits, self.misses)}
+
+
+class ResolveCache:
+    """DID -> resolve response for `ttl` seconds, only successful resolutions are kept."""
+
+    def __init__(self, ttl: float = RESOLVE_TTL, max_entries: int = RESOLVE_CACHE_ENTRIES,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param ttl: seconds an entry is served before asking the registry again
+        :param max_entries: oldest entries are dropped beyond this count
+        :param clock: time source, for tests
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.invalidations = 0
+        self._data: OrderedDict[str, tuple[float, DIDRegistryResolveResponse]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, did: str) -> Optional[DIDRegistryResolveResponse]:
+        """A copy of the cached response for did, None when absent or expired."""
+        with self._lock:
+            entry = self._data.get(did)
+            if entry is not None and entry[0] <= self.clock():
+                del self._data[did]
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[1].model_copy(deep=True)
+
+    def set(self, did: str, resp: DIDRegistryResolveResponse):
+        """Cache a resolution, ignored unless it found a CID."""
+        if resp.status != "success" or not resp.doc_cid:
+            return
+        with self._lock:
+            self._data.pop(did, None)
+            self._data[did] = (self.clock() + self.ttl, resp.model_copy(deep=True))
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, did: Optional[str] = None):
+        """Forget did, or every DID when None."""
+        with self._lock:
+            if did is None:
+                self.invalidations += len(self._data)
+                self._data.clear()
+            elif self._data.pop(did, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        """Counters and occupancy."""
+        with self._lock:
+            return {"entries": len(self._data), "ttl": self.ttl, "hits": self.hits,
+                    "misses": self.misses, "expired": self.expired,
+                    "invalidations": self.invalidations,
+                    "hit_rate": _hit_rate(self.hits, self.misses)}
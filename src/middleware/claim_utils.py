@@ -4,10 +4,10 @@ Utilities to handle claims
 import os
 import mimetypes
 from datetime import datetime
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 from src.core.models import VerityClaim, ContentType
-from src.core.crypto import hexhash, sign
-from .middleware import register, store
+from src.core.crypto import hexhash, sign, canonical_json
+from .middleware import register, store, store_batch
 
 class ClaimError(Exception):
     """
@@ -117,8 +117,19 @@ def _create_claim_from_message(message: str, issuer_did: str) -> VerityClaim:
     return claim
 
 
+def _canonicalize(claim: VerityClaim) -> VerityClaim:
+    """A copy of claim whose nested dicts have the key order the gateway stores
+    them with (sorted).
+
+    The verifier re-serializes the retrieved claim to check the signature,
+    the signed payload has to match what comes back from storage.
+    """
+    return VerityClaim.model_validate_json(canonical_json(claim.model_dump(mode="json")))
+
 def sign_claim(claim: VerityClaim, priv_key_hex: str) -> VerityClaim:
-    """Sign the claim using the provided private key hex string and attach proof."""
+    """Sign a copy of the claim using the provided private key hex string and attach proof,
+    the claim passed in is left untouched."""
+    claim = _canonicalize(claim)
     # Serialize claim deterministically
     payload = claim.model_dump_json()
     signature = sign(priv_key_hex, payload)
@@ -138,6 +149,10 @@ def store_claim(claim: VerityClaim):
     resp = store(claim)
     return resp.cid
 
+def store_claims(claims: List[VerityClaim]) -> List[str]:
+    """Store many claims with one middleware.store_batch call, CIDs are returned in order."""
+    return [resp.cid for resp in store_batch(claims)]
+
 def pin_claim(claim_id, cid):
     """map a claim id to cid """
     resp = register(claim_id, cid)
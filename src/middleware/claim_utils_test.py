@@ -0,0 +1,30 @@
+import json
+from fastapi.encoders import jsonable_encoder
+from src.core.crypto import canonical_json_cid, create_ethereum_account, verify
+from src.core.models import VerityClaim
+from .claim_utils import create_claim, sign_claim
+
+
+def test_signature_survives_canonical_storage():
+    account = create_ethereum_account()
+    claim = sign_claim(create_claim(issuer_did="did:verity:test", message="hello"),
+                       account.key.hex())
+    signature = claim.proof["proofValue"]
+    # what /store keeps and /retrieve hands back to the verifier
+    _, stored = canonical_json_cid(jsonable_encoder(claim.model_dump()))
+    retrieved = VerityClaim.model_validate(json.loads(stored))
+    retrieved.proof = None
+    retrieved.verification_url = None
+    assert verify(account.address, signature, retrieved.model_dump_json())
+
+
+def test_sign_claim_leaves_the_claim_passed_in_untouched():
+    account = create_ethereum_account()
+    claim = create_claim(issuer_did="did:verity:test", message="hello")
+    claim.credential_subject = {"text": "hello", "type": "Message"}
+    before = claim.model_dump()
+    signed = sign_claim(claim, account.key.hex())
+    assert signed is not claim
+    assert signed.proof and claim.proof is None
+    assert claim.model_dump() == before
+    assert list(claim.credential_subject) == ["text", "type"]
@@ -0,0 +1,117 @@
+"""
+Storage endpoints of a middleware client: one primary and optional read replicas
+
+Writes (register, store) always go to the primary. Reads (resolve, retrieve) are
+spread over every endpoint, round robin or to the one with the fewest requests in
+flight. An endpoint whose /health check fails is ejected from reads until a later
+check passes; the primary keeps taking writes regardless, there is nowhere else
+to send them.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN = "round_robin"
+LEAST_OUTSTANDING = "least_outstanding"
+BALANCE_STRATEGIES = (ROUND_ROBIN, LEAST_OUTSTANDING)
+# seconds between background /health checks, None disables them
+HEALTH_INTERVAL = 5.0
+
+
+class Endpoint:
+    """One storage process, scheme://host:port."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = True
+        self.outstanding = 0
+        self.requests = 0
+        self.ejections = 0
+
+    def stats(self) -> dict:
+        """Health and request counters of the endpoint."""
+        return {"healthy": self.healthy, "outstanding": self.outstanding,
+                "requests": self.requests, "ejections": self.ejections}
+
+
+class EndpointPool:
+    """Thread safe choice of the endpoint serving each request."""
+
+    def __init__(self, primary: str, replicas: Sequence[str] = (),
+                 balance: str = ROUND_ROBIN):
+        """
+        :param primary: scheme://host:port taking writes, reads too
+        :param replicas: further endpoints serving reads
+        :param balance: ROUND_ROBIN or LEAST_OUTSTANDING
+        """
+        if balance not in BALANCE_STRATEGIES:
+            raise ValueError(f"Unknown balance strategy: {balance}")
+        self.balance = balance
+        self.primary = Endpoint(primary)
+        self.endpoints = [self.primary]
+        for url in replicas:
+            if url.rstrip("/") not in (e.url for e in self.endpoints):
+                self.endpoints.append(Endpoint(url))
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.endpoints)
+
+    def pick(self, usable: Optional[Callable[[str], bool]] = None) -> Endpoint:
+        """The endpoint for the next read.
+
+        Healthy endpoints that `usable` accepts (e.g. whose circuit is closed) are
+        preferred, then healthy ones, then any: a read on a suspect node beats no read.
+        """
+        if len(self.endpoints) == 1:
+            return self.primary
+        with self._lock:
+            candidates = [e for e in self.endpoints
+                          if e.healthy and (usable is None or usable(e.url))]
+            candidates = candidates or [e for e in self.endpoints if e.healthy] \
+                or self.endpoints
+            n = len(self.endpoints)
+            # candidates in turn order, starting after the last endpoint picked
+            ordered = sorted(candidates,
+                             key=lambda e: (self.endpoints.index(e) - self._next) % n)
+            if self.balance == LEAST_OUTSTANDING:
+                choice = min(ordered, key=lambda e: e.outstanding)
+            else:
+                choice = ordered[0]
+            self._next = (self.endpoints.index(choice) + 1) % n
+            return choice
+
+    @contextmanager
+    def track(self, endpoint: Endpoint) -> Iterator[Endpoint]:
+        """Count a request in flight on endpoint for the duration of the block."""
+        with self._lock:
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+        try:
+            yield endpoint
+        finally:
+            with self._lock:
+                endpoint.outstanding -= 1
+
+    def mark(self, endpoint: Endpoint, healthy: bool):
+        """Record the outcome of a health check, ejecting or restoring endpoint."""
+        with self._lock:
+            if endpoint.healthy == healthy:
+                return
+            endpoint.healthy = healthy
+            if not healthy:
+                endpoint.ejections += 1
+        if healthy:
+            logger.info("Storage endpoint %s restored", endpoint.url)
+        else:
+            logger.warning("Storage endpoint %s ejected, health check failed", endpoint.url)
+
+    def stats(self) -> dict:
+        """Counters of every endpoint by url, flagging the primary."""
+        with self._lock:
+            return {e.url: {**e.stats(), "primary": e is self.primary}
+                    for e in self.endpoints}
@@ -0,0 +1,44 @@
+import pytest
+
+from .endpoints import EndpointPool, LEAST_OUTSTANDING
+
+
+def test_single_endpoint_is_always_the_primary():
+    pool = EndpointPool("http://a:1/")
+    assert pool.pick().url == "http://a:1"
+    assert pool.pick() is pool.primary
+
+
+def test_round_robin_skips_ejected_and_unusable():
+    pool = EndpointPool("http://a:1", ["http://b:1", "http://c:1", "http://a:1"])
+    assert len(pool) == 3
+    assert [pool.pick().url for _ in range(4)] == ["http://a:1", "http://b:1",
+                                                   "http://c:1", "http://a:1"]
+    pool.mark(pool.endpoints[1], False)
+    assert {pool.pick().url for _ in range(4)} == {"http://a:1", "http://c:1"}
+    assert {pool.pick(lambda url: url != "http://c:1").url for _ in range(4)} == {"http://a:1"}
+    # nothing usable: fall back to the healthy ones, then to any
+    assert pool.pick(lambda url: False).healthy
+    for endpoint in pool.endpoints:
+        pool.mark(endpoint, False)
+    assert pool.pick() in pool.endpoints
+    pool.mark(pool.endpoints[1], True)
+    assert pool.pick().url == "http://b:1"
+    assert pool.stats()["http://b:1"]["ejections"] == 1
+
+
+def test_least_outstanding_prefers_idle_endpoints():
+    pool = EndpointPool("http://a:1", ["http://b:1", "http://c:1"], balance=LEAST_OUTSTANDING)
+    with pool.track(pool.pick()) as first, pool.track(pool.pick()) as second:
+        assert first is not second
+        third = pool.pick()
+        assert third not in (first, second)
+        with pool.track(third):
+            assert {first.outstanding, second.outstanding, third.outstanding} == {1}
+    assert all(e.outstanding == 0 for e in pool.endpoints)
+    assert pool.stats()["http://a:1"]["primary"]
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        EndpointPool("http://a:1", balance="random")
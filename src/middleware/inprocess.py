@@ -0,0 +1,144 @@
+"""
+In-process clients for single node deployments
+
+When the storage service's files are local (the storage app runs in this process,
+or in another one on the same box sharing its LMDB files and blob directory),
+these clients call the service's handlers, DB and blob store directly: no HTTP,
+no TCP and no JSON round trip for registry lookups. They answer like the HTTP
+clients and are picked by default_client() / default_async_client() when
+STORAGETRANSPORT is "inprocess".
+"""
+import asyncio
+import json
+from typing import Optional, Union
+from pydantic import BaseModel
+from pydantic_core import to_jsonable_python
+from src.core.crypto import is_document_cid
+from src.core.models import (
+    DIDRegistryRegisterRequest,
+    DIDRegistryRegisterResponse,
+    DIDRegistryRegisterBatchRequest,
+    DIDRegistryResolveResponse,
+    IPFSStoreRequest,
+    IPFSStoreResponse,
+    IPFSRetrieveResponse,
+    IPFSStoreBatchRequest
+)
+
+
+def _storage():
+    # imported on first use: HTTP-only processes never load the service, lmdb included
+    from src.services.storage import main  # pylint: disable=import-outside-toplevel
+    return main
+
+
+def _document(model: Union[BaseModel, dict]) -> dict:
+    # what the service would have parsed out of the HTTP body, so the CID is the same
+    if isinstance(model, BaseModel):
+        model = model.model_dump()
+    return to_jsonable_python(model)
+
+
+def _retrieve(cid: str) -> IPFSRetrieveResponse:
+    # like /retrieve, only JSON documents: not files, chunks or nodes of streamed content
+    data = _storage().get_blobs().get(cid) if is_document_cid(cid) else None
+    if data is None:
+        return IPFSRetrieveResponse(cid=cid, document={"0": ""}, exists=False)
+    return IPFSRetrieveResponse(cid=cid, document=json.loads(data), exists=True)
+
+
+class InProcessClient:
+    """Calls the storage service of this process, same methods as MiddlewareClient.
+
+    `timeout` arguments are accepted for compatibility and ignored.
+    """
+    # calls run in this process, there is no network wait for a timeout to bound
+    # pylint: disable=unused-argument
+
+    def register(self, did: str, cid: str, signature: Optional[str] = None,
+                 timeout: Optional[float] = None) -> DIDRegistryRegisterResponse:
+        """Register a DID -> CID mapping on the registry."""
+        req = DIDRegistryRegisterRequest(did=did, doc_cid=cid, signature=signature)
+        batch = DIDRegistryRegisterBatchRequest(items=[req])
+        return _storage().register_batch(batch).results[0]
+
+    def resolve(self, did: str, timeout: Optional[float] = None) -> DIDRegistryResolveResponse:
+        """Resolve a DID to its current CID."""
+        return _storage().resolve(did)
+
+    def store(self, model: Union[BaseModel, dict],
+              timeout: Optional[float] = None) -> IPFSStoreResponse:
+        """Store a document (DID Document or claim)."""
+        return _storage().store_cid(IPFSStoreRequest(document=_document(model)))
+
+    def retrieve(self, cid: str, timeout: Optional[float] = None) -> IPFSRetrieveResponse:
+        """Retrieve a stored document by CID."""
+        return _retrieve(cid)
+
+    def store_batch(self, models: list[Union[BaseModel, dict]],
+                    timeout: Optional[float] = None) -> list[IPFSStoreResponse]:
+        """Store many documents, results are in order."""
+        req = IPFSStoreBatchRequest(documents=[_document(m) for m in models])
+        return _storage().store_batch(req).results
+
+    def retrieve_batch(self, cids: list[str],
+                       timeout: Optional[float] = None) -> list[IPFSRetrieveResponse]:
+        """Retrieve many documents, results are in order."""
+        return [_retrieve(cid) for cid in cids]
+
+    def health(self, timeout: Optional[float] = None) -> bool:
+        """The service is this process, it is up."""
+        return True
+
+    def close(self):
+        """Nothing to close, the service owns its DB and blob store."""
+
+
+class AsyncInProcessClient:
+    """Calls the storage service of this process, same coroutines as AsyncMiddlewareClient.
+
+    Registrations go through the service's group commit; writes and lookups run
+    in a worker thread, a lookup missing the page cache reads LMDB or the blob store
+    from disk and must not stall the event loop. `timeout` arguments are accepted
+    for compatibility and ignored.
+    """
+    # pylint: disable=unused-argument
+
+    async def register(self, did: str, cid: str, signature: Optional[str] = None,
+                       timeout: Optional[float] = None) -> DIDRegistryRegisterResponse:
+        """Register a DID -> CID mapping on the registry."""
+        req = DIDRegistryRegisterRequest(did=did, doc_cid=cid, signature=signature)
+        return await _storage().register(req)
+
+    async def resolve(self, did: str,
+                      timeout: Optional[float] = None) -> DIDRegistryResolveResponse:
+        """Resolve a DID to its current CID."""
+        return await asyncio.to_thread(_storage().resolve, did)
+
+    async def store(self, model: Union[BaseModel, dict],
+                    timeout: Optional[float] = None) -> IPFSStoreResponse:
+        """Store a document (DID Document or claim)."""
+        req = IPFSStoreRequest(document=_document(model))
+        return await asyncio.to_thread(_storage().store_cid, req)
+
+    async def retrieve(self, cid: str, timeout: Optional[float] = None) -> IPFSRetrieveResponse:
+        """Retrieve a stored document by CID."""
+        return await asyncio.to_thread(_retrieve, cid)
+
+    async def store_batch(self, models: list[Union[BaseModel, dict]],
+                          timeout: Optional[float] = None) -> list[IPFSStoreResponse]:
+        """Store many documents, results are in order."""
+        req = IPFSStoreBatchRequest(documents=[_document(m) for m in models])
+        return (await asyncio.to_thread(_storage().store_batch, req)).results
+
+    async def retrieve_batch(self, cids: list[str],
+                             timeout: Optional[float] = None) -> list[IPFSRetrieveResponse]:
+        """Retrieve many documents, results are in order."""
+        return await asyncio.to_thread(lambda: [_retrieve(cid) for cid in cids])
+
+    async def health(self, timeout: Optional[float] = None) -> bool:
+        """The service is this process, it is up."""
+        return True
+
+    async def aclose(self):
+        """Nothing to close, the service owns its DB and blob store."""
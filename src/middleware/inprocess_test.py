@@ -0,0 +1,120 @@
+import asyncio
+import os
+import tempfile
+import threading
+from datetime import datetime, timezone
+import pytest
+from pydantic import BaseModel
+
+from . import async_middleware, middleware
+from .inprocess import AsyncInProcessClient, InProcessClient
+from src.core.models import IPFSStoreRequest
+from src.services.storage import main
+from src.services.storage.blobstore import FileBlobStore
+from src.services.storage.db_lmdb import DB
+
+
+@pytest.fixture(autouse=True)
+def storage(monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "store.db"), index_path=os.path.join(tmpdir, "index.db"))
+        blobs = FileBlobStore(tmpdir)
+        monkeypatch.setattr(main, "get_db", lambda: db)
+        monkeypatch.setattr(main, "get_blobs", lambda: blobs)
+        yield db
+        blobs.close()
+        db.close()
+
+
+class Doc(BaseModel):
+    id: str
+    issued: datetime
+
+
+def test_register_resolve_store_retrieve():
+    client = InProcessClient()
+    doc = Doc(id="did:verity:local", issued=datetime(2025, 1, 1, tzinfo=timezone.utc))
+    stored = client.store(doc)
+    # same CID as the document sent over HTTP
+    over_http = IPFSStoreRequest.model_validate_json(
+        IPFSStoreRequest(document=doc.model_dump()).model_dump_json())
+    assert stored.cid == main.store_cid(over_http).cid
+
+    assert client.register("did:verity:local", stored.cid).status == "success"
+    resolved = client.resolve("did:verity:local")
+    assert resolved.status == "success" and resolved.doc_cid == stored.cid
+    assert client.resolve("did:missing").status == "error"
+
+    retrieved = client.retrieve(stored.cid)
+    assert retrieved.exists and retrieved.document == {"id": "did:verity:local",
+                                                       "issued": "2025-01-01T00:00:00Z"}
+    assert not client.retrieve("bagaaieramissing").exists
+    assert client.health()
+
+
+def test_batches():
+    client = InProcessClient()
+    stored = client.store_batch([{"a": 1}, {"b": 2}, {"a": 1}])
+    assert [s.deduplicated for s in stored] == [False, False, True]
+    retrieved = client.retrieve_batch([stored[1].cid, "cid_missing"])
+    assert retrieved[0].document == {"b": 2} and not retrieved[1].exists
+
+
+def test_async_client():
+    client = AsyncInProcessClient()
+
+    async def run():
+        stored = await client.store({"foo": "bar"})
+        registered = await asyncio.gather(*(client.register(f"did:a:{i}", stored.cid)
+                                            for i in range(5)))
+        resolved = await client.resolve("did:a:3")
+        retrieved = await client.retrieve(resolved.doc_cid)
+        return registered, retrieved
+
+    registered, retrieved = asyncio.run(run())
+    assert all(r.status == "success" for r in registered)
+    assert retrieved.document == {"foo": "bar"}
+
+
+def test_async_lookups_leave_the_event_loop(monkeypatch):
+    threads = []
+    blobs = main.get_blobs()
+    resolve_inline, get_inline = main.resolve, blobs.get
+
+    def resolve(did):
+        threads.append(threading.get_ident())
+        return resolve_inline(did)
+
+    def get(cid):
+        threads.append(threading.get_ident())
+        return get_inline(cid)
+    monkeypatch.setattr(main, "resolve", resolve)
+    monkeypatch.setattr(blobs, "get", get)
+    client = AsyncInProcessClient()
+
+    async def run():
+        stored = await client.store({"foo": "bar"})
+        await client.resolve("did:none")
+        await client.retrieve(stored.cid)
+        await client.retrieve_batch([stored.cid])
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert len(threads) == 3 and loop_thread not in threads
+
+
+def test_transport_is_selected_by_configuration(monkeypatch):
+    monkeypatch.setattr(middleware, "STORAGETRANSPORT", "inprocess")
+    previous = middleware.set_default_client(None)
+    try:
+        assert isinstance(middleware.default_client(), InProcessClient)
+        assert middleware.resolve("did:none").status == "error"
+    finally:
+        middleware.set_default_client(previous)
+
+    monkeypatch.setattr(async_middleware, "STORAGETRANSPORT", "inprocess")
+
+    async def run():
+        return async_middleware.default_async_client()
+
+    assert isinstance(asyncio.run(run()), AsyncInProcessClient)
@@ -1,20 +1,33 @@
 """
 Bridge communication between the frontend and the backend(IFPS+DIDregistry)
 """
+import json
 import logging
+import threading
 import time
-from typing import Optional, Union
-from pydantic import BaseModel
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, Optional, Sequence, Union
+from pydantic import BaseModel, TypeAdapter
 import requests
 from src.core.models import (
     DIDRegistryRegisterRequest,
     DIDRegistryRegisterResponse,
     DIDRegistryResolveResponse,
-    IPFSStoreRequest,
     IPFSStoreResponse,
-    IPFSRetrieveResponse
+    IPFSRetrieveResponse,
+    IPFSStoreBatchResponse,
+    IPFSRetrieveBatchRequest,
+    IPFSRetrieveBatchResponse
 )
-from src.core.constants import HOST, STORAGEPORT
+from src.core.constants import (BATCHMAXITEMS, HOST, STORAGEPORT, STORAGEREPLICAS, STORAGEBALANCE,
+                                STORAGETRANSPORT)
+from .cache import ContentCache, ResolveCache
+from .endpoints import Endpoint, EndpointPool, HEALTH_INTERVAL
+from .inprocess import InProcessClient
+from .resilience import CircuitBreaker, Resilience, OPEN
+from .singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
@@ -24,64 +37,509 @@ _ENDPOINTS = {
     "res": "/resolve/",
     "str": "/store",
     "ret": "/retrieve/",
+    "strb": "/store/batch",
+    "retb": "/retrieve/batch",
     "heal":"/health"
 }
 
 # sensible defaults
 DEFAULT_TIMEOUT = 5.0
 DEFAULT_RETRIES = 2
+CONNECT_TIMEOUT = 2.0
+# keep-alive pools: hosts with a pool, connections kept per host
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 32
+# conditional GETs: url -> (ETag, body) of the last responses that carried an ETag,
+# bounded by entries and by the bytes of the bodies
+ETAG_CACHE_SIZE = 256
+ETAG_CACHE_BYTES = 8 * 1024 * 1024
+
+
+# request bodies are serialized once, straight to bytes, models and dicts alike
+_JSON = TypeAdapter(Any)
+# JSON of the IPFSStoreRequest.content_type default, middleware_test checks they agree
+_STORE_CONTENT_TYPE = b'"application/did+json"'
+
+
+def _store_body(model: Union[BaseModel, dict]) -> bytes:
+    """IPFSStoreRequest JSON built around the document's JSON, without dumping the
+    model to a dict and validating it into the request first."""
+    return b"".join((b'{"document":', _JSON.dump_json(model), b',"content_type":',
+                     _STORE_CONTENT_TYPE, b"}"))
+
+
+def _store_batch_body(models: list[Union[BaseModel, dict]]) -> bytes:
+    """IPFSStoreBatchRequest JSON built around the documents' JSON."""
+    if len(models) > BATCHMAXITEMS:
+        raise ValueError(f"At most {BATCHMAXITEMS} documents per batch, got {len(models)}")
+    return b"".join((b'{"documents":[', b",".join(_JSON.dump_json(m) for m in models), b"]}"))
 
 
 class MiddlewareError(Exception):
     """Raised when middleware HTTP operations fail."""
 
 
-def _finalize_url(key: str, val: Optional[str] = None) -> str:
-    try:
-        part = _ENDPOINTS[key]
-    except KeyError as exc:
-        raise ValueError(f"Unknown endpoint key: {key}") from exc
+class CircuitOpenError(MiddlewareError):
+    """Raised without sending anything while the endpoint's circuit breaker is open."""
+
 
+def _base_url() -> str:
     # HOST may include scheme, e.g. http://127.0.0.1
-    base = f"{HOST}:{STORAGEPORT}"
-    url = f"{base}{part}"
-    if val:
-        url = url + str(val)
-    return url
-
-
-def _post_json(url: str, payload: str, timeout: float = DEFAULT_TIMEOUT,
-               retries: int = DEFAULT_RETRIES):
-    headers = {"Content-Type": "application/json"}
-    last_exc = None
-    for attempt in range(1, retries + 1):
+    return f"{HOST}:{STORAGEPORT}"
+
+
+class _ClientBase:
+    """Settings, endpoints and caches shared by the sync and async clients."""
+
+    def __init__(self, base_url: Optional[str], timeout: float, connect_timeout: float,
+                 retries: int, cache: bool = True, content_cache: Optional[ContentCache] = None,
+                 resolve_cache: Optional[ResolveCache] = None,
+                 resilience: Optional[Resilience] = None,
+                 replicas: Optional[Sequence[str]] = None, balance: str = STORAGEBALANCE,
+                 health_interval: Optional[float] = HEALTH_INTERVAL):
+        self.base_url = (base_url or _base_url()).rstrip("/")
+        if replicas is None:
+            # configured replicas belong to the configured primary
+            replicas = STORAGEREPLICAS if base_url is None else ()
+        self.endpoints = EndpointPool(self.base_url, replicas, balance)
+        # background /health checks only matter when there is a replica to fall back to
+        self.health_interval = health_interval if len(self.endpoints) > 1 else None
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.resilience = resilience or Resilience()
+        self.content_cache = (content_cache or ContentCache()) if cache else None
+        self.resolve_cache = (resolve_cache or ResolveCache()) if cache else None
+        self._etags: OrderedDict[str, tuple[str, bytes]] = OrderedDict()
+        self._etags_bytes = 0
+        self._etags_lock = threading.Lock()
+
+    def _cached_document(self, cid: str) -> Optional[IPFSRetrieveResponse]:
+        if self.content_cache is None:
+            return None
+        data = self.content_cache.get(cid)
+        return None if data is None else IPFSRetrieveResponse.model_validate_json(data)
+
+    def _retrieved(self, body: bytes) -> IPFSRetrieveResponse:
+        resp = IPFSRetrieveResponse.model_validate_json(body)
+        # missing CIDs may be stored later, only found documents are immutable
+        if self.content_cache is not None and resp.exists:
+            self.content_cache.set(resp.cid, body)
+        return resp
+
+    def _cached_resolution(self, did: str) -> Optional[DIDRegistryResolveResponse]:
+        return None if self.resolve_cache is None else self.resolve_cache.get(did)
+
+    def _resolved(self, body: bytes) -> DIDRegistryResolveResponse:
+        resp = DIDRegistryResolveResponse.model_validate_json(body)
+        if self.resolve_cache is not None:
+            self.resolve_cache.set(resp.did, resp)
+        return resp
+
+    def invalidate(self, did: Optional[str] = None):
+        """Forget the cached resolution of did, or of every DID when None."""
+        if self.resolve_cache is not None:
+            self.resolve_cache.invalidate(did)
+
+    def cache_stats(self) -> dict:
+        """Hit rates and occupancy of the content and resolve caches."""
+        return {"content": self.content_cache.stats() if self.content_cache else None,
+                "resolve": self.resolve_cache.stats() if self.resolve_cache else None}
+
+    def flight_stats(self) -> Optional[dict]:
+        """Lookups collapsed into one in-flight request, None when disabled."""
+        flights = getattr(self, "flights", None)
+        return flights.stats() if flights is not None else None
+
+    def resilience_stats(self) -> dict:
+        """Retries, hedges, circuit breaker states and read latencies."""
+        return self.resilience.stats()
+
+    def endpoint_stats(self) -> dict:
+        """Health, requests in flight and served per storage endpoint."""
+        return self.endpoints.stats()
+
+    def _usable(self, url: str) -> bool:
+        breaker = self.resilience.breaker(url)
+        return breaker is None or breaker.state != OPEN
+
+    def _endpoint(self, read: bool) -> Endpoint:
+        return self.endpoints.pick(self._usable) if read else self.endpoints.primary
+
+    @staticmethod
+    def _health_ok(status: int, body: Any) -> bool:
+        return status == 200 and isinstance(body, dict) and body.get("status") == 200
+
+    def _admit(self, url: str) -> Optional[CircuitBreaker]:
+        breaker = self.resilience.breaker(url)
+        if breaker is not None and not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} is failing, circuit open")
+        return breaker
+
+    @contextmanager
+    def _guarded(self, url: str,
+                 errors: type[BaseException]) -> Iterator[Optional[CircuitBreaker]]:
+        """Run one request to url through its endpoint's circuit breaker.
+
+        `errors` (transport failures) count against the endpoint, anything else, e.g.
+        the cancelled half of a hedge, frees a probe without a verdict on the node.
+        """
+        breaker = self._admit(url)
+        try:
+            yield breaker
+        except errors:
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        except BaseException:
+            if breaker is not None:
+                breaker.release()
+            raise
+
+    def _observed(self, route: str, start: float, resp: Any) -> Any:
+        # failed calls say nothing about how fast the route answers
+        if resp.status_code < 500:
+            self.resilience.observe(route, time.perf_counter() - start)
+        return resp
+
+    @contextmanager
+    def _on_endpoint(self, read: bool, path: str) -> Iterator[str]:
+        """The url of path on the endpoint picked for the request, counted in flight."""
+        endpoint = self._endpoint(read)
+        with self.endpoints.track(endpoint):
+            yield endpoint.url + path
+
+    def _prepare(self, key: str, val: Optional[str], payload: Optional[bytes],
+                 conditional: bool) -> tuple[str, dict, Optional[tuple[str, bytes]]]:
+        """Path, headers and the (ETag, body) revalidated by a conditional request."""
+        path = self._url(key, val, base="")
+        headers = {} if payload is None else {"Content-Type": "application/json"}
+        cached = None
+        if conditional:
+            # replicas serve the same content, ETags are kept per path
+            cached = self._cached_etag(path)
+            if cached is not None:
+                headers["If-None-Match"] = cached[0]
+        return path, headers, cached
+
+    def _body(self, resp: Any, path: str, cached: Optional[tuple[str, bytes]],
+              conditional: bool) -> bytes:
+        """The body of a response, the revalidated one on 304, raises on HTTP errors."""
+        if resp.status_code == 304 and cached is not None:
+            return cached[1]
+        resp.raise_for_status()
+        body = resp.content
+        etag = resp.headers.get("ETag")
+        if conditional and etag:
+            self._remember_etag(path, etag, body)
+        return body
+
+    def _retry_delay(self, method: str, path: str, attempt: int, exc: Exception) -> float:
+        """Log failed attempt number `attempt`, the backoff before the next one.
+
+        :raises MiddlewareError: once every attempt failed
+        """
+        logger.warning("Request failed (attempt %d/%d): %s", attempt, self.retries, exc)
+        if attempt >= self.retries:
+            raise MiddlewareError(
+                f"{method} {path} failed after {self.retries} attempts: {exc}") from exc
+        return self.resilience.retry_delay(attempt)
+
+    @staticmethod
+    def _record(breaker: Optional[CircuitBreaker], status: int):
+        # the node answered: only server errors count against it
+        if breaker is not None:
+            if status >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+
+    def _url(self, key: str, val: Optional[str] = None, base: Optional[str] = None) -> str:
+        try:
+            part = _ENDPOINTS[key]
+        except KeyError as exc:
+            raise ValueError(f"Unknown endpoint key: {key}") from exc
+        url = f"{self.base_url if base is None else base}{part}"
+        if val:
+            url = url + str(val)
+        return url
+
+    def _read_timeout(self, timeout: Optional[float]) -> float:
+        return self.timeout if timeout is None else timeout
+
+    def _cached_etag(self, url: str) -> Optional[tuple[str, bytes]]:
+        with self._etags_lock:
+            return self._etags.get(url)
+
+    def _remember_etag(self, url: str, etag: str, body: bytes):
+        with self._etags_lock:
+            old = self._etags.pop(url, None)
+            if old is not None:
+                self._etags_bytes -= len(old[1])
+            if len(body) > ETAG_CACHE_BYTES:
+                return
+            self._etags[url] = (etag, body)
+            self._etags_bytes += len(body)
+            while len(self._etags) > ETAG_CACHE_SIZE or self._etags_bytes > ETAG_CACHE_BYTES:
+                _, (_, evicted) = self._etags.popitem(last=False)
+                self._etags_bytes -= len(evicted)
+
+
+class MiddlewareClient(_ClientBase):
+    """Client for the registry/IPFS services over one pooled keep-alive session.
+
+    Connections are reused across calls instead of opening one per request.
+    The session is configured once and never mutated afterwards (no cookies,
+    no per-call headers on the session), requests only share urllib3's
+    connection pools, which are thread safe, so one client can serve many threads.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, timeout: float = DEFAULT_TIMEOUT,
+                 connect_timeout: float = CONNECT_TIMEOUT, retries: int = DEFAULT_RETRIES,
+                 pool_connections: int = POOL_CONNECTIONS, pool_maxsize: int = POOL_MAXSIZE,
+                 pool_block: bool = False, cache: bool = True,
+                 content_cache: Optional[ContentCache] = None,
+                 resolve_cache: Optional[ResolveCache] = None, singleflight: bool = True,
+                 resilience: Optional[Resilience] = None,
+                 replicas: Optional[Sequence[str]] = None, balance: str = STORAGEBALANCE,
+                 health_interval: Optional[float] = HEALTH_INTERVAL):
+        """
+        :param base_url: scheme://host:port of the primary storage service, taking the
+                         writes, from constants by default
+        :param timeout: read timeout in seconds, per call unless overridden
+        :param connect_timeout: seconds to establish a connection
+        :param retries: attempts per call
+        :param pool_connections: number of hosts to keep a pool for
+        :param pool_maxsize: connections kept alive per host
+        :param pool_block: wait for a free connection instead of opening an extra one
+                           beyond pool_maxsize, a hard per-host limit
+        :param cache: cache retrieved documents and resolutions
+        :param content_cache: document cache to use, a memory ContentCache by default
+        :param resolve_cache: resolution cache to use, a ResolveCache by default
+        :param singleflight: concurrent identical resolve/retrieve calls share one request
+        :param resilience: backoff, circuit breaker and hedging policy, defaults when None
+        :param replicas: further endpoints serving reads, from constants with the default
+                         base_url
+        :param balance: how reads are spread, "round_robin" or "least_outstanding"
+        :param health_interval: seconds between /health checks ejecting failing
+                                endpoints from reads, None to only check on demand
+        """
+        super().__init__(base_url, timeout, connect_timeout, retries, cache,
+                         content_cache, resolve_cache, resilience, replicas, balance,
+                         health_interval)
+        self.flights = SingleFlight() if singleflight else None
+        self.pool_maxsize = pool_maxsize
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self._hedge_pool_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections,
+                                                pool_maxsize=pool_maxsize,
+                                                pool_block=pool_block)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._stop = threading.Event()
+        self._checker: Optional[threading.Thread] = None
+        if self.health_interval:
+            self._checker = threading.Thread(target=self._check_loop, name="storage-health",
+                                             daemon=True)
+            self._checker.start()
+
+    def _timeouts(self, timeout: Optional[float]) -> tuple[float, float]:
+        return (self.connect_timeout, self._read_timeout(timeout))
+
+    def _single(self, key: tuple[str, str], fetch):
+        if self.flights is None:
+            return fetch()
+        result, shared = self.flights.do(key, fetch)
+        # waiters get their own copy, the first caller keeps the original
+        return result.model_copy(deep=True) if shared else result
+
+    def _send(self, url: str, send: Callable[[], requests.Response]) -> requests.Response:
+        """One request through the circuit breaker of url's endpoint."""
+        with self._guarded(url, requests.RequestException) as breaker:
+            resp = send()
+        self._record(breaker, resp.status_code)
+        return resp
+
+    def _timed(self, route: str, send: Callable[[], requests.Response]) -> requests.Response:
+        start = time.perf_counter()
+        return self._observed(route, start, send())
+
+    def _hedged(self, route: str, send: Callable[[], requests.Response]) -> requests.Response:
+        """Send, and once more if no answer came within the route's hedge delay.
+
+        The first successful response wins; the slower request cannot be aborted
+        and finishes in the background.
+        """
+        delay = self.resilience.hedge_delay(route)
+        if delay is None:
+            return self._timed(route, send)
+        with self._hedge_pool_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=self.pool_maxsize,
+                                                      thread_name_prefix="hedge")
+            pool = self._hedge_pool
+        first = pool.submit(self._timed, route, send)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+        self.resilience.hedge_sent()
+        second = pool.submit(self._timed, route, send)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.resilience.hedge_won()
+                    return future.result()
+        return first.result()
+
+    def _post(self, key: str, payload: bytes, timeout: Optional[float] = None,
+              read: bool = False) -> bytes:
+        """POST to the primary, with `read` to any healthy endpoint, returns the body"""
+        return self._request(key, payload=payload, timeout=timeout, read=read)
+
+    def _get(self, key: str, val: Optional[str] = None, timeout: Optional[float] = None,
+             conditional: bool = False, hedge: bool = False, read: bool = False) -> bytes:
+        """GET from the primary, with `read` from any healthy endpoint, returns the body.
+
+        With `conditional` revalidate the last body seen through If-None-Match, with
+        `hedge` record the latency of the route and hedge slow calls.
+        """
+        return self._request(key, val, timeout=timeout, conditional=conditional, hedge=hedge,
+                             read=read)
+
+    def _request(self, key: str, val: Optional[str] = None, payload: Optional[bytes] = None,
+                 timeout: Optional[float] = None, conditional: bool = False,
+                 hedge: bool = False, read: bool = False) -> bytes:
+        """GET, or POST payload, retried with backoff, returns the body"""
+        method = "GET" if payload is None else "POST"
+        path, headers, cached = self._prepare(key, val, payload, conditional)
+
+        def send():
+            with self._on_endpoint(read, path) as url:
+                return self._send(url, lambda: self._http(url, payload, headers, timeout))
+        for attempt in range(1, self.retries + 1):
+            logger.debug("%s %s attempt %d", method, path, attempt)
+            try:
+                resp = self._hedged(key, send) if hedge else send()
+                return self._body(resp, path, cached, conditional)
+            except requests.RequestException as e:
+                time.sleep(self._retry_delay(method, path, attempt, e))
+        raise MiddlewareError(f"{method} {path} not sent, retries is {self.retries}")
+
+    def _http(self, url: str, payload: Optional[bytes], headers: dict,
+              timeout: Optional[float]) -> requests.Response:
+        if payload is None:
+            return self.session.get(url, headers=headers, timeout=self._timeouts(timeout))
+        return self.session.post(url, data=payload, headers=headers,
+                                 timeout=self._timeouts(timeout))
+
+    def _probe(self, endpoint: Endpoint) -> bool:
         try:
-            logger.debug("POST %s attempt %d", url, attempt)
-            resp = requests.post(url, data=payload, headers=headers, timeout=timeout)
-            resp.raise_for_status()
-            return resp.json()
-        except requests.RequestException as e:
-            last_exc = e
-            logger.warning("Request failed (attempt %d/%d): %s", attempt, retries, e)
-            if attempt < retries:
-                time.sleep(0.2 * attempt)
-    raise MiddlewareError(f"POST {url} failed after {retries} attempts: {last_exc}")
-
-
-def _get_json(url: str, timeout: float = DEFAULT_TIMEOUT, retries: int = DEFAULT_RETRIES):
-    last_exc = None
-    for attempt in range(1, retries + 1):
+            resp = self.session.get(self._url("heal", base=endpoint.url), headers={},
+                                    timeout=self._timeouts(self.connect_timeout))
+            return self._health_ok(resp.status_code, resp.json())
+        except (requests.RequestException, ValueError):
+            return False
+
+    def check_health(self) -> dict[str, bool]:
+        """Probe /health on every endpoint, eject failing ones from reads and
+        restore recovered ones."""
+        results = {}
+        for endpoint in self.endpoints.endpoints:
+            healthy = self._probe(endpoint)
+            self.endpoints.mark(endpoint, healthy)
+            results[endpoint.url] = healthy
+        return results
+
+    def _check_loop(self):
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def register(self, did: str, cid: str, signature: Optional[str] = None,
+                 timeout: Optional[float] = None) -> DIDRegistryRegisterResponse:
+        """Register a DID -> CID mapping on the registry service."""
+        data = _JSON.dump_json(DIDRegistryRegisterRequest(did=did, doc_cid=cid,
+                                                          signature=signature))
         try:
-            logger.debug("GET %s attempt %d", url, attempt)
-            resp = requests.get(url, timeout=timeout)
-            resp.raise_for_status()
-            return resp.json()
-        except requests.RequestException as e:
-            last_exc = e
-            logger.warning("Request failed (attempt %d/%d): %s", attempt, retries, e)
-            if attempt < retries:
-                time.sleep(0.2 * attempt)
-    raise MiddlewareError(f"GET {url} failed after {retries} attempts: {last_exc}")
+            body = self._post("reg", data, timeout=timeout)
+        finally:
+            self.invalidate(did)
+        return DIDRegistryRegisterResponse.model_validate_json(body)
+
+    def resolve(self, did: str, timeout: Optional[float] = None) -> DIDRegistryResolveResponse:
+        """Resolve a DID to its current CID and metadata, cached for the resolve TTL."""
+        def fetch():
+            return self._resolved(self._get("res", did, timeout=timeout, hedge=True, read=True))
+        cached = self._cached_resolution(did)
+        return cached if cached is not None else self._single(("res", did), fetch)
+
+    def store(self, model: Union[BaseModel, dict],
+              timeout: Optional[float] = None) -> IPFSStoreResponse:
+        """Store a document (DID Document or claim) on the IPFS mock gateway."""
+        body = self._post("str", _store_body(model), timeout=timeout)
+        return IPFSStoreResponse.model_validate_json(body)
+
+    def retrieve(self, cid: str, timeout: Optional[float] = None) -> IPFSRetrieveResponse:
+        """Retrieve a stored document by CID, from the content cache when present,
+        revalidated with If-None-Match when seen before."""
+        def fetch():
+            return self._retrieved(self._get("ret", cid, timeout=timeout, conditional=True,
+                                             hedge=True, read=True))
+        cached = self._cached_document(cid)
+        return cached if cached is not None else self._single(("ret", cid), fetch)
+
+    def store_batch(self, models: list[Union[BaseModel, dict]],
+                    timeout: Optional[float] = None) -> list[IPFSStoreResponse]:
+        """Store many documents with one request, results are in order."""
+        body = self._post("strb", _store_batch_body(models), timeout=timeout)
+        return IPFSStoreBatchResponse.model_validate_json(body).results
+
+    def retrieve_batch(self, cids: list[str],
+                       timeout: Optional[float] = None) -> list[IPFSRetrieveResponse]:
+        """Retrieve many documents with one request, results are in order."""
+        payload = _JSON.dump_json(IPFSRetrieveBatchRequest(cids=cids))
+        body = self._post("retb", payload, timeout=timeout, read=True)
+        return IPFSRetrieveBatchResponse.model_validate_json(body).results
+
+    def health(self, timeout: Optional[float] = None) -> bool:
+        """Checks the Health of backend"""
+        return json.loads(self._get("heal", timeout=timeout))["status"] == 200
+
+    def close(self):
+        """Close the pooled connections"""
+        self._stop.set()
+        if self._hedge_pool is not None:
+            self._hedge_pool.shutdown(wait=False)
+        self.session.close()
+
+
+AnyClient = Union[MiddlewareClient, InProcessClient]
+# replaced by set_default_client, not a constant
+_default: Optional[AnyClient] = None  # pylint: disable=invalid-name
+_default_lock = threading.Lock()
+
+
+def default_client() -> AnyClient:
+    """The client used by the module level functions, created on first use,
+    in-process when STORAGETRANSPORT is "inprocess"."""
+    global _default  # pylint: disable=global-statement
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = InProcessClient() if STORAGETRANSPORT == "inprocess" \
+                    else MiddlewareClient()
+    return _default
+
+
+def set_default_client(client: AnyClient) -> Optional[AnyClient]:
+    """Replace the client used by the module level functions, returns the previous one."""
+    global _default  # pylint: disable=global-statement
+    with _default_lock:
+        previous, _default = _default, client
+    return previous
 
 
 def register(did: str, cid: str, signature: Optional[str] = None,
@@ -90,10 +548,7 @@ def register(did: str, cid: str, signature: Optional[str] = None,
 
     Returns a `DIDRegistryRegisterResponse` on success or raises `MiddlewareError` on failure.
     """
-    url = _finalize_url("reg")
-    data = DIDRegistryRegisterRequest(did=did, doc_cid=cid, signature=signature).model_dump_json()
-    j = _post_json(url, data, timeout=timeout)
-    return DIDRegistryRegisterResponse.model_validate(j)
+    return default_client().register(did, cid, signature=signature, timeout=timeout)
 
 
 def resolve(did: str, timeout: float = DEFAULT_TIMEOUT) -> DIDRegistryResolveResponse:
@@ -101,9 +556,7 @@ def resolve(did: str, timeout: float = DEFAULT_TIMEOUT) -> DIDRegistryResolveRes
 
     Returns a `DIDRegistryResolveResponse`.
     """
-    url = _finalize_url("res", val=did)
-    j = _get_json(url, timeout=timeout)
-    return DIDRegistryResolveResponse.model_validate(j)
+    return default_client().resolve(did, timeout=timeout)
 
 
 def store(model: Union[BaseModel, dict], timeout: float = DEFAULT_TIMEOUT) -> IPFSStoreResponse:
@@ -111,31 +564,38 @@ def store(model: Union[BaseModel, dict], timeout: float = DEFAULT_TIMEOUT) -> IP
 
     `model` may be a pydantic `BaseModel` or a plain dict. Returns `IPFSStoreResponse`.
     """
-    url = _finalize_url("str")
-    if isinstance(model, BaseModel):
-        json_model = model.model_dump()
-    else:
-        json_model = model
-
-    payload = IPFSStoreRequest(document=json_model).model_dump_json()
-    j = _post_json(url, payload, timeout=timeout)
-    return IPFSStoreResponse.model_validate(j)
+    return default_client().store(model, timeout=timeout)
 
 
 def retrieve(cid: str, timeout: float = DEFAULT_TIMEOUT) -> IPFSRetrieveResponse:
-    """Retrieve a stored document by CID from the IPFS mock gateway."""
-    url = _finalize_url("ret", val=cid)
-    j = _get_json(url, timeout=timeout)
-    return IPFSRetrieveResponse.model_validate(j)
+    """Retrieve a stored document by CID from the IPFS mock gateway.
+
+    Documents are immutable: a repeated retrieve sends If-None-Match and reuses
+    the previous body when the gateway answers 304.
+    """
+    return default_client().retrieve(cid, timeout=timeout)
+
+
+def store_batch(models: list[Union[BaseModel, dict]],
+                timeout: float = DEFAULT_TIMEOUT) -> list[IPFSStoreResponse]:
+    """Store many documents with one request.
+
+    Returns one `IPFSStoreResponse` per document, in order.
+    """
+    return default_client().store_batch(models, timeout=timeout)
+
+
+def retrieve_batch(cids: list[str], timeout: float = DEFAULT_TIMEOUT) -> list[IPFSRetrieveResponse]:
+    """Retrieve many documents with one request.
+
+    Returns one `IPFSRetrieveResponse` per CID, in order, `exists` is False for unknown CIDs.
+    """
+    return default_client().retrieve_batch(cids, timeout=timeout)
 
 
 def health(timeout: float = DEFAULT_TIMEOUT):
     """Checks the Health of backend"""
-    url = _finalize_url("heal")
-    j = _get_json(url, timeout=timeout)
-    if j["status"] == 200:
-        return True
-    return False
+    return default_client().health(timeout=timeout)
 
 if __name__ == "__main__":
     # small demo when run directly (keeps previous CLI-style prints for convenience)
@@ -14,7 +14,7 @@ def test_register_success():
 def test_store_and_retrieve_success():
     if not _is_alive():
         pytest.skip(reason="Server needs to be online")
-    cid = "cid_426fc04f04bf8fdb5831dc37bbb6dcf70f63a37e05a68c6ea5f63e85ae579376"
+    cid = "bagaaierapi4l7aptqp3jim5nn2ia2nnt4i4fle7xnj5xvnougvnyxja64jfq"
 
     s = store({"foo": "bar"})
     assert isinstance(s, IPFSStoreResponse)
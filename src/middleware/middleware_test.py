@@ -1,23 +1,52 @@
 import pytest
 import requests
 
-from .middleware import register, store, resolve, retrieve, MiddlewareError
+import json
+import threading
+import time
+from .cache import ContentCache, ResolveCache
+from .middleware import (register, store, resolve, retrieve, store_batch, retrieve_batch,
+                         MiddlewareError, MiddlewareClient, default_client, set_default_client,
+                         CircuitOpenError, _store_body, _store_batch_body)
+from .resilience import Backoff, Resilience, OPEN
+from . import middleware
+from datetime import datetime, timezone
+from src.core.constants import BATCHMAXITEMS
 from src.core.models import (
+    DEMO,
+    IPFSStoreRequest,
+    IPFSStoreBatchRequest,
+    VerityClaim,
     DIDRegistryRegisterResponse,
     IPFSStoreResponse,
     IPFSRetrieveResponse,
 )
 
 
+@pytest.fixture(autouse=True)
+def client():
+    # a fresh default client per test: empty ETag cache, its own session to patch
+    fresh = MiddlewareClient()
+    previous = set_default_client(fresh)
+    yield fresh
+    set_default_client(previous)
+    fresh.close()
+
+
 class DummyResponse:
-    def __init__(self, data, status=200):
+    def __init__(self, data, status=200, headers=None):
         self._data = data
         self.status_code = status
+        self.headers = headers or {}
 
     def raise_for_status(self):
         if not 200 <= self.status_code < 300:
             raise requests.HTTPError(f"Status {self.status_code}")
 
+    @property
+    def content(self):
+        return json.dumps(self._data).encode()
+
     def json(self):
         return self._data
 
@@ -33,7 +62,7 @@ def test_register_success(monkeypatch):
     def fake_post(url, data, headers, timeout):
         return DummyResponse(expected)
 
-    monkeypatch.setattr("src.middleware.requests.post", fake_post)
+    monkeypatch.setattr(default_client().session, "post", fake_post)
 
     resp = register("did:verity:demo:1", "cid123")
     assert isinstance(resp, DIDRegistryRegisterResponse)
@@ -52,11 +81,11 @@ def test_store_and_retrieve_success(monkeypatch):
     def fake_post(url, data, headers, timeout):
         return DummyResponse(store_resp)
 
-    def fake_get(url, timeout):
+    def fake_get(url, headers, timeout):
         return DummyResponse(retrieve_resp)
 
-    monkeypatch.setattr("src.middleware.requests.post", fake_post)
-    monkeypatch.setattr("src.middleware.requests.get", fake_get)
+    monkeypatch.setattr(default_client().session, "post", fake_post)
+    monkeypatch.setattr(default_client().session, "get", fake_get)
 
     s = store({"foo": "bar"})
     assert isinstance(s, IPFSStoreResponse)
@@ -68,10 +97,362 @@ def test_store_and_retrieve_success(monkeypatch):
 
 
 def test_resolve_failure_raises(monkeypatch):
-    def fake_get(url, timeout):
+    def fake_get(url, headers, timeout):
         raise requests.RequestException("network")
 
-    monkeypatch.setattr("src.middleware.requests.get", fake_get)
+    monkeypatch.setattr(default_client().session, "get", fake_get)
 
     with pytest.raises(MiddlewareError):
         resolve("did:not:found")
+
+
+def test_retrieve_revalidates_with_etag(client, monkeypatch):
+    # without the content cache every retrieve reaches the gateway
+    monkeypatch.setattr(client, "content_cache", None)
+    body = {
+        "cid": "cid-etag",
+        "document": {"foo": "bar"},
+        "retrieved_at": "2025-01-01T00:00:00",
+        "exists": True,
+    }
+    sent = []
+
+    def fake_get(url, headers, timeout):
+        sent.append(dict(headers))
+        if headers.get("If-None-Match") == 'W/"cid-etag"':
+            return DummyResponse(None, status=304)
+        return DummyResponse(body, headers={"ETag": 'W/"cid-etag"'})
+
+    monkeypatch.setattr(default_client().session, "get", fake_get)
+
+    first = retrieve("cid-etag")
+    second = retrieve("cid-etag")
+    assert sent == [{}, {"If-None-Match": 'W/"cid-etag"'}]
+    assert second == first
+
+
+def test_etag_bodies_are_byte_capped(client, monkeypatch):
+    monkeypatch.setattr(middleware, "ETAG_CACHE_BYTES", 100)
+    client._remember_etag("/retrieve/a", '"a"', b"x" * 60)
+    client._remember_etag("/retrieve/b", '"b"', b"x" * 60)
+    client._remember_etag("/retrieve/big", '"big"', b"x" * 101)
+    assert client._cached_etag("/retrieve/a") is None
+    assert client._cached_etag("/retrieve/b") == ('"b"', b"x" * 60)
+    assert client._cached_etag("/retrieve/big") is None
+    assert client._etags_bytes == 60
+
+
+def test_store_and_retrieve_batch(monkeypatch):
+    calls = []
+
+    def fake_post(url, data, headers, timeout):
+        calls.append(url)
+        body = json.loads(data)
+        if url.endswith("/store/batch"):
+            return DummyResponse({"results": [{"cid": f"cid-{i}", "size_bytes": 1}
+                                              for i, _ in enumerate(body["documents"])]})
+        return DummyResponse({"results": [{"cid": c, "document": {"c": c}, "exists": True}
+                                          for c in body["cids"]], "found": len(body["cids"])})
+
+    monkeypatch.setattr(default_client().session, "post", fake_post)
+
+    stored = store_batch([{"a": 1}, {"b": 2}])
+    assert [s.cid for s in stored] == ["cid-0", "cid-1"]
+    docs = retrieve_batch(["cid-0", "cid-1"])
+    assert [d.document["c"] for d in docs] == ["cid-0", "cid-1"]
+    assert len(calls) == 2
+
+
+def test_client_reuses_one_session_across_threads(client, monkeypatch):
+    seen = []
+
+    def fake_get(url, headers, timeout):
+        seen.append((url, timeout))
+        return DummyResponse({"status": 200})
+
+    monkeypatch.setattr(client.session, "get", fake_get)
+    threads = [threading.Thread(target=client.health) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(seen) == 8
+    assert seen[0] == (f"{client.base_url}/health", (client.connect_timeout, client.timeout))
+    adapter = client.session.get_adapter("http://127.0.0.1")
+    assert adapter._pool_maxsize == client.session.adapters["https://"]._pool_maxsize
+
+
+def test_client_options():
+    c = MiddlewareClient(base_url="http://svc:9000/", timeout=1.5, pool_maxsize=4,
+                         pool_block=True)
+    assert c._url("res", "did:x") == "http://svc:9000/resolve/did:x"
+    assert c._timeouts(None)[1] == 1.5 and c._timeouts(9)[1] == 9
+    assert c.session.get_adapter("http://svc:9000")._pool_block
+    c.close()
+
+
+def test_retrieve_is_cached(client, monkeypatch):
+    gets = []
+
+    def fake_get(url, headers, timeout):
+        gets.append(url)
+        cid = url.rsplit("/", 1)[1]
+        if cid == "cid-missing":
+            return DummyResponse({"cid": cid, "document": {"0": ""}, "exists": False})
+        return DummyResponse({"cid": cid, "document": {"n": cid}, "exists": True})
+
+    monkeypatch.setattr(client.session, "get", fake_get)
+    first = retrieve("cid-1")
+    again = retrieve("cid-1")
+    assert again.document == first.document == {"n": "cid-1"}
+    retrieve("cid-missing")
+    retrieve("cid-missing")
+    assert len(gets) == 3
+    stats = client.cache_stats()["content"]
+    assert stats["hits"] == 1 and stats["entries"] == 1
+
+
+def test_resolve_ttl_and_invalidation(monkeypatch):
+    now = [0.0]
+    client = MiddlewareClient(resolve_cache=ResolveCache(ttl=10, clock=lambda: now[0]))
+    set_default_client(client)
+    cids = iter(["cid-a", "cid-b", "cid-c"])
+    gets = []
+
+    def fake_get(url, headers, timeout):
+        gets.append(url)
+        return DummyResponse({"did": "did:x", "doc_cid": next(cids), "status": "success"})
+
+    def fake_post(url, data, headers, timeout):
+        return DummyResponse({"status": "success", "did": "did:x", "doc_cid": "cid-b"})
+
+    monkeypatch.setattr(client.session, "get", fake_get)
+    monkeypatch.setattr(client.session, "post", fake_post)
+    first = resolve("did:x")
+    assert first.doc_cid == "cid-a"
+    # callers get copies, changing one leaves the cached resolution alone
+    first.doc_cid = "cid-tampered"
+    assert resolve("did:x").doc_cid == "cid-a"
+    now[0] = 11
+    assert resolve("did:x").doc_cid == "cid-b"
+    register("did:x", "cid-c")
+    assert resolve("did:x").doc_cid == "cid-c"
+    assert len(gets) == 3
+    assert client.cache_stats()["resolve"]["hits"] == 1
+
+
+def test_content_cache_lru_and_disk(tmp_path):
+    cache = ContentCache(max_bytes=10, path=str(tmp_path))
+    cache.set("a", b"12345")
+    cache.set("b", b"12345")
+    assert cache.get("a") == b"12345"
+    cache.set("c", b"12345")
+    assert cache.stats()["evictions"] == 1
+    assert "b" not in cache._data
+    # evicted from memory, still on disk
+    assert cache.get("b") == b"12345"
+    reopened = ContentCache(max_bytes=10, path=str(tmp_path))
+    assert reopened.get("c") == b"12345"
+    assert reopened.stats()["disk_hits"] == 1
+    assert reopened.get("../x") is None
+    cache.set("big", b"x" * 11)
+    assert "big" not in cache._data
+
+
+def test_cache_can_be_disabled():
+    client = MiddlewareClient(cache=False)
+    assert client.cache_stats() == {"content": None, "resolve": None}
+
+
+def test_concurrent_retrieves_share_one_request(client, monkeypatch):
+    sent = []
+    gate = threading.Event()
+
+    def fake_get(url, headers, timeout):
+        sent.append(url)
+        gate.wait(1)
+        return DummyResponse({"cid": "cid-s", "document": {"a": 1},
+                              "retrieved_at": "2025-01-01T00:00:00", "exists": True})
+
+    monkeypatch.setattr(client.session, "get", fake_get)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.retrieve("cid-s")))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(sent) == 1
+    assert len(results) == 8 and all(r.document == {"a": 1} for r in results)
+    assert client.flight_stats() == {"calls": 8, "executions": 1, "collapsed": 7}
+    # every waiter owns its document, nested dicts included
+    results[0].document["a"] = 2
+    assert all(r.document == {"a": 1} for r in results[1:])
+
+
+def test_circuit_opens_and_fails_fast():
+    policy = Resilience(backoff=Backoff(base=0), breaker_failures=3, breaker_reset=60)
+    client = MiddlewareClient(base_url="http://down:1", retries=2, cache=False,
+                              resilience=policy)
+    calls = []
+
+    def fake_get(url, headers, timeout):
+        calls.append(url)
+        raise requests.ConnectionError("refused")
+
+    client.session.get = fake_get
+    with pytest.raises(MiddlewareError):
+        client.resolve("did:a")
+    with pytest.raises(CircuitOpenError):
+        client.resolve("did:b")
+    assert len(calls) == 3
+    with pytest.raises(CircuitOpenError):
+        client.health()
+    assert len(calls) == 3
+    stats = client.resilience_stats()
+    assert stats["breakers"]["http://down:1"]["state"] == OPEN
+    assert stats["retries"] == 2
+    client.close()
+
+
+def test_client_errors_do_not_open_the_circuit():
+    policy = Resilience(backoff=Backoff(base=0), breaker_failures=1)
+    client = MiddlewareClient(base_url="http://up:1", retries=1, resilience=policy)
+    client.session.get = lambda url, headers, timeout: DummyResponse({}, status=404)
+    for _ in range(3):
+        with pytest.raises(MiddlewareError):
+            client.health()
+    assert policy.breaker("http://up:1").state != OPEN
+    client.close()
+
+
+def test_slow_read_is_hedged():
+    policy = Resilience(hedge_percentile=95, latency_min_samples=5)
+    client = MiddlewareClient(base_url="http://node:1", cache=False, resilience=policy)
+    for _ in range(5):
+        policy.observe("res", 0.01)
+    sent = []
+    release = threading.Event()
+
+    def fake_get(url, headers, timeout):
+        sent.append(url)
+        if len(sent) == 1:
+            release.wait(2)
+        return DummyResponse({"did": "did:h", "doc_cid": "cid-h", "status": "success"})
+
+    client.session.get = fake_get
+    start = time.perf_counter()
+    resp = client.resolve("did:h")
+    assert time.perf_counter() - start < 1
+    release.set()
+    assert resp.doc_cid == "cid-h" and len(sent) == 2
+    stats = client.resilience_stats()
+    assert (stats["hedges"], stats["hedge_wins"]) == (1, 1)
+    client.close()
+
+
+def test_reads_spread_over_replicas_and_writes_go_to_primary():
+    client = MiddlewareClient(base_url="http://primary:1", replicas=["http://replica:1"],
+                              cache=False, health_interval=None)
+    gets, posts = [], []
+
+    def fake_get(url, headers, timeout):
+        gets.append(url)
+        if url.endswith("/health"):
+            return DummyResponse({"status": 200 if "primary" in url else 503})
+        return DummyResponse({"did": "did:r", "doc_cid": "cid-r", "status": "success"})
+
+    def fake_post(url, data, headers, timeout):
+        posts.append(url)
+        return DummyResponse({"cid": "cid-r", "size_bytes": 1})
+
+    client.session.get = fake_get
+    client.session.post = fake_post
+    for _ in range(4):
+        client.resolve("did:r")
+        client.store({"a": 1})
+    assert sorted(gets) == ["http://primary:1/resolve/did:r"] * 2 + \
+        ["http://replica:1/resolve/did:r"] * 2
+    assert posts == ["http://primary:1/store"] * 4
+
+    assert client.check_health() == {"http://primary:1": True, "http://replica:1": False}
+    gets.clear()
+    for _ in range(3):
+        client.resolve("did:r")
+    assert gets == ["http://primary:1/resolve/did:r"] * 3
+    assert not client.endpoint_stats()["http://replica:1"]["healthy"]
+    client.close()
+
+
+def test_failed_read_retries_on_another_replica():
+    policy = Resilience(backoff=Backoff(base=0))
+    client = MiddlewareClient(base_url="http://down:1", replicas=["http://up:1"], cache=False,
+                              resilience=policy, health_interval=None)
+    gets = []
+
+    def fake_get(url, headers, timeout):
+        gets.append(url)
+        if url.startswith("http://down:1"):
+            raise requests.ConnectionError("refused")
+        return DummyResponse({"did": "did:r", "doc_cid": "cid-r", "status": "success"})
+
+    client.session.get = fake_get
+    assert client.resolve("did:r").doc_cid == "cid-r"
+    assert gets == ["http://down:1/resolve/did:r", "http://up:1/resolve/did:r"]
+    client.close()
+
+
+def test_background_health_checks():
+    client = MiddlewareClient(base_url="http://primary:1", replicas=["http://replica:1"],
+                              health_interval=0.01)
+    client.session.get = lambda url, headers, timeout: DummyResponse({"status": 503})
+    deadline = time.time() + 2
+    while client.endpoint_stats()["http://replica:1"]["healthy"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert not client.endpoint_stats()["http://replica:1"]["healthy"]
+    client.close()
+    assert MiddlewareClient(base_url="http://solo:1")._checker is None
+
+
+def _claim():
+    return VerityClaim(claim_id="claim_1", issuer={"id": "did:verity:demo"},
+                       credential_subject={"title": "Résultats", "n": 3},
+                       content_hash="sha256:ab", content_type="document",
+                       issuance_date=datetime(2025, 1, 1, tzinfo=timezone.utc))
+
+
+def test_request_bodies_match_the_request_models():
+    for doc in (_claim(), DEMO, {"plain": ["dict", 1, None]}):
+        dumped = doc.model_dump() if hasattr(doc, "model_dump") else doc
+        assert _store_body(doc) == IPFSStoreRequest(document=dumped).model_dump_json().encode()
+    docs = [_claim(), {"a": 1}]
+    assert _store_batch_body(docs) == IPFSStoreBatchRequest(
+        documents=[_claim().model_dump(), {"a": 1}]).model_dump_json().encode()
+    assert _store_batch_body([]) == b'{"documents":[]}'
+    with pytest.raises(ValueError):
+        _store_batch_body([{}] * (BATCHMAXITEMS + 1))
+
+
+def test_request_bodies_round_trip_through_the_request_models():
+    for doc in (_claim(), DEMO, {"plain": ["dict", 1, None]}):
+        dumped = doc.model_dump(mode="json") if hasattr(doc, "model_dump") else doc
+        assert IPFSStoreRequest.model_validate_json(_store_body(doc)) == \
+            IPFSStoreRequest(document=dumped)
+    docs = [_claim(), {"a": 1}]
+    assert IPFSStoreBatchRequest.model_validate_json(_store_batch_body(docs)) == \
+        IPFSStoreBatchRequest(documents=[_claim().model_dump(mode="json"), {"a": 1}])
+
+
+def test_non_ascii_documents_are_sent_as_utf8(monkeypatch):
+    sent = []
+
+    def fake_post(url, data, headers, timeout):
+        sent.append(data)
+        return DummyResponse({"cid": "cid-u", "size_bytes": 1})
+
+    monkeypatch.setattr(default_client().session, "post", fake_post)
+    store(_claim())
+    assert isinstance(sent[0], bytes)
+    assert json.loads(sent[0])["document"]["credential_subject"]["title"] == "Résultats"
@@ -0,0 +1,261 @@
+"""
+Retry backoff, circuit breakers and hedging policy for the middleware clients
+
+Retries wait a jittered exponential delay so clients that failed together do not
+retry together. Each storage node (scheme://host:port) has a circuit breaker: after
+enough consecutive failures calls fail fast for a while instead of piling onto a
+node that is down, then a single probe decides whether it is back. Reads can be
+hedged: when a lookup is slower than a latency percentile of recent ones, a second
+identical request is sent and the first answer wins.
+"""
+import logging
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 5.0
+BREAKER_FAILURES = 5
+BREAKER_RESET = 10.0
+# hedging is off unless a percentile is given
+HEDGE_MIN_DELAY = 0.01
+LATENCY_WINDOW = 256
+LATENCY_MIN_SAMPLES = 20
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class Backoff:
+    """Full jitter exponential backoff: a uniform delay in [0, min(cap, base * 2^(n-1))]."""
+
+    def __init__(self, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX,
+                 rng: Optional[random.Random] = None):
+        """
+        :param base: ceiling of the first delay in seconds
+        :param cap: largest delay in seconds
+        :param rng: random source, for reproducible delays
+        """
+        self.base = base
+        self.cap = cap
+        self._rng = rng or random.Random()
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after failed attempt number `attempt` (from 1)."""
+        return self._rng.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Consecutive failure breaker for one endpoint.
+
+    closed: calls go through. open: calls are refused until `reset_after` seconds
+    have passed. half_open: one probe call goes through, its outcome closes or
+    reopens the breaker.
+    """
+
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES,
+                 reset_after: float = BREAKER_RESET,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param name: endpoint the breaker guards, for logs and stats
+        :param failures: consecutive failures that open the breaker
+        :param reset_after: seconds the breaker stays open before a probe
+        :param clock: time source in seconds
+        """
+        self.name = name
+        self.failures = failures
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may be sent now, a refused call counts as rejected."""
+        with self._lock:
+            if self.state == OPEN and self._clock() - self._opened_at >= self.reset_after:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        """The endpoint answered, close the breaker."""
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit for %s closed", self.name)
+            self.state = CLOSED
+            self.consecutive = 0
+            self._probing = False
+
+    def record_failure(self):
+        """The call failed, open the breaker after `failures` in a row or a failed probe."""
+        with self._lock:
+            self.consecutive += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED
+                                           and self.consecutive >= self.failures):
+                logger.warning("Circuit for %s opened after %d failures", self.name,
+                               self.consecutive)
+                self.state = OPEN
+                self.opened += 1
+                self._opened_at = self._clock()
+            self._probing = False
+
+    def release(self):
+        """A call let through ended without an outcome (cancelled), free the probe."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> dict:
+        """State and counters of the breaker."""
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive,
+                    "opened": self.opened, "rejected": self.rejected}
+
+
+class LatencyTracker:
+    """Latencies of the last `window` successful calls of one route."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        """
+        :param window: number of latest samples kept
+        """
+        self._samples: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        """Add a sample, dropping the oldest one once the window is full."""
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """The p-th percentile (0-100) of the window, None when empty."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * p / 100))
+        return samples[index]
+
+
+class Resilience:
+    """Backoff, per endpoint circuit breakers and hedging settings of one client.
+
+    Thread safe, one instance may be shared by several clients so they agree on
+    which storage nodes are down.
+    """
+
+    def __init__(self, backoff: Optional[Backoff] = None,
+                 breaker_failures: int = BREAKER_FAILURES,
+                 breaker_reset: float = BREAKER_RESET,
+                 hedge_percentile: Optional[float] = None,
+                 hedge_min_delay: float = HEDGE_MIN_DELAY,
+                 latency_window: int = LATENCY_WINDOW,
+                 latency_min_samples: int = LATENCY_MIN_SAMPLES,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        :param backoff: delays between retries, a full jitter Backoff by default
+        :param breaker_failures: consecutive failures that open an endpoint's breaker,
+                                 0 disables the breakers
+        :param breaker_reset: seconds a breaker stays open before a probe
+        :param hedge_percentile: hedge resolve/retrieve calls slower than this
+                                 percentile of recent ones (e.g. 95), None disables hedging
+        :param hedge_min_delay: never hedge sooner than this many seconds
+        :param latency_window: successful calls per route the percentile is taken over
+        :param latency_min_samples: calls observed before hedging starts
+        :param clock: time source in seconds
+        """
+        self.backoff = backoff or Backoff()
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.latency_window = latency_window
+        self.latency_min_samples = latency_min_samples
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self._clock = clock
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latency: dict[str, LatencyTracker] = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url: str) -> Optional[CircuitBreaker]:
+        """The breaker of the endpoint serving url, None when breakers are disabled."""
+        if self.breaker_failures <= 0:
+            return None
+        parts = urlsplit(url)
+        endpoint = f"{parts.scheme}://{parts.netloc}"
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(
+                    endpoint, self.breaker_failures, self.breaker_reset, self._clock)
+            return breaker
+
+    def _tracker(self, route: str) -> LatencyTracker:
+        with self._lock:
+            tracker = self._latency.get(route)
+            if tracker is None:
+                tracker = self._latency[route] = LatencyTracker(self.latency_window)
+            return tracker
+
+    def observe(self, route: str, seconds: float):
+        """Record the latency of a successful call of route."""
+        self._tracker(route).observe(seconds)
+
+    def hedge_delay(self, route: str) -> Optional[float]:
+        """Seconds to wait before hedging a call of route, None to not hedge."""
+        if self.hedge_percentile is None:
+            return None
+        tracker = self._tracker(route)
+        if len(tracker) < self.latency_min_samples:
+            return None
+        return max(self.hedge_min_delay, tracker.percentile(self.hedge_percentile))
+
+    def retry_delay(self, attempt: int) -> float:
+        """Backoff after failed attempt number `attempt`, counted as a retry."""
+        with self._lock:
+            self.retries += 1
+        return self.backoff.delay(attempt)
+
+    def hedge_sent(self):
+        """Count a hedge request sent after the hedge delay."""
+        with self._lock:
+            self.hedges += 1
+
+    def hedge_won(self):
+        """Count a hedge request that answered before the original."""
+        with self._lock:
+            self.hedge_wins += 1
+
+    def stats(self) -> dict:
+        """Retry and hedge counters, breaker states and route latencies."""
+        with self._lock:
+            breakers = dict(self._breakers)
+            latency = dict(self._latency)
+            counters = {"retries": self.retries, "hedges": self.hedges,
+                        "hedge_wins": self.hedge_wins}
+        counters["breakers"] = {name: b.stats() for name, b in breakers.items()}
+        counters["latency"] = {route: {"samples": len(t), "p50": t.percentile(50),
+                                       "p95": t.percentile(95)}
+                               for route, t in latency.items()}
+        return counters
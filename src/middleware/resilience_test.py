@@ -0,0 +1,91 @@
+import random
+
+from .resilience import (Backoff, CircuitBreaker, LatencyTracker, Resilience, CLOSED, OPEN,
+                         HALF_OPEN)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_backoff_is_jittered_and_capped():
+    backoff = Backoff(base=0.1, cap=0.5, rng=random.Random(7))
+    delays = [backoff.delay(1) for _ in range(200)]
+    assert all(0 <= d <= 0.1 for d in delays)
+    assert len(set(delays)) > 100
+    assert all(0 <= backoff.delay(10) <= 0.5 for _ in range(200))
+    assert max(backoff.delay(3) for _ in range(200)) > 0.2
+
+
+def test_breaker_opens_fails_fast_and_probes():
+    clock = Clock()
+    breaker = CircuitBreaker("http://node", failures=3, reset_after=5, clock=clock)
+    for _ in range(3):
+        assert breaker.allow()
+        breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    clock.now = 5
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # one probe at a time
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now = 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CLOSED and breaker.allow()
+    assert breaker.stats() == {"state": CLOSED, "consecutive_failures": 0, "opened": 2,
+                               "rejected": 2}
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker("http://node", failures=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+
+def test_cancelled_probe_frees_the_slot():
+    clock = Clock()
+    breaker = CircuitBreaker("http://node", failures=1, reset_after=1, clock=clock)
+    breaker.record_failure()
+    clock.now = 1
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+
+def test_latency_percentile():
+    tracker = LatencyTracker(window=100)
+    assert tracker.percentile(95) is None
+    for ms in range(1, 101):
+        tracker.observe(ms / 1000)
+    assert tracker.percentile(50) == 0.051
+    assert tracker.percentile(95) == 0.096
+    tracker.observe(1.0)
+    assert len(tracker) == 100
+
+
+def test_breakers_are_per_endpoint_and_hedging_waits_for_samples():
+    policy = Resilience(hedge_percentile=90, latency_min_samples=10, hedge_min_delay=0.005)
+    assert policy.breaker("http://a:1/resolve/x") is policy.breaker("http://a:1/store")
+    assert policy.breaker("http://a:1/store") is not policy.breaker("http://b:1/store")
+    assert Resilience(breaker_failures=0).breaker("http://a:1/store") is None
+
+    assert policy.hedge_delay("res") is None
+    for _ in range(10):
+        policy.observe("res", 0.001)
+    assert policy.hedge_delay("res") == 0.005
+    assert Resilience().hedge_delay("res") is None
+    stats = policy.stats()
+    assert stats["latency"]["res"]["samples"] == 10
+    assert set(stats["breakers"]) == {"http://a:1", "http://b:1"}
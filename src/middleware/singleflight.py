@@ -0,0 +1,108 @@
+"""
+Singleflight: concurrent calls for the same key share one execution
+
+The first caller of a key runs the lookup, callers arriving while it is in flight
+wait for it and get its result (or its exception). Nothing is kept once the call
+returns, caching is left to the caches.
+"""
+import asyncio
+import threading
+from collections.abc import Hashable
+from typing import Any, Awaitable, Callable, Optional
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class _Counters:
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.collapsed = 0
+
+    def stats(self) -> dict:
+        """Calls made, executions run and calls that joined one in flight."""
+        return {"calls": self.calls, "executions": self.executions,
+                "collapsed": self.collapsed}
+
+
+class SingleFlight(_Counters):
+    """Thread based singleflight, callers block until the shared call returns."""
+
+    def __init__(self):
+        super().__init__()
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Run fn unless a call for key is in flight, then wait for that one.
+
+        :param key: identity of the lookup
+        :param fn: the lookup
+        :return: the result and whether it was shared with another caller
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executions += 1
+            else:
+                self.collapsed += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class AsyncSingleFlight(_Counters):
+    """asyncio singleflight, for use from a single event loop.
+
+    The shared call runs as its own task: a caller that is cancelled stops
+    waiting but does not cancel the lookup for the others.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._tasks: dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[Any]]) -> tuple[Any, bool]:
+        """Await factory() unless a call for key is in flight, then await that one.
+
+        :param key: identity of the lookup
+        :param factory: returns the lookup coroutine
+        :return: the result and whether it was shared with another caller
+        """
+        self.calls += 1
+        task = self._tasks.get(key)
+        shared = task is not None
+        if shared:
+            self.collapsed += 1
+        else:
+            self.executions += 1
+            task = self._tasks[key] = asyncio.ensure_future(factory())
+            task.add_done_callback(lambda done: self._finished(key, done))
+        return await asyncio.shield(task), shared
+
+    def _finished(self, key: Hashable, task: asyncio.Future):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            # every waiter may have gone, don't warn about an unretrieved exception
+            task.exception()
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+import pytest
+
+from .singleflight import AsyncSingleFlight, SingleFlight
+
+
+def test_concurrent_threads_share_one_call():
+    flights = SingleFlight()
+    runs = []
+    gate = threading.Event()
+
+    def lookup():
+        runs.append(1)
+        gate.wait(1)
+        return "doc"
+
+    results = []
+
+    def caller():
+        results.append(flights.do("k", lookup))
+
+    threads = [threading.Thread(target=caller) for _ in range(8)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(runs) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert all(result == "doc" for result, _ in results)
+    assert flights.stats() == {"calls": 8, "executions": 1, "collapsed": 7}
+
+
+def test_error_reaches_every_waiter_and_key_is_released():
+    flights = SingleFlight()
+    gate = threading.Event()
+
+    def failing():
+        gate.wait(1)
+        raise RuntimeError("down")
+
+    errors = []
+
+    def caller():
+        try:
+            flights.do("k", failing)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=caller) for _ in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    gate.set()
+    for t in threads:
+        t.join()
+    assert len(errors) == 3
+    assert flights.do("k", lambda: "again") == ("again", False)
+
+
+def test_async_callers_share_one_call():
+    flights = AsyncSingleFlight()
+    runs = []
+
+    async def lookup():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return "doc"
+
+    async def run():
+        return await asyncio.gather(*(flights.do("k", lookup) for _ in range(50)))
+
+    results = asyncio.run(run())
+    assert len(runs) == 1
+    assert [shared for _, shared in results].count(False) == 1
+    assert flights.stats()["collapsed"] == 49
+
+
+def test_async_error_propagates():
+    flights = AsyncSingleFlight()
+
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("down")
+
+    async def run():
+        return await asyncio.gather(*(flights.do("k", failing) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_cancelled_waiter_does_not_cancel_the_others():
+    flights = AsyncSingleFlight()
+
+    async def lookup():
+        await asyncio.sleep(0.05)
+        return "doc"
+
+    async def run():
+        first = asyncio.ensure_future(flights.do("k", lookup))
+        second = asyncio.ensure_future(flights.do("k", lookup))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(run()) == ("doc", True)
@@ -0,0 +1,383 @@
+"""
+Content stores behind /store and /retrieve
+
+FileBlobStore keeps one file per CID (the original layout), PackBlobStore appends
+documents to segment files and keeps their offsets in an LMDB index.
+"""
+import mmap
+import os
+import struct
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional
+from .db_lmdb import DB, DBError, LAYOUT_SINGLE
+from .locks import RWLock
+
+try:
+    import fcntl
+except ImportError: # windows, writers are only serialized within the process
+    fcntl = None
+
+BACKEND_FILE = "file"
+BACKEND_PACK = "pack"
+PACKROOT = "blobs"
+# a new segment is started once the active one reaches this size
+SEGMENTSIZE = 256 * 1024 * 1024
+# lookups of a record whose segment another process compacted away meanwhile
+MAPTRIES = 3
+# record header: magic, cid length, data length
+_RECORD = struct.Struct(">4sHQ")
+_MAGIC = b"VBLB"
+
+class BlobStoreError(Exception):
+    """
+    Error class for blob stores
+    """
+
+class FileBlobStore:
+    """
+    One file named after the CID per document
+    """
+    def __init__(self, root:str="."):
+        """
+        :param root: directory holding the files
+        """
+        self.root = root
+
+    def _path(self, cid:str) -> Optional[str]:
+        # CIDs come from URLs, never let one escape root
+        if not cid or cid.startswith(".") or os.sep in cid or (os.altsep and os.altsep in cid):
+            return None
+        return os.path.join(self.root, cid)
+
+    def exists(self, cid:str) -> bool:
+        """
+        True when a document is stored under cid
+
+        :param cid: content id
+        """
+        return self.path(cid) is not None
+
+    def path(self, cid:str) -> Optional[str]:
+        """
+        Path of the file holding cid, None when absent
+
+        :param cid: content id
+        """
+        path = self._path(cid)
+        if path is None or not os.path.exists(path):
+            return None
+        return path
+
+    def size(self, cid:str) -> Optional[int]:
+        """
+        Length of the document stored under cid, None when absent
+
+        :param cid: content id
+        """
+        path = self._path(cid)
+        if path is None:
+            return None
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+    def put(self, cid:str, data:bytes) -> bool:
+        """
+        Store data under cid unless already present.
+        The file is written aside and renamed in place, readers never see it half written.
+
+        :param cid: content id
+        :param data: document bytes
+        :return: False when cid was already stored
+        """
+        path = self._path(cid)
+        if path is None:
+            raise BlobStoreError(f"Invalid cid: {cid}")
+        if os.path.exists(path):
+            return False
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        return True
+
+    def get(self, cid:str) -> Optional[bytes]:
+        """
+        Return the document stored under cid, None when absent
+
+        :param cid: content id
+        """
+        path = self._path(cid)
+        if path is None:
+            return None
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, cid:str) -> bool:
+        """
+        Remove the document stored under cid
+
+        :param cid: content id
+        :return: False when it was not present
+        """
+        path = self._path(cid)
+        if path is None:
+            return False
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def close(self):
+        """
+        Nothing to release
+        """
+
+class PackBlobStore:
+    """
+    Append-only segment files with a cid -> (segment, offset, length) index in LMDB
+
+    Documents are read through a memory map of their segment. Each record keeps
+    its cid next to the data so segments stay self describing. Replaced or deleted
+    documents leave dead records behind until compact() rewrites the segments.
+    """
+    def __init__(self, root:str=PACKROOT, segment_size:int=SEGMENTSIZE, sync:bool=True):
+        """
+        :param root: directory holding the segments and the index
+        :param segment_size: roll to a new segment past this size
+        :param sync: fsync segments after every write
+        """
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self.segment_size = segment_size
+        self.sync = sync
+        self.index = DB(path=os.path.join(root, "index.db"), layout=LAYOUT_SINGLE, shared=True)
+        self._maps:dict[int, mmap.mmap] = {}
+        self._maps_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # reads and writes are shared, compaction is exclusive
+        self._rw = RWLock()
+
+    def _segment_path(self, seg:int) -> str:
+        return os.path.join(self.root, f"seg_{seg:08d}.pack")
+
+    def _segments(self) -> list[int]:
+        return sorted(int(name[4:12]) for name in os.listdir(self.root)
+                      if name.startswith("seg_") and name.endswith(".pack"))
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers of this process and, where flock exists, of other processes"""
+        with self._write_lock, open(os.path.join(self.root, "write.lock"), "ab") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _append(self, seg:int, records:list[tuple[str, bytes]]) -> list[tuple[str, str]]:
+        """Append records to a segment, returns (cid, location) per record"""
+        locations = []
+        with open(self._segment_path(seg), "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for cid, data in records:
+                cidb = cid.encode()
+                f.write(_RECORD.pack(_MAGIC, len(cidb), len(data)))
+                f.write(cidb)
+                f.write(data)
+                start = offset + _RECORD.size + len(cidb)
+                locations.append((cid, f"{seg}:{start}:{len(data)}"))
+                offset = start + len(data)
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+        return locations
+
+    def _active_segment(self) -> int:
+        segments = self._segments()
+        if not segments:
+            return 0
+        last = segments[-1]
+        if os.path.getsize(self._segment_path(last)) >= self.segment_size:
+            return last + 1
+        return last
+
+    def put(self, cid:str, data:bytes) -> bool:
+        """
+        Append data to the active segment and point cid at it, unless already present.
+        The index is only updated once the record is written.
+
+        :param cid: content id
+        :param data: document bytes
+        :return: False when cid was already stored
+        """
+        if not cid or not data:
+            raise BlobStoreError("cid and data can't be empty")
+        with self._rw.shared(), self._locked():
+            if self.exists(cid):
+                return False
+            locations = self._append(self._active_segment(), [(cid, data)])
+            try:
+                self.index.put_many(locations)
+            except DBError as e:
+                raise BlobStoreError(f"Can't index {cid}") from e
+        return True
+
+    def _location(self, cid:str) -> Optional[tuple[int, int, int]]:
+        try:
+            seg, start, length = self.index.get(cid).split(":")
+        except DBError:
+            return None
+        return int(seg), int(start), int(length)
+
+    def _map(self, seg:int, end:int) -> mmap.mmap:
+        with self._maps_lock:
+            mapped = self._maps.get(seg)
+            # the active segment grows, remap when a record lies past the mapped end
+            if mapped is None or len(mapped) < end:
+                with open(self._segment_path(seg), "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[seg] = mapped
+            return mapped
+
+    def exists(self, cid:str) -> bool:
+        """
+        True when a document is stored under cid
+
+        :param cid: content id
+        """
+        return self._location(cid) is not None
+
+    def size(self, cid:str) -> Optional[int]:
+        """
+        Length of the document stored under cid, from the index, None when absent
+
+        :param cid: content id
+        """
+        location = self._location(cid)
+        return None if location is None else location[2]
+
+    @contextmanager
+    def view(self, cid:str) -> Iterator[Optional[memoryview]]:
+        """
+        Yields a memoryview of the document in its mapped segment, None when absent.
+        The view is only valid inside the with block.
+
+        :param cid: content id
+        """
+        with self._rw.shared():
+            found = self._mapped(cid)
+            if found is None:
+                yield None
+                return
+            mapped, start, length = found
+            with memoryview(mapped) as whole:
+                with whole[start:start + length] as part:
+                    yield part
+
+    def _mapped(self, cid:str) -> Optional[tuple[mmap.mmap, int, int]]:
+        """The mapped segment holding cid with the record's offset and length"""
+        for _ in range(MAPTRIES):
+            location = self._location(cid)
+            if location is None:
+                return None
+            seg, start, length = location
+            try:
+                return self._map(seg, start + length), start, length
+            except FileNotFoundError:
+                # another process compacted the segment away after the lookup, the
+                # index already points at the rewritten record: look it up again
+                continue
+        return None
+
+    def get(self, cid:str) -> Optional[bytes]:
+        """
+        Return the document stored under cid, None when absent
+
+        :param cid: content id
+        """
+        with self.view(cid) as part:
+            return None if part is None else bytes(part)
+
+    def delete(self, cid:str) -> bool:
+        """
+        Drop cid from the index, its record is reclaimed by compact()
+
+        :param cid: content id
+        :return: False when it was not present
+        """
+        with self._rw.shared(), self._locked():
+            return self.index.delete(cid)
+
+    def compact(self) -> dict:
+        """
+        Rewrite the live documents into fresh segments and delete the old ones.
+        Blocks readers and writers of this process while running, other processes
+        using the same root should be stopped.
+
+        :return: segment and byte counts before and after
+        """
+        with self._rw.exclusive(), self._locked():
+            old = self._segments()
+            before = sum(os.path.getsize(self._segment_path(seg)) for seg in old)
+            entries = list(self.index.iterate())
+            seg = old[-1] + 1 if old else 0
+            size = 0
+            records:list[tuple[str, bytes]] = []
+            locations = []
+            for cid, location in entries:
+                src, start, length = (int(x) for x in location.split(":"))
+                data = self._map(src, start + length)[start:start + length]
+                if records and size + length > self.segment_size:
+                    locations += self._append(seg, records)
+                    seg, size, records = seg + 1, 0, []
+                records.append((cid, data))
+                size += _RECORD.size + len(cid) + length
+            if records:
+                locations += self._append(seg, records)
+            if locations:
+                self.index.put_many(locations)
+            self._close_maps()
+            for src in old:
+                os.remove(self._segment_path(src))
+            new = self._segments()
+            after = sum(os.path.getsize(self._segment_path(s)) for s in new)
+        return {"blobs": len(entries), "segments_before": len(old), "bytes_before": before,
+                "segments_after": len(new), "bytes_after": after}
+
+    def _close_maps(self):
+        with self._maps_lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
+
+    def close(self):
+        """
+        Unmap the segments and close the index
+        """
+        with self._rw.exclusive():
+            self._close_maps()
+            self.index.close()
+
+def open_blob_store(backend:str=BACKEND_FILE, root:Optional[str]=None):
+    """
+    Open the blob store selected by backend
+
+    :param backend: BACKEND_FILE or BACKEND_PACK
+    :param root: directory of the store, the backend default when None
+    """
+    if backend == BACKEND_FILE:
+        return FileBlobStore(root or ".")
+    if backend == BACKEND_PACK:
+        return PackBlobStore(root or PACKROOT)
+    raise BlobStoreError(f"Unknown blob backend: {backend}")
@@ -0,0 +1,117 @@
+"""
+Tests for the file and pack blob stores
+"""
+import multiprocessing
+import os
+import tempfile
+import pytest
+from .blobstore import (FileBlobStore, PackBlobStore, BlobStoreError, open_blob_store,
+                        BACKEND_PACK)
+from .tools import compact_pack
+
+@pytest.fixture
+def pack():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blobs = PackBlobStore(os.path.join(tmpdir, "blobs"), segment_size=1024, sync=False)
+        yield blobs
+        blobs.close()
+
+def test_file_store_round_trip():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blobs = FileBlobStore(tmpdir)
+        assert blobs.put("cid_1", b'{"a": 1}')
+        assert not blobs.put("cid_1", b'{"a": 1}')
+        assert os.listdir(tmpdir) == ["cid_1"]
+        assert blobs.exists("cid_1")
+        assert blobs.get("cid_1") == b'{"a": 1}'
+        assert blobs.get("cid_2") is None
+        assert blobs.size("cid_1") == 8 and blobs.size("cid_2") is None
+        assert blobs.delete("cid_1")
+        assert not blobs.exists("cid_1")
+
+def test_file_store_rejects_paths():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blobs = FileBlobStore(tmpdir)
+        assert blobs.get("../etc/passwd") is None
+        assert blobs.get(".hidden") is None
+        with pytest.raises(BlobStoreError):
+            blobs.put("a/b", b"x")
+
+def test_pack_round_trip_and_view(pack):
+    pack.put("cid_1", b"first")
+    pack.put("cid_2", b"second")
+    assert pack.get("cid_1") == b"first"
+    assert pack.exists("cid_2")
+    assert pack.get("cid_3") is None
+    assert pack.size("cid_2") == 6 and pack.size("cid_3") is None
+    with pack.view("cid_2") as view:
+        assert isinstance(view, memoryview)
+        assert bytes(view) == b"second"
+
+def test_pack_rolls_segments_and_reopens(pack):
+    for i in range(20):
+        pack.put(f"cid_{i}", bytes([i]) * 200)
+    assert len(pack._segments()) > 1
+    root = pack.root
+    pack.close()
+    reopened = PackBlobStore(root, segment_size=1024, sync=False)
+    try:
+        assert all(reopened.get(f"cid_{i}") == bytes([i]) * 200 for i in range(20))
+    finally:
+        reopened.close()
+
+def test_pack_compaction_drops_dead_records(pack):
+    for i in range(10):
+        pack.put(f"cid_{i}", b"x" * 200)
+    assert not pack.put("cid_0", b"x" * 200)
+    pack.delete("cid_0")
+    assert pack.put("cid_0", b"y" * 200)
+    for i in range(1, 6):
+        assert pack.delete(f"cid_{i}")
+    root = pack.root
+    pack.close()
+    stats = compact_pack(root)
+    assert stats["blobs"] == 5
+    assert stats["bytes_after"] < stats["bytes_before"]
+    reopened = PackBlobStore(root)
+    try:
+        assert reopened.get("cid_0") == b"y" * 200
+        assert reopened.get("cid_9") == b"x" * 200
+        assert reopened.get("cid_3") is None
+    finally:
+        reopened.close()
+
+def test_read_racing_compaction_by_another_store(pack):
+    for i in range(10):
+        pack.put(f"cid_{i}", bytes([i]) * 200)
+    for i in range(1, 6):
+        pack.delete(f"cid_{i}")
+    old = pack._segments()
+    location = pack._location
+    compacted = []
+
+    def compacted_after_lookup(cid):
+        found = location(cid)
+        if not compacted:
+            # the record's segment goes away between the lookup and the read
+            proc = multiprocessing.get_context("spawn").Process(target=compact_pack,
+                                                                args=(pack.root,))
+            proc.start()
+            proc.join()
+            compacted.append(proc.exitcode)
+        return found
+
+    pack._location = compacted_after_lookup
+    assert pack.get("cid_9") == bytes([9]) * 200
+    assert compacted == [0]
+    assert not set(old) & set(pack._segments())
+    assert pack.get("cid_0") == bytes([0]) * 200
+    assert pack.get("cid_3") is None
+
+def test_open_blob_store():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        blobs = open_blob_store(BACKEND_PACK, os.path.join(tmpdir, "p"))
+        assert isinstance(blobs, PackBlobStore)
+        blobs.close()
+        with pytest.raises(BlobStoreError):
+            open_blob_store("tape")
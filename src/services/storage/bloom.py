@@ -0,0 +1,112 @@
+"""
+Bloom filter answering "definitely absent" for registry keys without touching LMDB
+"""
+import hashlib
+import math
+import os
+import struct
+
+# capacity, fp_rate, bits, hashes, count, last_txnid
+_HEADER = struct.Struct(">QdQIQQ")
+_MAGIC = b"VBLM1"
+
+class BloomFilter:
+    """
+    Fixed size Bloom filter sized for `capacity` keys at `fp_rate`
+
+    Lookups are lock free, adds are not synchronized: callers serialize them.
+
+    :var count: keys added so far
+    :var txnid: lmdb transaction id the content matches, used when persisting
+    """
+    def __init__(self, capacity:int, fp_rate:float):
+        """
+        :param capacity: expected number of keys
+        :param fp_rate: target false positive rate at capacity
+        """
+        if not 0 < fp_rate < 1:
+            raise ValueError(f"fp_rate must be in (0, 1): {fp_rate}")
+        self.capacity = max(capacity, 1)
+        self.fp_rate = fp_rate
+        self.num_bits = max(8, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+        self.txnid = 0
+
+    def _positions(self, key:bytes):
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.num_hashes):
+            yield (h1 + i * h2) % self.num_bits
+
+    def add(self, key:bytes):
+        """
+        Add a key
+
+        :param key: key bytes
+        """
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key:bytes) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def estimated_fp_rate(self) -> float:
+        """
+        False positive rate expected with the keys added so far
+        """
+        return (1 - math.exp(-self.num_hashes * self.count / self.num_bits)) ** self.num_hashes
+
+    def stats(self) -> dict:
+        """
+        Size, fill and false positive rates
+        """
+        return {
+            "capacity": self.capacity,
+            "count": self.count,
+            "size_bytes": len(self.bits),
+            "hashes": self.num_hashes,
+            "target_fp_rate": self.fp_rate,
+            "estimated_fp_rate": self.estimated_fp_rate(),
+        }
+
+    def save(self, path:str):
+        """
+        Write the filter to path atomically
+
+        :param path: destination file
+        """
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_MAGIC)
+            f.write(_HEADER.pack(self.capacity, self.fp_rate, self.num_bits,
+                                 self.num_hashes, self.count, self.txnid))
+            f.write(self.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path:str) -> "BloomFilter":
+        """
+        Read a filter written by save
+
+        :param path: source file
+        :raises ValueError: when the file is not a saved filter
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        if not data.startswith(_MAGIC):
+            raise ValueError(f"Not a bloom filter file: {path}")
+        offset = len(_MAGIC)
+        capacity, fp_rate, num_bits, num_hashes, count, txnid = _HEADER.unpack_from(data, offset)
+        bloom = cls(capacity, fp_rate)
+        bits = data[offset + _HEADER.size:]
+        if num_bits != bloom.num_bits or num_hashes != bloom.num_hashes \
+                or len(bits) != len(bloom.bits):
+            raise ValueError(f"Corrupted bloom filter file: {path}")
+        bloom.bits = bytearray(bits)
+        bloom.count = count
+        bloom.txnid = txnid
+        return bloom
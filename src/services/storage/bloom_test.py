@@ -0,0 +1,41 @@
+"""
+Tests for the missing key Bloom filter
+"""
+import os
+import tempfile
+import pytest
+from .bloom import BloomFilter
+
+def test_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, fp_rate=0.01)
+    keys = [f"did:verity:{i}".encode() for i in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+
+def test_false_positive_rate_close_to_target():
+    bloom = BloomFilter(capacity=2000, fp_rate=0.01)
+    for i in range(2000):
+        bloom.add(f"in:{i}".encode())
+    false_positives = sum(f"out:{i}".encode() in bloom for i in range(20000))
+    assert false_positives / 20000 < 0.03
+    assert bloom.stats()["estimated_fp_rate"] == pytest.approx(0.01, rel=0.5)
+
+def test_save_and_load_round_trip():
+    bloom = BloomFilter(capacity=100, fp_rate=0.001)
+    bloom.add(b"a")
+    bloom.txnid = 42
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "bloom.bin")
+        bloom.save(path)
+        loaded = BloomFilter.load(path)
+        assert b"a" in loaded
+        assert (loaded.count, loaded.txnid) == (1, 42)
+        with open(path, "wb") as f:
+            f.write(b"junk")
+        with pytest.raises(ValueError):
+            BloomFilter.load(path)
+
+def test_invalid_fp_rate():
+    with pytest.raises(ValueError):
+        BloomFilter(capacity=10, fp_rate=1.5)
@@ -0,0 +1,187 @@
+"""
+Thread safe LRU cache bounded by bytes and entries, used by DB
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Optional
+
+# rough per entry bookkeeping cost (OrderedDict node, tuple, object headers)
+ENTRY_OVERHEAD = 96
+# keys whose last write generation is remembered for fill
+WRITE_LOG_SIZE = 4096
+
+class _Missing:
+    """Marker cached for keys known to be absent"""
+    def __repr__(self):
+        return "MISSING"
+
+MISSING = _Missing()
+
+class LRUCache:
+    """
+    Least recently used cache sized in bytes
+
+    Entries are evicted from the least recently used end once either
+    max_bytes or max_entries is exceeded. Keys known to be absent can be
+    cached with set_missing so repeated misses skip the backing store.
+    All operations take a lock, FastAPI runs sync endpoints in a threadpool.
+
+    Writes bump a generation and remember it per key. A reader that loaded a
+    value from the backing store inserts it with fill and the generation it saw
+    before the load, the fill is dropped when a write to the same key landed in
+    between and may have been newer. The last WRITE_LOG_SIZE written keys are
+    remembered, fills older than the ones forgotten are dropped too.
+
+    :var generation: count of writes (set, set_missing, discard, clear)
+    :var hits: lookups answered with a value
+    :var negative_hits: lookups answered with MISSING
+    :var misses: lookups not in cache
+    :var evictions: entries dropped to respect the budget
+    """
+    def __init__(self, max_bytes:int, max_entries:int):
+        """
+        :param max_bytes: byte budget for keys + values + ENTRY_OVERHEAD
+        :param max_entries: maximum number of entries
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size_bytes = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        # key -> generation of its last write, oldest first
+        self._writes:OrderedDict[bytes, int] = OrderedDict()
+        # fills taken before this generation can't be checked against _writes
+        self._floor = 0
+        self._data:OrderedDict[bytes, tuple[Any, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key:bytes) -> Optional[Any]:
+        """
+        Return the cached value, MISSING for a cached miss, None when not cached
+
+        :param key: key to look up
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if entry[0] is MISSING:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return entry[0]
+
+    def set(self, key:bytes, value:Any):
+        """
+        Insert or refresh a value, evicting least recently used entries
+
+        :param key: key to store
+        :param value: str or bytes value
+        """
+        size = len(key) + len(value) + ENTRY_OVERHEAD
+        with self._lock:
+            self._written(key)
+            self._insert(key, value, size)
+
+    def set_missing(self, key:bytes):
+        """
+        Remember that key is absent from the backing store
+
+        :param key: missing key
+        """
+        with self._lock:
+            self._written(key)
+            self._insert(key, MISSING, len(key) + ENTRY_OVERHEAD)
+
+    def fill(self, key:bytes, value:Any, generation:int) -> bool:
+        """
+        Insert a value read from the backing store unless key was written after the read
+
+        :param key: key read
+        :param value: value read, MISSING when the key was absent
+        :param generation: self.generation taken before the read
+        :return: False when the value was dropped
+        """
+        size = len(key) + ENTRY_OVERHEAD
+        if value is not MISSING:
+            size += len(value)
+        with self._lock:
+            if generation < self._floor or self._writes.get(key, 0) > generation:
+                return False
+            self._insert(key, value, size)
+            return True
+
+    def discard(self, key:bytes):
+        """
+        Drop key from the cache if present
+
+        :param key: key to drop
+        """
+        with self._lock:
+            self._written(key)
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self.size_bytes -= entry[1]
+
+    def clear(self):
+        """
+        Drop every entry, counters are kept
+        """
+        with self._lock:
+            self.generation += 1
+            # every key may have changed
+            self._floor = self.generation
+            self._writes.clear()
+            self._data.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> dict:
+        """
+        Snapshot of size and hit/miss/eviction counters
+        """
+        with self._lock:
+            lookups = self.hits + self.negative_hits + self.misses
+            return {
+                "entries": len(self._data),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+            }
+
+    def _written(self, key:bytes):
+        self.generation += 1
+        self._writes[key] = self.generation
+        self._writes.move_to_end(key)
+        if len(self._writes) > WRITE_LOG_SIZE:
+            _, self._floor = self._writes.popitem(last=False)
+
+    def _insert(self, key:bytes, value:Any, size:int):
+        old = self._data.pop(key, None)
+        if old is not None:
+            self.size_bytes -= old[1]
+        if size > self.max_bytes:
+            return
+        self._data[key] = (value, size)
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes or len(self._data) > self.max_entries:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.size_bytes -= evicted
+            self.evictions += 1
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
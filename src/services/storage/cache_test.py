@@ -0,0 +1,89 @@
+"""
+Tests for the byte budgeted LRU cache
+"""
+import threading
+from . import cache as cache_module
+from .cache import LRUCache, MISSING, ENTRY_OVERHEAD
+
+def test_get_counts_hits_and_misses():
+    cache = LRUCache(max_bytes=10_000, max_entries=10)
+    cache.set(b"k", "v")
+    assert cache.get(b"k") == "v"
+    assert cache.get(b"other") is None
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+def test_byte_budget_evicts_least_recently_used():
+    entry = 1 + 10 + ENTRY_OVERHEAD
+    cache = LRUCache(max_bytes=2 * entry, max_entries=100)
+    cache.set(b"a", "x" * 10)
+    cache.set(b"b", "x" * 10)
+    cache.get(b"a")
+    cache.set(b"c", "x" * 10)
+    assert b"a" in cache
+    assert b"b" not in cache
+    assert cache.size_bytes == 2 * entry
+    assert cache.stats()["evictions"] == 1
+
+def test_value_larger_than_budget_is_not_cached():
+    cache = LRUCache(max_bytes=ENTRY_OVERHEAD + 4, max_entries=10)
+    cache.set(b"a", "x" * 100)
+    assert b"a" not in cache
+    assert cache.size_bytes == 0
+
+def test_missing_marker():
+    cache = LRUCache(max_bytes=10_000, max_entries=10)
+    cache.set_missing(b"gone")
+    assert cache.get(b"gone") is MISSING
+    cache.set(b"gone", "back")
+    assert cache.get(b"gone") == "back"
+    assert cache.stats()["negative_hits"] == 1
+
+def test_concurrent_access_keeps_accounting_consistent():
+    cache = LRUCache(max_bytes=50 * (4 + 8 + ENTRY_OVERHEAD), max_entries=1000)
+
+    def worker(n):
+        for i in range(2000):
+            key = f"{(i * n) % 200:04d}".encode()
+            cache.set(key, "v" * 8)
+            cache.get(key)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(1, 9)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.size_bytes == len(cache) * (4 + 8 + ENTRY_OVERHEAD)
+    assert cache.size_bytes <= cache.max_bytes
+
+def test_fill_dropped_after_a_write():
+    cache = LRUCache(max_bytes=10_000, max_entries=10)
+    generation = cache.generation
+    cache.set(b"k", "new")
+    assert not cache.fill(b"k", "old", generation)
+    assert cache.get(b"k") == "new"
+    assert cache.fill(b"other", MISSING, cache.generation)
+    assert cache.get(b"other") is MISSING
+
+def test_fill_kept_over_writes_to_other_keys():
+    cache = LRUCache(max_bytes=10_000, max_entries=10)
+    generation = cache.generation
+    cache.set(b"a", "1")
+    cache.set_missing(b"b")
+    cache.discard(b"c")
+    assert cache.fill(b"k", "v", generation)
+    assert cache.get(b"k") == "v"
+    generation = cache.generation
+    cache.clear()
+    assert not cache.fill(b"k", "v", generation)
+
+def test_fill_dropped_once_its_writes_are_forgotten(monkeypatch):
+    monkeypatch.setattr(cache_module, "WRITE_LOG_SIZE", 2)
+    cache = LRUCache(max_bytes=10_000, max_entries=10)
+    generation = cache.generation
+    for key in (b"k", b"a", b"b"):
+        cache.set(key, "new")
+    # the write to k fell out of the log, the fill can't be proven fresh
+    assert not cache.fill(b"k", "old", generation)
+    assert cache.fill(b"k", "new", cache.generation)
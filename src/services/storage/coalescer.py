@@ -0,0 +1,86 @@
+"""
+Group commit for registrations: writes arriving close together share one transaction
+"""
+import asyncio
+from typing import Callable, Optional, Union
+from .db_lmdb import DBError
+
+Item = tuple[Union[bytes,str], Union[bytes,str]]
+
+class WriteCoalescer:
+    """
+    Gathers puts for up to `window` seconds or `max_items` items and commits
+    them with a single put_many call run off the event loop.
+
+    Every waiting caller gets the result of its own item. Batches commit one at
+    a time in the order they were flushed. The timer and futures belong to the
+    event loop of the first put, use one coalescer per loop.
+    """
+    def __init__(self, put_many:Callable[[list[Item]], list[Optional[DBError]]],
+                 window:float, max_items:int):
+        """
+        :param put_many: DB.put_many or an equivalent callable
+        :param window: seconds to wait for more items after the first one
+        :param max_items: commit as soon as this many items are pending
+        """
+        self.put_many = put_many
+        self.window = window
+        self.max_items = max_items
+        self.batches = 0
+        self.items = 0
+        self._pending:list[tuple[Item, asyncio.Future]] = []
+        self._timer:Optional[asyncio.TimerHandle] = None
+        self._commits:set[asyncio.Task] = set()
+        # commits run in flush order, a later batch never lands first
+        self._commit_lock = asyncio.Lock()
+
+    async def put(self, key:Union[bytes,str], value:Union[bytes,str]) -> Optional[DBError]:
+        """
+        Queue a put and wait for the batch holding it to commit
+
+        :param key: key to use
+        :param value: value to store
+        :return: None when written, the DBError of the item otherwise
+        :raises DBError: when the whole batch failed to commit
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append(((key, value), fut))
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await fut
+
+    def stats(self) -> dict:
+        """
+        Number of batches committed and items they held
+        """
+        return {"batches": self.batches, "items": self.items,
+                "avg_batch": self.items / self.batches if self.batches else 0.0}
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._commit(batch))
+            # keep a reference until done, the loop only holds weak ones
+            self._commits.add(task)
+            task.add_done_callback(self._commits.discard)
+
+    async def _commit(self, batch:list[tuple[Item, asyncio.Future]]):
+        try:
+            async with self._commit_lock:
+                errors = await asyncio.to_thread(self.put_many, [item for item, _ in batch])
+        except Exception as e: # pylint: disable=broad-exception-caught
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(batch)
+        for (_, fut), error in zip(batch, errors):
+            if not fut.done():
+                fut.set_result(error)
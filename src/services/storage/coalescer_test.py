@@ -0,0 +1,80 @@
+"""
+Tests for the registration write coalescer
+"""
+import asyncio
+import time
+import pytest
+from .coalescer import WriteCoalescer
+from .db_lmdb import DBError
+
+class FakeDB:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+
+    def put_many(self, items):
+        if self.fail:
+            raise DBError("disk on fire")
+        self.batches.append(list(items))
+        return [None if value else DBError("empty") for _, value in items]
+
+def test_concurrent_puts_share_one_batch():
+    db = FakeDB()
+    coalescer = WriteCoalescer(db.put_many, window=0.01, max_items=1000)
+
+    async def run():
+        return await asyncio.gather(*(coalescer.put(f"k{i}", "v") for i in range(150)))
+
+    results = asyncio.run(run())
+    assert results == [None] * 150
+    assert len(db.batches) == 1
+    assert coalescer.stats()["items"] == 150
+
+def test_max_items_splits_batches():
+    db = FakeDB()
+    coalescer = WriteCoalescer(db.put_many, window=10, max_items=4)
+
+    async def run():
+        return await asyncio.gather(*(coalescer.put(f"k{i}", "v") for i in range(8)))
+
+    asyncio.run(run())
+    assert [len(b) for b in db.batches] == [4, 4]
+
+def test_per_item_errors_are_returned():
+    coalescer = WriteCoalescer(FakeDB().put_many, window=0.001, max_items=10)
+
+    async def run():
+        return await asyncio.gather(coalescer.put("a", "v"), coalescer.put("b", ""))
+
+    ok, failed = asyncio.run(run())
+    assert ok is None
+    assert isinstance(failed, DBError)
+
+def test_batch_failure_raises_for_every_caller():
+    coalescer = WriteCoalescer(FakeDB(fail=True).put_many, window=0.001, max_items=10)
+
+    async def run():
+        return await asyncio.gather(coalescer.put("a", "v"), coalescer.put("b", "v"),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, DBError) for r in results)
+    with pytest.raises(DBError):
+        asyncio.run(coalescer.put("c", "v"))
+
+def test_batches_commit_in_flush_order():
+    committed = []
+
+    def put_many(items):
+        # the first batch is the slowest to write
+        if not committed and items[0][0] == "k0":
+            time.sleep(0.05)
+        committed.append([key for key, _ in items])
+        return [None] * len(items)
+    coalescer = WriteCoalescer(put_many, window=10, max_items=2)
+
+    async def run():
+        return await asyncio.gather(*(coalescer.put(f"k{i}", "v") for i in range(6)))
+
+    asyncio.run(run())
+    assert committed == [["k0", "k1"], ["k2", "k3"], ["k4", "k5"]]
@@ -0,0 +1,187 @@
+"""
+Merkle DAG layout for large uploads
+
+The body is cut into CHUNKSIZE chunks, each stored under its own raw CID. Up to
+FANOUT links are grouped into a dag-json node `{"links":[{"cid","size"}],"size"}`,
+nodes are grouped the same way until a single root remains. Building and reading
+keep one node per tree level in memory, never the whole document.
+"""
+import json
+from typing import Iterator, Optional, Union
+from src.core.crypto import (canonical_json_cid, compute_cid, decode_cid, verify_cid,
+                             CODEC_DAG_JSON)
+from .blobstore import FileBlobStore, PackBlobStore
+
+CHUNKSIZE = 256 * 1024
+FANOUT = 174
+
+Link = tuple[str, int]
+Blobs = Union[FileBlobStore, PackBlobStore]
+
+class DAGError(Exception):
+    """
+    Error class for missing or malformed DAG nodes
+    """
+
+def is_node(cid:str) -> bool:
+    """
+    True when cid names a DAG node rather than stored bytes
+
+    :param cid: content id
+    """
+    try:
+        return decode_cid(cid)[0] == CODEC_DAG_JSON
+    except ValueError:
+        return False
+
+class DAGBuilder:
+    """
+    Builds the DAG bottom up while chunks arrive.
+
+    levels[0] holds the pending leaf links, levels[i] the pending links to nodes
+    of height i. A level is written as a node as soon as it reaches FANOUT links.
+    """
+    def __init__(self, blobs:Blobs, chunk_size:int=CHUNKSIZE, fanout:int=FANOUT):
+        """
+        :param blobs: store receiving chunks and nodes
+        :param chunk_size: bytes per leaf
+        :param fanout: links per node
+        """
+        if chunk_size < 1 or fanout < 2:
+            raise ValueError("chunk_size must be positive and fanout at least 2")
+        self.blobs = blobs
+        self.chunk_size = chunk_size
+        self.fanout = fanout
+        self.size = 0
+        self.new_blocks = 0
+        self._levels:list[list[Link]] = [[]]
+        self._buf = bytearray()
+
+    def write(self, data:bytes):
+        """
+        Feed the next part of the body, full chunks are stored right away
+
+        :param data: bytes of any length
+        """
+        self._buf += data
+        while len(self._buf) >= self.chunk_size:
+            self._add_leaf(bytes(self._buf[:self.chunk_size]))
+            del self._buf[:self.chunk_size]
+
+    def finish(self) -> str:
+        """
+        Store the last partial chunk and the remaining nodes
+
+        :return: root CID
+        """
+        if self._buf:
+            self._add_leaf(bytes(self._buf))
+            self._buf.clear()
+        carry:Optional[Link] = None
+        top = len(self._levels) - 1
+        for height, links in enumerate(self._levels):
+            if carry is not None:
+                links.append(carry)
+            if height == top:
+                if height > 0 and len(links) == 1:
+                    return links[0][0]
+                return self._add_node(links)[0]
+            carry = self._add_node(links) if links else None
+        raise AssertionError("unreachable")
+
+    def _add_leaf(self, chunk:bytes):
+        cid = compute_cid(chunk)
+        self.new_blocks += self.blobs.put(cid, chunk)
+        self.size += len(chunk)
+        self._push(0, (cid, len(chunk)))
+
+    def _push(self, height:int, link:Link):
+        if height == len(self._levels):
+            self._levels.append([])
+        links = self._levels[height]
+        links.append(link)
+        if len(links) == self.fanout:
+            self._levels[height] = []
+            self._push(height + 1, self._add_node(links))
+
+    def _add_node(self, links:list[Link]) -> Link:
+        total = sum(length for _, length in links)
+        _, data = canonical_json_cid({"links": [{"cid": c, "size": length} for c, length in links],
+                                      "size": total})
+        # canonical_json_cid tags its CID as json, nodes are dag-json
+        cid = compute_cid(data, CODEC_DAG_JSON)
+        self.new_blocks += self.blobs.put(cid, bytes(data))
+        return cid, total
+
+def _load(blobs:Blobs, cid:str) -> bytes:
+    data = blobs.get(cid)
+    if data is None:
+        raise DAGError(f"Missing block {cid}")
+    return data
+
+def _links(blobs:Blobs, cid:str) -> list[Link]:
+    try:
+        node = json.loads(_load(blobs, cid))
+        return [(link["cid"], int(link["size"])) for link in node["links"]]
+    except (ValueError, KeyError, TypeError) as e:
+        raise DAGError(f"Malformed node {cid}") from e
+
+def size(blobs:Blobs, cid:str) -> Optional[int]:
+    """
+    Total bytes under cid, None when it isn't stored
+
+    :param blobs: blob store
+    :param cid: root CID, a plain blob is its own single chunk
+    """
+    if not is_node(cid):
+        # a length lookup, the chunk itself is read once, when it is streamed
+        return blobs.size(cid)
+    data = blobs.get(cid)
+    if data is None:
+        return None
+    try:
+        return int(json.loads(data)["size"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise DAGError(f"Malformed node {cid}") from e
+
+def read(blobs:Blobs, cid:str, start:int=0, end:Optional[int]=None) -> Iterator[bytes]:
+    """
+    Yield the bytes [start, end) under cid chunk by chunk, skipping subtrees
+    outside the range
+
+    :param blobs: blob store
+    :param cid: root CID
+    :param start: first byte
+    :param end: byte after the last one, None for the end of the content
+    """
+    if end is not None and end <= start:
+        return
+    if not is_node(cid):
+        yield _load(blobs, cid)[start:end]
+        return
+    offset = 0
+    for child, child_size in _links(blobs, cid):
+        child_end = offset + child_size
+        if child_end > start and (end is None or offset < end):
+            yield from read(blobs, child, max(start - offset, 0),
+                            None if end is None or end >= child_end else end - offset)
+        offset = child_end
+        if end is not None and offset >= end:
+            return
+
+def verify(blobs:Blobs, cid:str) -> bool:
+    """
+    Check every block under cid against its CID
+
+    :param blobs: blob store
+    :param cid: root CID
+    """
+    data = blobs.get(cid)
+    if data is None or not verify_cid(cid, data):
+        return False
+    if not is_node(cid):
+        return True
+    try:
+        return all(verify(blobs, child) for child, _ in _links(blobs, cid))
+    except DAGError:
+        return False
@@ -0,0 +1,63 @@
+"""
+Tests for the Merkle DAG layout
+"""
+import os
+import tempfile
+import pytest
+from .blobstore import FileBlobStore
+from . import dag
+
+@pytest.fixture
+def blobs():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        yield FileBlobStore(tmpdir)
+
+def _store(blobs, data, chunk_size=4, fanout=3, part=5):
+    builder = dag.DAGBuilder(blobs, chunk_size=chunk_size, fanout=fanout)
+    for i in range(0, len(data), part):
+        builder.write(data[i:i + part])
+    return builder.finish(), builder
+
+@pytest.mark.parametrize("length", [0, 1, 4, 12, 13, 36, 37, 200])
+def test_round_trip(blobs, length):
+    data = os.urandom(length)
+    cid, builder = _store(blobs, data)
+    assert dag.is_node(cid)
+    assert builder.size == length
+    assert dag.size(blobs, cid) == length
+    assert b"".join(dag.read(blobs, cid)) == data
+    assert dag.verify(blobs, cid)
+
+def test_ranges_skip_to_the_right_chunks(blobs):
+    data = bytes(range(256)) * 2
+    cid, _ = _store(blobs, data)
+    for start, end in [(0, 1), (3, 5), (4, 8), (100, 400), (511, 512), (0, 512), (7, None)]:
+        assert b"".join(dag.read(blobs, cid, start, end)) == data[start:end]
+    assert b"".join(dag.read(blobs, cid, 10, 10)) == b""
+
+def test_same_content_same_root_and_shared_chunks(blobs):
+    data = b"abcd" * 50
+    first, builder = _store(blobs, data)
+    assert builder.new_blocks > 0
+    again, builder = _store(blobs, data, part=7)
+    assert again == first
+    assert builder.new_blocks == 0
+
+def test_verify_detects_tampering(blobs):
+    cid, _ = _store(blobs, b"0123456789abcdef")
+    leaf = next(name for name in os.listdir(blobs.root) if not dag.is_node(name))
+    with open(os.path.join(blobs.root, leaf), "wb") as f:
+        f.write(b"XXXX")
+    assert not dag.verify(blobs, cid)
+
+def test_plain_blob_reads_as_one_chunk(blobs):
+    blobs.put("cid_plain", b"hello world")
+    assert not dag.is_node("cid_plain")
+    assert dag.size(blobs, "cid_plain") == 11
+    assert b"".join(dag.read(blobs, "cid_plain", 6)) == b"world"
+    assert dag.size(blobs, "cid_missing") is None
+
+def test_plain_blob_size_does_not_read_it(blobs, monkeypatch):
+    blobs.put("cid_plain", b"hello world")
+    monkeypatch.setattr(blobs, "get", lambda cid: pytest.fail("size read the blob"))
+    assert dag.size(blobs, "cid_plain") == 11
@@ -1,18 +1,57 @@
 """
 Wrapper around lmdb for storage(store + index)
 """
-from collections import OrderedDict
-from typing import Optional, Union
+import os
+import threading
+from contextlib import ExitStack, contextmanager
+from typing import Iterable, Iterator, Optional, Union
 import lmdb as tool
 from src.core import dighash
+from .cache import LRUCache, MISSING
+from .bloom import BloomFilter
+from .locks import RWLock
 
-CACHESIZE = 30
+CACHESIZE = 4096
+CACHEBYTES = 4 * 1024 * 1024
+# split: value table and key index live in two environments (store.db, index.db)
+# single: both are named sub-databases of one environment, written in one transaction
+LAYOUT_SPLIT = "split"
+LAYOUT_SINGLE = "single"
+# initial map size (lmdb default), doubled on MapFullError up to MAXMAPSIZE
+MAPSIZE = 10 * 1024 * 1024
+MAXMAPSIZE = 1 << 40
+MAXREADERS = 126
+# index keys read per transaction by iterate
+ITERATECHUNK = 1024
+# bloom filter of index keys, rebuilt with twice the keys when full
+BLOOMFPRATE = 0.01
+BLOOMCAPACITY = 100_000
 
 class DBError(Exception):
     """
     Error class for DB
     """
 
+class WriteBatch:
+    """
+    Pending puts collected by DB.write_batch
+
+    :var items: (key, value) pairs queued for the commit
+    :var errors: per-item result of the commit, None when written
+    """
+    def __init__(self):
+        self.items:list[tuple[Union[bytes,str],Union[bytes,str]]] = []
+        self.errors:list[Optional[DBError]] = []
+
+    def put(self, key:Union[bytes,str], value:Union[bytes,str]):
+        """
+        Queue a key/value pair for the batch commit
+
+        :param key: key to use
+        :param value: value to store
+        """
+        self.items.append((key, value))
+
 class DB:
     """
     DB wrapper around lmdb
@@ -21,52 +60,354 @@ class DB:
     :var prefix_bytes: Description
     :vartype prefix_bytes: Any
     """
-    def __init__(self, path="store.db", index_path="index.db", max_dbs=2):
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, path="store.db", index_path="index.db", max_dbs=2, layout=LAYOUT_SPLIT,
+                 cache_bytes=CACHEBYTES, cache_size=CACHESIZE, map_size=MAPSIZE,
+                 readers=MAXREADERS, sync=True, metasync=True, writemap=False, shared=False,
+                 bloom_fp_rate=BLOOMFPRATE, bloom_path=None):
         """
         Initialize the wrapper
-        
-        :param self: Description
-        :param path: Path for store
-        :param index_path: Path for index
+
+        :param path: Path for store (the whole DB with the single layout)
+        :param index_path: Path for index, unused with the single layout
         :param max_dbs: Max number of db
+        :param layout: LAYOUT_SPLIT or LAYOUT_SINGLE
+        :param cache_bytes: byte budget of the read cache
+        :param cache_size: max entries of the read cache
+        :param map_size: initial map size in bytes, doubled when full
+        :param readers: max concurrent read transactions
+        :param sync: fsync data on commit
+        :param metasync: fsync metadata on commit
+        :param writemap: write through a writable memory map
+        :param shared: other processes write to the same files, revalidate the
+                       cache against the last committed transaction id on reads
+        :param bloom_fp_rate: false positive rate of the missing key filter, None disables it;
+                              it is always off when shared, other processes' commits never
+                              reach it and it could only answer after a full index rescan
+        :param bloom_path: file the filter is loaded from and saved to on close
+        """
+        self.cache = LRUCache(max_bytes=cache_bytes, max_entries=cache_size)
+        self.layout = layout
+        self.shared = shared
+        self._resize = RWLock()
+        self._seen_txnid = 0
+        self._env_options = {"map_size": map_size, "max_readers": readers, "sync": sync,
+                             "metasync": metasync, "writemap": writemap}
+        if layout == LAYOUT_SINGLE:
+            self.db = self._open_env(path, max(max_dbs, 2))
+            self.index = self.db
+            self.store_dbi = self.db.open_db(b"store")
+            self.index_dbi = self.db.open_db(b"index")
+        elif layout == LAYOUT_SPLIT:
+            self.db = self._open_env(path, max_dbs)
+            self.index = self._open_env(index_path, max_dbs)
+            self.store_dbi = self.db.open_db()
+            self.index_dbi = self.index.open_db()
+        else:
+            raise DBError(f"Unknown layout: {layout}")
+        self.bloom:Optional[BloomFilter] = None
+        self.bloom_fp_rate = bloom_fp_rate
+        self.bloom_path = bloom_path
+        self.bloom_negatives = 0
+        self._bloom_lock = threading.Lock()
+        # our commits past bloom.txnid, the filter covers them once contiguous
+        self._bloom_own:set[int] = set()
+        # keys committed while a rebuild scans the index, None when none runs
+        self._bloom_pending:Optional[list[bytes]] = None
+        self._bloom_rebuild_lock = threading.Lock()
+        self._bloom_rebuilder:Optional[threading.Thread] = None
+        if bloom_fp_rate and not shared:
+            self._init_bloom()
+
+    def _init_bloom(self):
+        """Load the persisted filter if it matches the last commit, rebuild otherwise"""
+        if self.bloom_path and os.path.exists(self.bloom_path):
+            try:
+                bloom = BloomFilter.load(self.bloom_path)
+            except ValueError:
+                bloom = None
+            if bloom is not None and bloom.fp_rate == self.bloom_fp_rate \
+                    and bloom.txnid == self._last_txnid():
+                self.bloom = bloom
+                return
+        self.rebuild_bloom()
+
+    def _last_txnid(self) -> int:
+        with self._resize.shared():
+            return self.db.info()["last_txnid"]
+
+    def rebuild_bloom(self, capacity:int=0):
+        """
+        Rebuild the missing key filter from the index
+
+        The index is scanned chunk by chunk without holding up writers, keys
+        they commit meanwhile are added to the new filter before it replaces
+        the old one.
+
+        :param capacity: minimum number of keys to size the filter for
+        """
+        with self._bloom_rebuild_lock:
+            with self._bloom_lock:
+                self._bloom_pending = []
+            try:
+                txnid = self._last_txnid()
+                with self._txns() as (_, itxn):
+                    entries = itxn.stat(self.index_dbi)["entries"]
+                bloom = BloomFilter(max(capacity, BLOOMCAPACITY, 2 * entries),
+                                    self.bloom_fp_rate)
+                for key in self.iterate(keys_only=True, decode=False):
+                    bloom.add(key)
+            except Exception:
+                with self._bloom_lock:
+                    self._bloom_pending = None
+                raise
+            with self._bloom_lock:
+                for key in self._bloom_pending:
+                    bloom.add(key)
+                self._bloom_pending = None
+                bloom.txnid = txnid
+                self._bloom_own = {own for own in self._bloom_own if own > txnid}
+                self._bloom_advance(bloom)
+                self.bloom = bloom
+
+    def _rebuild_bloom_in_background(self, capacity:int=0):
+        """Start a rebuild in a thread unless one is running"""
+        with self._bloom_lock:
+            if self._bloom_rebuilder is not None and self._bloom_rebuilder.is_alive():
+                return
+            self._bloom_rebuilder = threading.Thread(target=self.rebuild_bloom, args=(capacity,),
+                                                     name="bloom-rebuild", daemon=True)
+            self._bloom_rebuilder.start()
+
+    def _bloom_add(self, keys:list[bytes], txnid:int):
+        """Add the keys of our commit txnid, with no keys for commits that only delete"""
+        with self._bloom_lock:
+            bloom = self.bloom
+            for key in keys:
+                bloom.add(key)
+            if self._bloom_pending is not None:
+                self._bloom_pending.extend(keys)
+            # commits of other threads may land here in any order
+            self._bloom_own.add(txnid)
+            self._bloom_advance(bloom)
+        if bloom.count > bloom.capacity:
+            self._rebuild_bloom_in_background(2 * bloom.capacity)
+
+    def _bloom_advance(self, bloom:BloomFilter):
+        """Move bloom.txnid over our contiguous commits, a gap is another process"""
+        while bloom.txnid + 1 in self._bloom_own:
+            bloom.txnid += 1
+            self._bloom_own.discard(bloom.txnid)
+
+    def _bloom_rules_out(self, key:bytes) -> bool:
+        """True when the filter proves key absent"""
+        bloom = self.bloom
+        if bloom is None or key in bloom:
+            return False
+        self.bloom_negatives += 1
+        return True
+
+    def _open_env(self, path, max_dbs):
+        return tool.open(path, max_dbs=max_dbs, **self._env_options)
+
+    @contextmanager
+    def _begin(self, envs, write=False, buffers=False):
+        """
+        Yields one txn per env, entered in order and committed in reverse.
+        Retries when another process grew the map since it was last seen.
+        """
+        opened = self._open_txns(envs, write, buffers)
+        while opened is None:
+            self._adopt_map()
+            opened = self._open_txns(envs, write, buffers)
+        stack, txns = opened
+        with stack:
+            yield txns
+
+    def _open_txns(self, envs, write, buffers):
         """
-        self.cache = OrderedDict()
-        self.cache_size = CACHESIZE
-        self.db = tool.open(path, max_dbs=max_dbs)
-        self.index = tool.open(index_path, max_dbs=max_dbs)
+        One txn per env under the shared resize lock, with an ExitStack leaving
+        them and then the lock, None when the map was resized by another process.
+        """
+        with ExitStack() as stack:
+            stack.enter_context(self._resize.shared())
+            txns = []
+            try:
+                for env in envs:
+                    txns.append(env.begin(write=write, buffers=buffers))
+            except tool.MapResizedError:
+                for txn in txns:
+                    txn.abort()
+                return None
+            for txn in txns:
+                stack.enter_context(txn)
+            return stack.pop_all(), txns
+
+    @contextmanager
+    def _txns(self, write=False):
+        """
+        Yields (store txn, index txn), the same txn twice with the single layout.
+        With the split layout the store commits before the index so the index
+        never points to a missing value.
+        """
+        envs = [self.db] if self.index is self.db else [self.index, self.db]
+        with self._begin(envs, write=write) as txns:
+            yield txns[-1], txns[0]
+
+    def _envs(self):
+        return [self.db] if self.index is self.db else [self.db, self.index]
+
+    def map_size(self) -> int:
+        """
+        Current map size in bytes of the store environment
+        """
+        with self._resize.shared():
+            return self.db.info()["map_size"]
+
+    def _grow(self, seen:int):
+        """
+        Double the map of every environment, unless another thread already did
+        since a commit saw `seen` as the map size
+        """
+        with self._resize.exclusive():
+            if self.db.info()["map_size"] != seen:
+                return
+            if seen * 2 > MAXMAPSIZE:
+                raise DBError(f"Map size limit reached: {seen} bytes")
+            for env in self._envs():
+                env.set_mapsize(env.info()["map_size"] * 2)
+
+    def _adopt_map(self):
+        """Pick up the map size set by another process"""
+        with self._resize.exclusive():
+            for env in self._envs():
+                env.set_mapsize(0)
+
+    def _revalidate(self):
+        """
+        Drop the cache when another process committed since the last check.
+        lmdb bumps last_txnid on every commit and keeps it in the shared lock
+        file, so reading it needs no transaction.
+        """
+        with self._resize.shared():
+            txnid = self.db.info()["last_txnid"]
+        if txnid != self._seen_txnid:
+            self.cache.clear()
+            self._seen_txnid = txnid
+
+    @property
+    def cache_size(self) -> int:
+        """Max entries of the read cache"""
+        return self.cache.max_entries
+
+    @cache_size.setter
+    def cache_size(self, size:int):
+        self.cache.max_entries = size
 
-    def _cache_set(self, key, value):
-        if len(self.cache) >= self.cache_size:
-            self.cache.popitem(last=False)
-        self.cache[key] = value
+    def stats(self) -> dict:
+        """
+        Counters of the read cache and missing key filter
+        """
+        stats = {"cache": self.cache.stats()}
+        if self.bloom is not None:
+            stats["bloom"] = {**self.bloom.stats(), "negatives": self.bloom_negatives}
+        return stats
 
     def get(self, key:Union[bytes,str]):
         """
         Retrieve the value using a key from db
-        
-        :param self: Description
+
         :param key: key to retrieve
         """
         if not key:
             raise DBError("Key can't be empty")
         key ,_=self._encode_key_value(key)
-        if key in self.cache:
-            return self.cache[key]
-        with self.db.begin(write=False) as txn:
+        if self.shared:
+            self._revalidate()
+        cached = self.cache.get(key)
+        if cached is MISSING:
+            raise DBError(f"Value for key {key} not found")
+        if cached is not None:
+            return cached
+        if self._bloom_rules_out(key):
+            raise DBError(f"Value for key {key} not found")
+        # taken before the read: a put of key committing meanwhile must win over our fill
+        generation = self.cache.generation
+        with self._begin([self.db]) as (txn,):
             hash_key = dighash(key)
-            val = txn.get(hash_key)
+            val = txn.get(hash_key, db=self.store_dbi)
+        if val is None:
+            self.cache.fill(key, MISSING, generation)
+            raise DBError(f"Value for key {key} not found")
+        decoded = val.decode()
+        self.cache.fill(key, decoded, generation)
+        return decoded
+
+    def get_many(self, keys:Iterable[Union[bytes,str]]) -> list[Optional[str]]:
+        """
+        Retrieve many values, keys missing from the cache share one read transaction
+
+        :param keys: keys to retrieve
+        :return: one entry per key, None when the key is empty or not found
+        :rtype: list[Optional[str]]
+        """
+        if self.shared:
+            self._revalidate()
+        results:list[Optional[str]] = []
+        pending:list[tuple[int, bytes]] = []
+        for key in keys:
+            results.append(None)
+            if not key:
+                continue
+            key, _ = self._encode_key_value(key)
+            cached = self.cache.get(key)
+            if cached is MISSING:
+                continue
+            if cached is not None:
+                results[-1] = cached
+            elif not self._bloom_rules_out(key):
+                pending.append((len(results) - 1, key))
+        if pending:
+            generation = self.cache.generation
+            with self._begin([self.db]) as (txn,):
+                vals = [txn.get(dighash(key), db=self.store_dbi) for _, key in pending]
+            for (idx, key), val in zip(pending, vals):
+                if val is None:
+                    self.cache.fill(key, MISSING, generation)
+                    continue
+                results[idx] = val.decode()
+                self.cache.fill(key, results[idx], generation)
+        return results
+
+    @contextmanager
+    def get_view(self, key:Union[bytes,str]):
+        """
+        Zero copy read, yields a memoryview into the mapped page of the value
+
+        The view is only valid inside the with block, copy it (bytes(view))
+        to keep it. The read cache is not consulted nor filled, the missing
+        key filter is.
+
+        :param key: key to retrieve
+        """
+        if not key:
+            raise DBError("Key can't be empty")
+        key ,_=self._encode_key_value(key)
+        if self.shared:
+            self._revalidate()
+        if self._bloom_rules_out(key):
+            raise DBError(f"Value for key {key} not found")
+        with self._begin([self.db], buffers=True) as (txn,):
+            val = txn.get(dighash(key), db=self.store_dbi)
             if val is None:
                 raise DBError(f"Value for key {key} not found")
-            decoded = val.decode()
-            self._cache_set(key, decoded)
-            return decoded
+            yield val
 
     def put(self, key:Union[bytes,str], value:Union[bytes,str]):
         """
         Stores a value into DB using specified key
         replaces a value if the key is already present
 
-        :param self: Description
         :param key: key to use
         :param value: value to store
         """
@@ -75,17 +416,105 @@ class DB:
         if not value:
             raise DBError("Value can't be empty")
         key ,value = self._encode_key_value(key, value)
-        self._cache_set(key, value)
-
-        hash_key = dighash(key)
         try:
-            with self.db.begin(write=True) as txn:
-                txn.put(hash_key, value)
-            with self.index.begin(write=True) as txn:
-                txn.put(key, hash_key)
+            self._commit([(key, value)])
         except Exception as e:
             raise DBError(f"Can't insert item: {key}:{value}") from e
 
+    def put_many(self, items:Iterable[tuple[Union[bytes,str],Union[bytes,str]]]
+                 ) -> list[Optional[DBError]]:
+        """
+        Stores many key/value pairs using a single write transaction per environment
+
+        Invalid items are skipped and reported, valid ones are committed together.
+        If the commit itself fails nothing is written and DBError is raised.
+
+        :param items: iterable of (key, value) pairs
+        :return: one entry per item, None when the item was written
+        :rtype: list[Optional[DBError]]
+        """
+        errors:list[Optional[DBError]] = []
+        pairs = []
+        for key, value in items:
+            if not key:
+                errors.append(DBError("Key can't be empty"))
+                continue
+            if not value:
+                errors.append(DBError(f"Value for key {key} can't be empty"))
+                continue
+            pairs.append(self._encode_key_value(key, value))
+            errors.append(None)
+        if pairs:
+            try:
+                self._commit(pairs)
+            except Exception as e:
+                raise DBError(f"Can't insert batch of {len(pairs)} items") from e
+        return errors
+
+    def delete(self, key:Union[bytes,str]) -> bool:
+        """
+        Removes a key and its value
+
+        :param key: key to remove
+        :return: False when the key was not present
+        """
+        if not key:
+            raise DBError("Key can't be empty")
+        key ,_=self._encode_key_value(key)
+        try:
+            with self._txns(write=True) as (txn, itxn):
+                found = itxn.delete(key, db=self.index_dbi)
+                txn.delete(dighash(key), db=self.store_dbi)
+                txnid = txn.id()
+        except Exception as e:
+            raise DBError(f"Can't delete item: {key}") from e
+        if self.bloom is not None:
+            # nothing to add, a deleted key only costs a false positive
+            self._bloom_add([], txnid)
+        self._committed(txnid)
+        self.cache.set_missing(key)
+        return found
+
+    @contextmanager
+    def write_batch(self):
+        """
+        Collects puts and commits them on exit using put_many
+
+        Nothing is written if the block raises.
+        Per-item errors are available on the batch once the block exits.
+        """
+        batch = WriteBatch()
+        yield batch
+        batch.errors = self.put_many(batch.items)
+
+    def _commit(self, pairs:list[tuple[bytes,bytes]]):
+        hashed = [(key, dighash(key), value) for key, value in pairs]
+        while True:
+            seen = self.map_size()
+            try:
+                with self._txns(write=True) as (txn, itxn):
+                    for key, hash_key, value in hashed:
+                        txn.put(hash_key, value, db=self.store_dbi)
+                        itxn.put(key, hash_key, db=self.index_dbi)
+                    txnid = txn.id()
+                break
+            except tool.MapFullError:
+                # the transaction was aborted, grow and replay it
+                self._grow(seen)
+        if self.bloom is not None:
+            self._bloom_add([key for key, _, _ in hashed], txnid)
+        self._committed(txnid)
+        for key, _, value in hashed:
+            self.cache.set(key, value.decode())
+
+    def _committed(self, txnid:int):
+        if self.shared:
+            # our own commit keeps the cache valid, any other one in between does not
+            if self._seen_txnid == txnid - 1:
+                self._seen_txnid = txnid
+            else:
+                self._revalidate()
+
     def _encode_key_value(self,key:Union[bytes,str],
                           value:Optional[Union[bytes,str]]=None) -> tuple[bytes,Optional[bytes]]:
         if key is not None:
@@ -96,39 +525,73 @@ class DB:
                 value = value.encode()
         return (key, value)
 
-    def iterate(self, prefix: str):
-        """
-        Iterate over all keys in the index database with a given prefix (e.g. 'ec:').
-
-        Returns:
-            prefix_bytes = prefix.encode()  # LMDB keys must be bytes, so encode the prefix
-        """
-        results = []
-        with self.index.begin(write=False) as txn:
-            cursor = txn.cursor()
-            prefix_bytes = prefix.encode()
-            if cursor.set_range(prefix_bytes):
-                with self.db.begin(write=False) as dtxn:
-                    # iterate from the current cursor position and
-                    # stop when keys no longer match the prefix
-                    for k, v in cursor:
-                        if not k.startswith(prefix_bytes):
-                            break
-                        # v is the hash_key, fetch from main DB
-                        val = dtxn.get(v)
-                        if val:
-                            # Decode key and value before appending for clarity
-                            decoded_key = k.decode()
-                            decoded_val = val.decode()
-                            results.append((decoded_key, decoded_val))
-        return results
+    def iterate(self, prefix:Union[bytes,str]="", limit:Optional[int]=None,
+                start_after:Optional[Union[bytes,str]]=None, keys_only:bool=False,
+                decode:bool=True) -> Iterator:
+        """
+        Lazily iterate over the keys of the index with a given prefix (e.g. 'ec:').
+
+        The index is read ITERATECHUNK keys at a time, each chunk in its own read
+        transaction: nothing is held between items, so writes (map growth included)
+        go on while the generator is open and keys they add may or may not be seen.
+
+        :param prefix: only keys starting with prefix are yielded
+        :param limit: stop after this many items
+        :param start_after: resume token, the last key of the previous page
+        :param keys_only: yield keys only and skip the value lookups
+        :param decode: yield str, raw bytes when False
+        :return: (key, value) pairs, or keys when keys_only
+        """
+        prefix_bytes, _ = self._encode_key_value(prefix)
+        after = self._encode_key_value(start_after)[0] if start_after else None
+        count = 0
+        while limit is None or count < limit:
+            size = ITERATECHUNK if limit is None else min(ITERATECHUNK, limit - count)
+            scanned, more = self._scan(prefix_bytes, after, size, keys_only)
+            for k, val in scanned:
+                if keys_only:
+                    count += 1
+                    yield k.decode() if decode else k
+                elif val:
+                    count += 1
+                    yield (k.decode(), val.decode()) if decode else (k, val)
+            if not more:
+                return
+            after = scanned[-1][0]
+
+    def _scan(self, prefix:bytes, after:Optional[bytes], size:int,
+              keys_only:bool) -> tuple[list[tuple[bytes,Optional[bytes]]],bool]:
+        """
+        Up to `size` index entries under prefix following `after`, read in one
+        transaction, with their values unless keys_only, and whether more may follow
+        """
+        scanned:list[tuple[bytes,Optional[bytes]]] = []
+        with self._txns() as (dtxn, txn):
+            cursor = txn.cursor(db=self.index_dbi)
+            positioned = cursor.set_range(prefix if after is None else max(prefix, after))
+            if positioned and after is not None and cursor.key() == after:
+                positioned = cursor.next()
+            # walk from the current cursor position and
+            # stop when keys no longer match the prefix
+            while positioned and len(scanned) < size:
+                k = cursor.key()
+                if not k.startswith(prefix):
+                    return scanned, False
+                # value is the hash_key, fetch from main DB
+                scanned.append((k, None if keys_only
+                                else dtxn.get(cursor.value(), db=self.store_dbi)))
+                positioned = cursor.next()
+        return scanned, positioned
 
     def close(self):
         """
-        closes the DB, clear caches
-        
-        :param self: Description
+        closes the DB, clear caches, persist the missing key filter
         """
         self.cache.clear()
+        if self._bloom_rebuilder is not None:
+            self._bloom_rebuilder.join()
+        if self.bloom is not None and self.bloom_path:
+            self.bloom.save(self.bloom_path)
         self.db.close()
-        self.index.close()
+        if self.index is not self.db:
+            self.index.close()
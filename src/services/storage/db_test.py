@@ -3,22 +3,27 @@ Docstring for db_test
 A small unit to test db.py: make sure to peform tests before using to detect early errors
 when used on other machines
 """
+import multiprocessing
 import os
 import tempfile
+import threading
+from contextlib import contextmanager
 import pytest
-from .db_lmdb import DB, DBError
+from .db_lmdb import DB, DBError, LAYOUT_SINGLE, MAPSIZE
+from .tools import migrate_split_to_single
+from . import db_lmdb
 
 @pytest.fixture
 def temp_db():
     # Create a temporary directory for LMDB
     with tempfile.TemporaryDirectory() as tmpdir:
-        db = DB(path=os.path.join(tmpdir, "testdb"))
+        db = DB(path=os.path.join(tmpdir, "testdb"), index_path=os.path.join(tmpdir, "testindex"))
         yield db
         db.close()
 
 def test_put_and_get(temp_db):
     temp_db.put("key1", "value1")
-    assert temp_db.get("key1") == b"value1"
+    assert temp_db.get("key1") == "value1"
 
 def test_get_populates_cache(temp_db):
     temp_db.put("key2", "value2")
@@ -29,6 +34,52 @@ def test_get_populates_cache(temp_db):
     # Now it should also be back in cache
     assert b"key2" in temp_db.cache
 
+def _read_around_put(db, read_key, put_key):
+    """db.get(read_key) with db.put(put_key) landing between its LMDB read and its cache fill"""
+    read_done = threading.Event()
+    resume = threading.Event()
+    begin = db._begin
+
+    @contextmanager
+    def paused_begin(envs, write=False, buffers=False):
+        with begin(envs, write=write, buffers=buffers) as txns:
+            yield txns
+        if not write and not read_done.is_set():
+            # the reader has its value, hold it before the cache fill
+            read_done.set()
+            resume.wait(5)
+
+    def read():
+        try:
+            db.get(read_key)
+        except DBError:
+            pass
+
+    db._begin = paused_begin
+    reader = threading.Thread(target=read)
+    reader.start()
+    assert read_done.wait(5)
+    db.put(put_key, "new")
+    resume.set()
+    reader.join()
+    del db._begin
+
+@pytest.mark.parametrize("deleted", [False, True])
+def test_get_does_not_cache_over_a_concurrent_put(temp_db, deleted):
+    temp_db.put("key3", "old")
+    if deleted:
+        # still in the missing key filter, the read goes to LMDB and finds nothing
+        temp_db.delete("key3")
+    temp_db.cache.clear()
+    _read_around_put(temp_db, "key3", "key3")
+    assert temp_db.get("key3") == "new"
+
+def test_get_caches_over_a_concurrent_put_to_another_key(temp_db):
+    temp_db.put("key3", "old")
+    temp_db.cache.clear()
+    _read_around_put(temp_db, "key3", "key4")
+    assert temp_db.cache.get(b"key3") == "old"
+
 def test_empty_key_raises(temp_db):
     with pytest.raises(DBError):
         temp_db.put("", "value")
@@ -54,6 +105,26 @@ def test_cache_eviction(temp_db):
     assert b"b" in temp_db.cache
     assert b"c" in temp_db.cache
 
+def test_cache_hit_refreshes_recency(temp_db):
+    temp_db.cache_size = 2
+    temp_db.put("a", "1")
+    temp_db.put("b", "2")
+    temp_db.get("a")
+    temp_db.put("c", "3")
+    # "b" is now the least recently used entry
+    assert b"a" in temp_db.cache
+    assert b"b" not in temp_db.cache
+
+def test_missing_key_is_cached_until_put(temp_db):
+    temp_db.bloom = None
+    with pytest.raises(DBError):
+        temp_db.get("later")
+    with pytest.raises(DBError):
+        temp_db.get("later")
+    assert temp_db.stats()["cache"]["negative_hits"] == 1
+    temp_db.put("later", "now")
+    assert temp_db.get("later") == "now"
+
 def test_iterate_returns_only_prefixed_keys(temp_db):
     # Insert some keys with prefix "ec:" and some without
     temp_db.put("ec:1", "value1")
@@ -85,3 +156,325 @@ def test_iterate_empty_prefix_returns_all(temp_db):
 
     assert "a:1" in keys
     assert "b:1" in keys
+
+def test_put_many_writes_all_items(temp_db):
+    errors = temp_db.put_many([("m:1", "v1"), ("m:2", "v2"), ("m:3", "v3")])
+    assert errors == [None, None, None]
+    temp_db.cache.clear()
+    assert temp_db.get("m:2") == "v2"
+    assert len(list(temp_db.iterate("m:"))) == 3
+
+def test_get_many_mixes_cache_and_one_read(temp_db):
+    temp_db.put_many([("m:1", "v1"), ("m:2", "v2"), ("m:3", "v3")])
+    temp_db.cache.clear()
+    assert temp_db.get("m:2") == "v2"
+    assert temp_db.get_many(["m:1", "m:2", "missing", "", "m:3"]) == ["v1", "v2", None, None, "v3"]
+    assert temp_db.cache.get(b"m:3") == "v3"
+    temp_db.put("missing", "now")
+    assert temp_db.get_many(["missing"]) == ["now"]
+
+def test_put_many_reports_invalid_items(temp_db):
+    errors = temp_db.put_many([("ok", "v"), ("", "v"), ("empty", "")])
+    assert errors[0] is None
+    assert isinstance(errors[1], DBError)
+    assert isinstance(errors[2], DBError)
+    temp_db.cache.clear()
+    assert temp_db.get("ok") == "v"
+    with pytest.raises(DBError):
+        temp_db.get("empty")
+
+def test_write_batch_commits_on_exit(temp_db):
+    with temp_db.write_batch() as batch:
+        batch.put("w:1", "a")
+        batch.put("w:2", "")
+    assert batch.errors[0] is None
+    assert isinstance(batch.errors[1], DBError)
+    temp_db.cache.clear()
+    assert temp_db.get("w:1") == "a"
+
+def test_write_batch_discarded_on_error(temp_db):
+    with pytest.raises(RuntimeError):
+        with temp_db.write_batch() as batch:
+            batch.put("x:1", "a")
+            raise RuntimeError("abort")
+    with pytest.raises(DBError):
+        temp_db.get("x:1")
+
+@pytest.fixture
+def single_db():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "registry.db"), layout=LAYOUT_SINGLE)
+        yield db
+        db.close()
+
+def test_single_layout_put_get_iterate(single_db):
+    single_db.put("ec:1", "value1")
+    single_db.put_many([("ec:2", "value2"), ("other:1", "x")])
+    single_db.cache.clear()
+    assert single_db.get("ec:1") == "value1"
+    assert dict(single_db.iterate("ec:")) == {"ec:1": "value1", "ec:2": "value2"}
+
+def test_unknown_layout_raises():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with pytest.raises(DBError):
+            DB(path=os.path.join(tmpdir, "x.db"), layout="nope")
+
+def test_migrate_split_to_single():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = os.path.join(tmpdir, "store.db")
+        index = os.path.join(tmpdir, "index.db")
+        dest = os.path.join(tmpdir, "registry.db")
+        split = DB(path=store, index_path=index)
+        split.put_many([("did:1", "cid_1"), ("claim_1", "cid_2")])
+        split.close()
+
+        values, keys = migrate_split_to_single(store, index, dest, batch=1)
+        assert (values, keys) == (2, 2)
+
+        single = DB(path=dest, layout=LAYOUT_SINGLE)
+        try:
+            assert single.get("did:1") == "cid_1"
+            assert dict(single.iterate("claim_")) == {"claim_1": "cid_2"}
+        finally:
+            single.close()
+
+def test_migrate_split_to_single_larger_than_default_map():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = os.path.join(tmpdir, "store.db")
+        index = os.path.join(tmpdir, "index.db")
+        dest = os.path.join(tmpdir, "registry.db")
+        split = DB(path=store, index_path=index)
+        # 16 MB of values, the split DB grows past MAPSIZE to hold them
+        for i in range(16):
+            split.put(f"claim_{i}", str(i % 10) * (1024 * 1024))
+        assert split.map_size() > MAPSIZE
+        split.close()
+
+        assert migrate_split_to_single(store, index, dest) == (16, 16)
+
+        single = DB(path=dest, layout=LAYOUT_SINGLE)
+        try:
+            assert single.get("claim_15") == "5" * (1024 * 1024)
+        finally:
+            single.close()
+
+def test_iterate_is_lazy_and_paginates(temp_db):
+    temp_db.put_many([(f"claim_{i}", f"cid_{i}") for i in range(5)])
+    temp_db.put("did:1", "cid_x")
+    items = temp_db.iterate("claim_", limit=2)
+    assert not isinstance(items, list)
+    first = list(items)
+    assert first == [("claim_0", "cid_0"), ("claim_1", "cid_1")]
+    second = list(temp_db.iterate("claim_", limit=2, start_after=first[-1][0]))
+    assert [k for k, _ in second] == ["claim_2", "claim_3"]
+    last = list(temp_db.iterate("claim_", limit=2, start_after="claim_3"))
+    assert [k for k, _ in last] == ["claim_4"]
+
+def test_iterate_keys_only_and_raw(temp_db):
+    temp_db.put_many([("ec:1", "v1"), ("ec:2", "v2")])
+    assert list(temp_db.iterate("ec:", keys_only=True)) == ["ec:1", "ec:2"]
+    assert list(temp_db.iterate("ec:", decode=False)) == [(b"ec:1", b"v1"), (b"ec:2", b"v2")]
+    # a resume token before the prefix starts at the prefix
+    assert list(temp_db.iterate("ec:", keys_only=True, start_after="a")) == ["ec:1", "ec:2"]
+
+def test_map_grows_past_default_size():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "store.db"), index_path=os.path.join(tmpdir, "index.db"),
+                sync=False, metasync=False)
+        try:
+            assert db.map_size() == MAPSIZE
+            blob = "x" * (512 * 1024)
+            # 24 MiB of values, well past the 10 MiB default map
+            for i in range(0, 48, 8):
+                assert db.put_many([(f"big:{j}", blob) for j in range(i, i + 8)]) == [None] * 8
+            db.put("big:last", blob)
+            assert db.map_size() > MAPSIZE
+            db.cache.clear()
+            assert db.get("big:47") == blob
+            assert len(list(db.iterate("big:", keys_only=True))) == 49
+        finally:
+            db.close()
+
+def _finishes(target, seconds=10):
+    """Run target in a thread, whether it returned in time"""
+    done = threading.Event()
+
+    def run():
+        try:
+            target()
+        finally:
+            done.set()
+    threading.Thread(target=run, daemon=True).start()
+    return done.wait(seconds)
+
+def test_map_grows_while_an_iteration_is_open(monkeypatch):
+    monkeypatch.setattr(db_lmdb, "ITERATECHUNK", 2)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "store.db"), index_path=os.path.join(tmpdir, "index.db"),
+                map_size=1 << 20, sync=False, metasync=False)
+        try:
+            db.put_many([(f"k:{i}", f"v{i}") for i in range(5)])
+            items = db.iterate("k:")
+            assert next(items) == ("k:0", "v0")
+            assert _finishes(lambda: db.put("big", "x" * (4 << 20)))
+            assert db.map_size() > 1 << 20
+            assert [k for k, _ in items] == ["k:1", "k:2", "k:3", "k:4"]
+        finally:
+            db.close()
+
+def test_growing_the_map_inside_get_view_fails_fast():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "store.db"), index_path=os.path.join(tmpdir, "index.db"),
+                map_size=1 << 20, sync=False, metasync=False)
+        errors = []
+
+        def grow_in_view():
+            with db.get_view("k"):
+                try:
+                    db.put("big", "x" * (4 << 20))
+                except DBError as e:
+                    errors.append(e)
+        try:
+            db.put("k", "v")
+            assert _finishes(grow_in_view)
+            assert len(errors) == 1
+        finally:
+            db.close()
+
+def test_env_options_are_applied():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "registry.db"), layout=LAYOUT_SINGLE,
+                map_size=1 << 20, readers=8, writemap=True)
+        try:
+            assert db.map_size() == 1 << 20
+            assert db.db.max_readers() == 8
+            assert db.db.flags()["writemap"]
+        finally:
+            db.close()
+
+def test_get_view_returns_memoryview(temp_db):
+    temp_db.put("v:1", "payload")
+    with temp_db.get_view("v:1") as view:
+        assert isinstance(view, memoryview)
+        assert bytes(view) == b"payload"
+    with pytest.raises(DBError):
+        with temp_db.get_view("v:missing"):
+            pass
+
+def _put_from_other_process(store, index, key, value):
+    other = DB(path=store, index_path=index, shared=True)
+    other.put(key, value)
+    other.close()
+
+def test_shared_cache_follows_other_process_commits():
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = os.path.join(tmpdir, "store.db")
+        index = os.path.join(tmpdir, "index.db")
+        db = DB(path=store, index_path=index, shared=True)
+        try:
+            db.put("did:1", "cid_old")
+            assert db.get("did:1") == "cid_old"
+            with pytest.raises(DBError):
+                db.get("did:2")
+            for key, value in (("did:1", "cid_new"), ("did:2", "cid_2")):
+                proc = ctx.Process(target=_put_from_other_process, args=(store, index, key, value))
+                proc.start()
+                proc.join()
+                assert proc.exitcode == 0
+            # both the stale value and the cached miss are dropped
+            assert db.get("did:1") == "cid_new"
+            assert db.get("did:2") == "cid_2"
+        finally:
+            db.close()
+
+def test_own_commits_keep_shared_cache(temp_db):
+    temp_db.shared = True
+    temp_db.put("a", "1")
+    temp_db.get("a")
+    temp_db.put("b", "2")
+    assert b"a" in temp_db.cache
+
+def test_bloom_answers_missing_keys(temp_db):
+    temp_db.put("did:here", "cid")
+    with pytest.raises(DBError):
+        temp_db.get("did:typo")
+    stats = temp_db.stats()
+    assert stats["bloom"]["negatives"] == 1
+    assert stats["cache"]["negative_hits"] == 0
+    assert temp_db.get("did:here") == "cid"
+
+def test_bloom_rebuilt_from_index_and_persisted():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = {"path": os.path.join(tmpdir, "s.db"), "index_path": os.path.join(tmpdir, "i.db")}
+        bloom_path = os.path.join(tmpdir, "bloom.bin")
+        db = DB(**paths, bloom_fp_rate=None)
+        db.put_many([(f"claim_{i}", "cid") for i in range(50)])
+        db.close()
+
+        db = DB(**paths, bloom_path=bloom_path)
+        assert db.bloom.count == 50
+        assert all(f"claim_{i}".encode() in db.bloom for i in range(50))
+        db.put("claim_new", "cid")
+        db.close()
+        assert os.path.exists(bloom_path)
+
+        db = DB(**paths, bloom_path=bloom_path)
+        try:
+            assert db.bloom.count == 51
+            assert db.get("claim_new") == "cid"
+        finally:
+            db.close()
+
+def test_bloom_grows_past_capacity(temp_db, monkeypatch):
+    monkeypatch.setattr(db_lmdb, "BLOOMCAPACITY", 8)
+    temp_db.rebuild_bloom()
+    temp_db.put_many([(f"k{i}", "v") for i in range(40)])
+    temp_db._bloom_rebuilder.join()
+    assert temp_db.bloom.capacity >= 40
+    temp_db.cache.clear()
+    assert all(temp_db.get(f"k{i}") == "v" for i in range(40))
+
+def test_shared_handles_answer_negatives_after_foreign_writes():
+    ctx = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = os.path.join(tmpdir, "store.db")
+        index = os.path.join(tmpdir, "index.db")
+        db = DB(path=store, index_path=index, shared=True)
+        try:
+            # the filter could not see the other handle's commits, it is off
+            assert db.bloom is None and "bloom" not in db.stats()
+            db.put("did:1", "cid_1")
+            proc = ctx.Process(target=_put_from_other_process, args=(store, index, "did:2", "cid_2"))
+            proc.start()
+            proc.join()
+            assert db.get("did:2") == "cid_2"
+            for missing in ("did:missing", "did:3"):
+                with pytest.raises(DBError):
+                    db.get(missing)
+            # answered by LMDB, no rescan of the index was started
+            assert db._bloom_rebuilder is None
+        finally:
+            db.close()
+
+def test_bloom_covers_own_commits_in_any_order(temp_db):
+    temp_db.put("a", "1")
+    txnid = temp_db.bloom.txnid
+    temp_db._bloom_add([b"c"], txnid + 2)
+    assert temp_db.bloom.txnid == txnid
+    temp_db._bloom_add([b"b"], txnid + 1)
+    assert temp_db.bloom.txnid == txnid + 2
+    assert not temp_db._bloom_own
+
+def test_bloom_covers_own_deletes(temp_db):
+    temp_db.put("a", "1")
+    temp_db.delete("a")
+    assert temp_db.bloom.txnid == temp_db._last_txnid()
+
+def test_delete(temp_db):
+    temp_db.put("gone", "soon")
+    assert temp_db.delete("gone")
+    with pytest.raises(DBError):
+        temp_db.get("gone")
+    assert list(temp_db.iterate("gone")) == []
+    assert not temp_db.delete("gone")
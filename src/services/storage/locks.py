@@ -0,0 +1,69 @@
+"""
+Locks shared by the storage backends
+"""
+import threading
+from contextlib import contextmanager
+
+class RWLock:
+    """
+    Shared/exclusive lock: DB transactions are shared and map resizes exclusive
+    since lmdb requires no active transaction in the process while resizing
+
+    Writer preferring: once an exclusive holder waits, new shared holders wait
+    behind it, threads already holding the lock shared may take it again.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+        self._waiting = 0
+        # shared holds per thread id
+        self._holders:dict[int, int] = {}
+
+    @contextmanager
+    def shared(self):
+        """Hold the lock along with other shared holders"""
+        me = threading.get_ident()
+        with self._cond:
+            if me not in self._holders:
+                while self._exclusive or self._waiting:
+                    self._cond.wait()
+            self._holders[me] = self._holders.get(me, 0) + 1
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._shared -= 1
+                self._holders[me] -= 1
+                if not self._holders[me]:
+                    del self._holders[me]
+                if not self._shared:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        """
+        Hold the lock alone
+
+        :raises RuntimeError: when the calling thread holds the lock shared,
+                              waiting for itself would never end
+        """
+        with self._cond:
+            if threading.get_ident() in self._holders:
+                raise RuntimeError("Exclusive lock requested by a thread holding it shared")
+            self._waiting += 1
+            try:
+                while self._exclusive or self._shared:
+                    self._cond.wait()
+            finally:
+                self._waiting -= 1
+                if not self._waiting:
+                    self._cond.notify_all()
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._exclusive = False
+                self._cond.notify_all()
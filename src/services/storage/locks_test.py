@@ -0,0 +1,44 @@
+"""
+Tests for the shared/exclusive lock of the storage backends
+"""
+import threading
+import time
+import pytest
+from .locks import RWLock
+
+
+def test_waiting_exclusive_holds_back_new_shared_holders():
+    lock = RWLock()
+    order = []
+    with lock.shared():
+        def exclusive():
+            with lock.exclusive():
+                order.append("exclusive")
+
+        def shared():
+            with lock.shared():
+                order.append("shared")
+        writer = threading.Thread(target=exclusive)
+        writer.start()
+        while not lock._waiting:
+            time.sleep(0.001)
+        reader = threading.Thread(target=shared)
+        reader.start()
+        time.sleep(0.05)
+        # the reader queues behind the writer, the holder may still nest
+        assert not order
+        with lock.shared():
+            pass
+    writer.join(5)
+    reader.join(5)
+    assert order == ["exclusive", "shared"]
+
+
+def test_exclusive_while_holding_shared_raises():
+    lock = RWLock()
+    with lock.shared():
+        with pytest.raises(RuntimeError):
+            with lock.exclusive():
+                pass
+    with lock.exclusive():
+        pass
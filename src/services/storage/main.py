@@ -1,26 +1,100 @@
 """
 The main interface to start the storage and regsitration service
 """
+import asyncio
 import json
+import os
+import threading
+import weakref
+from datetime import datetime
+from typing import Annotated, Any, Callable, Optional, Union
 import uvicorn
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Query, Request, Response
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from src.core.models import (DIDRegistryRegisterRequest, DIDRegistryRegisterResponse
-, DIDRegistryResolveResponse,
-IPFSStoreRequest, IPFSStoreResponse, IPFSRetrieveResponse)
-from src.core.crypto import hexhash
-from src.core.constants import (STORAGEPORT, ADDHOST)
+, DIDRegistryResolveResponse, DIDRegistryEntry, DIDRegistryListResponse,
+DIDRegistryRegisterBatchRequest, DIDRegistryRegisterBatchResponse,
+DIDRegistryResolveBatchRequest, DIDRegistryResolveBatchResponse,
+IPFSStoreRequest, IPFSStoreResponse, IPFSRetrieveResponse,
+IPFSStoreBatchRequest, IPFSStoreBatchResponse, IPFSRetrieveBatchRequest, IPFSRetrieveBatchResponse)
+from src.core.crypto import canonical_json_cid, is_cid, is_document_cid
+from src.core.constants import (STORAGEPORT, ADDHOST, STORAGELAYOUT, STORAGEWORKERS,
+REGISTERWINDOW, REGISTERBATCH, BLOBBACKEND)
 from .db_lmdb import DB, DBError
+from .coalescer import WriteCoalescer
+from .blobstore import FileBlobStore, PackBlobStore, open_blob_store
+from . import dag
 
 
+# documents are addressed by their hash and never change
+IMMUTABLE = "public, max-age=31536000, immutable"
+LISTLIMIT = 100
+LISTMAXLIMIT = 1000
+NDJSON = "application/x-ndjson"
+
 app = FastAPI()
-db = DB()
+_opened:dict[str, tuple[int, Any]] = {}
+_opened_lock = threading.Lock()
+
+def _per_process(name:str, factory:Callable[[], Any]) -> Any:
+    """
+    Returns the resource `name` of this process, created by factory on first use.
+
+    lmdb environments and memory maps must not cross a fork, so each worker
+    opens its own after it starts.
+    """
+    opened = _opened.get(name)
+    if opened is None or opened[0] != os.getpid():
+        with _opened_lock:
+            opened = _opened.get(name)
+            if opened is None or opened[0] != os.getpid():
+                opened = (os.getpid(), factory())
+                _opened[name] = opened
+    return opened[1]
+
+def get_db() -> DB:
+    """
+    Returns the registry DB of this process.
+
+    Other workers write to the same files, the DB is opened shared so its
+    cache follows their commits.
+    """
+    return _per_process("db", lambda: DB(layout=STORAGELAYOUT, shared=True))
+
+def get_blobs() -> Union[FileBlobStore, PackBlobStore]:
+    """
+    Returns the document store of this process, selected by BLOBBACKEND
+    """
+    return _per_process("blobs", lambda: open_blob_store(BLOBBACKEND))
+
+def get_coalescer() -> WriteCoalescer:
+    """
+    Returns the registration coalescer of the running event loop
+
+    Its timer and futures belong to one loop, in-process clients register from
+    loops of their own.
+    """
+    loop = asyncio.get_running_loop()
+    coalescer = _coalescers.get(loop)
+    if coalescer is None:
+        with _opened_lock:
+            coalescer = _coalescers.get(loop)
+            if coalescer is None:
+                coalescer = _coalescers[loop] = WriteCoalescer(
+                    lambda items: get_db().put_many(items),
+                    window=REGISTERWINDOW, max_items=REGISTERBATCH)
+    return coalescer
+
+# registrations arriving within REGISTERWINDOW on one event loop share one commit
+_coalescers:"weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, WriteCoalescer]" = \
+    weakref.WeakKeyDictionary()
 
 """
 Smart Contract(mock) did -> diddoc registration
 """
 @app.post("/register", response_model=DIDRegistryRegisterResponse)
-def register(req: DIDRegistryRegisterRequest):
+async def register(req: DIDRegistryRegisterRequest):
     """
     Registers a did to a CID (maps did to CID)
 
@@ -28,31 +102,117 @@ def register(req: DIDRegistryRegisterRequest):
     :type req: DIDRegistryRegisterRequest
     """
     try:
-        db.put(req.did, req.doc_cid)
-        return DIDRegistryRegisterResponse(status="success", did=req.did, doc_cid=req.doc_cid)
-    except DBError:
+        error = await get_coalescer().put(req.did, req.doc_cid)
+    except DBError as e:
+        error = e
+    if error:
         return DIDRegistryRegisterResponse(status="error", did=req.did, doc_cid=req.doc_cid)
+    return DIDRegistryRegisterResponse(status="success", did=req.did, doc_cid=req.doc_cid)
+
+@app.post("/register/batch", response_model=DIDRegistryRegisterBatchResponse)
+def register_batch(req:DIDRegistryRegisterBatchRequest):
+    """
+    Registers many dids with a single write transaction
+
+    Invalid items fail on their own, the others are committed together.
+
+    :param req: registrations, answered in the same order
+    :type req: DIDRegistryRegisterBatchRequest
+    """
+    try:
+        errors:list[Optional[DBError]] = get_db().put_many(
+            [(item.did, item.doc_cid) for item in req.items])
+    except DBError as e:
+        errors = [e] * len(req.items)
+    results = [DIDRegistryRegisterResponse(status="error" if error else "success", did=item.did,
+                                           doc_cid=item.doc_cid,
+                                           message=str(error) if error else None)
+               for item, error in zip(req.items, errors)]
+    failed = sum(1 for error in errors if error)
+    return DIDRegistryRegisterBatchResponse(results=results, succeeded=len(results) - failed,
+                                            failed=failed)
+
+@app.post("/resolve/batch", response_model=DIDRegistryResolveBatchResponse)
+def resolve_batch(req:DIDRegistryResolveBatchRequest):
+    """
+    Resolves many dids with a single read transaction
+
+    :param req: dids, answered in the same order
+    :type req: DIDRegistryResolveBatchRequest
+    """
+    cids = get_db().get_many(req.dids)
+    results = [DIDRegistryResolveResponse(did=did, doc_cid=cid,
+                                          status="success" if cid else "error")
+               for did, cid in zip(req.dids, cids)]
+    return DIDRegistryResolveBatchResponse(results=results,
+                                           found=sum(1 for cid in cids if cid))
 
 @app.get("/resolve/{did}", response_model=DIDRegistryResolveResponse)
-def resolve(did:str):
+def resolve(did:str, raw:bool = False):
     """
     Resolves a did to it's CID
 
     :param did: Description
     :type did: str
+    :param raw: answer with the CID bytes only (404 when missing)
     """
+    if raw:
+        return _resolve_raw(did)
     try:
-        data = db.get(did)
+        data = get_db().get(did)
         return DIDRegistryResolveResponse(did=did, doc_cid=data, status="success")
     except DBError:
         return DIDRegistryResolveResponse(did=did,status="error")
 
+def _resolve_raw(did:str) -> Response:
+    """Copy the value once out of the map, no decode, no model, no JSON"""
+    try:
+        with get_db().get_view(did) as view:
+            body = bytes(view)
+    except DBError:
+        return Response(status_code=404)
+    return Response(content=body, media_type="text/plain")
+
+@app.get("/list", response_model=DIDRegistryListResponse)
+def list_keys(prefix:str = "", after:Optional[str] = None,
+              limit:int = Query(LISTLIMIT, ge=1, le=LISTMAXLIMIT), keys_only:bool = False):
+    """
+    Lists registry keys with a prefix one page at a time
+
+    :param prefix: key prefix (e.g. claim_)
+    :param after: resume token returned as `next` by the previous page
+    :param limit: page size
+    :param keys_only: skip the CID lookups
+    """
+    page = list(get_db().iterate(prefix, limit=limit + 1, start_after=after, keys_only=keys_only))
+    if keys_only:
+        entries = [DIDRegistryEntry(did=k) for k in page]
+    else:
+        entries = [DIDRegistryEntry(did=k, doc_cid=v) for k, v in page]
+    next_token = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_token = entries[-1].did
+    return DIDRegistryListResponse(prefix=prefix, entries=entries, next=next_token)
+
 @app.get("/health")
 def health():
     """
     Returns the current status of server
     """
     return {"status":200}
+
+@app.get("/stats")
+def stats():
+    """
+    Returns the registry cache and group commit counters
+    """
+    with _opened_lock:
+        coalescers = list(_coalescers.values())
+    batches = sum(c.batches for c in coalescers)
+    items = sum(c.items for c in coalescers)
+    return {**get_db().stats(), "register": {
+        "batches": batches, "items": items, "avg_batch": items / batches if batches else 0.0}}
 #
 ### IFPS server Implementation
 #
@@ -64,37 +224,236 @@ def store_cid(req:IPFSStoreRequest):
     :param req: Description
     :type req: IPFSStoreRequest
     """
-    jsondoc = jsonable_encoder(req.document)
-    if req.document:
-        doc = json.dumps(jsondoc)
-        size = len(doc)
-        checksum = hexhash(doc)
-        cid = _gen_ifps_hash(checksum)
-        with open(cid, "w", encoding="utf-8") as f:
-            f.write(doc)
-        return IPFSStoreResponse(cid=cid, size_bytes=size)
+    return _store_document(get_blobs(), req.document)
+
+def _store_document(blobs:Union[FileBlobStore, PackBlobStore], document:dict) -> IPFSStoreResponse:
+    if document:
+        # documents stored before CIDv1 keep their "cid_" ids, retrieve looks them up as is
+        cid, doc = canonical_json_cid(jsonable_encoder(document))
+        written = blobs.put(cid, doc)
+        return IPFSStoreResponse(cid=cid, size_bytes=len(doc), deduplicated=not written)
     return IPFSStoreResponse(cid="0x0", size_bytes=0)
 
+@app.post("/store/batch", response_model=IPFSStoreBatchResponse)
+def store_batch(req:IPFSStoreBatchRequest, accept:Annotated[Optional[str], Header()] = None):
+    """
+    Stores many documents, answered in request order
+
+    :param req: documents to store
+    :type req: IPFSStoreBatchRequest
+    :param accept: application/x-ndjson streams one IPFSStoreResponse per line
+    """
+    blobs = get_blobs()
+    results = (_store_document(blobs, doc) for doc in req.documents)
+    if _wants_ndjson(accept):
+        return StreamingResponse((r.model_dump_json().encode() + b"\n" for r in results),
+                                 media_type=NDJSON)
+    stored = list(results)
+    return IPFSStoreBatchResponse(results=stored,
+                                  deduplicated=sum(1 for r in stored if r.deduplicated))
+
+@app.post("/retrieve/batch", response_model=IPFSRetrieveBatchResponse)
+def retrieve_batch(req:IPFSRetrieveBatchRequest,
+                   accept:Annotated[Optional[str], Header()] = None):
+    """
+    Retrieves many documents, answered in request order.
+    Like /retrieve the stored bytes are spliced into the response, not re-parsed,
+    CIDs of streamed content are answered as not existing.
+
+    :param req: cids to retrieve
+    :type req: IPFSRetrieveBatchRequest
+    :param accept: application/x-ndjson streams one IPFSRetrieveResponse per line
+    """
+    blobs = get_blobs()
+    if _wants_ndjson(accept):
+        return StreamingResponse((_retrieve_item(blobs, cid)[0] + b"\n" for cid in req.cids),
+                                 media_type=NDJSON)
+    items = [_retrieve_item(blobs, cid) for cid in req.cids]
+    found = sum(1 for _, exists in items if exists)
+    body = b"".join((b'{"results":[', b",".join(item for item, _ in items),
+                     b'],"found":', str(found).encode(), b"}"))
+    return Response(content=body, media_type="application/json")
+
+def _retrieve_item(blobs:Union[FileBlobStore, PackBlobStore], cid:str) -> tuple[bytes, bool]:
+    """IPFSRetrieveResponse JSON of cid and whether it exists"""
+    # streamed content is not JSON, it can't be spliced into the response
+    data = blobs.get(cid) if is_document_cid(cid) else None
+    if data is None:
+        return IPFSRetrieveResponse(cid=cid, document={"0":""},
+                                    exists=False).model_dump_json().encode(), False
+    return _frame_retrieve(cid, data), True
+
+def _wants_ndjson(accept:Optional[str]) -> bool:
+    return bool(accept) and any(part.split(";")[0].strip() == NDJSON
+                                for part in accept.split(","))
+
 @app.get("/retrieve/{cid}", response_model=IPFSRetrieveResponse)
-def retrieve_cid(cid:str):
+def retrieve_cid(cid:str, framed:bool = True,
+                 if_none_match:Annotated[Optional[str], Header()] = None):
     """
-    Retrieve a document using its cid
+    Retrieve a document using its cid. Content uploaded through /store/stream
+    is not JSON, its CIDs are answered 415 and served by /retrieve/stream.
 
     :param cid: Description
     :type cid: str
+    :param framed: splice the stored bytes into the response instead of
+                   parsing and re-serializing the document
+    :param if_none_match: answer 304 when it matches the document ETag
     """
-    try:
-        with open(cid, "r", encoding="utf-8") as f:
-            di = json.loads(f.read())
-            return IPFSRetrieveResponse(cid=cid, document=di, exists=True)
-    except FileNotFoundError:
+    if not is_cid(cid):
+        # not a name the store hands out, e.g. a file next to the file backend's documents
+        return IPFSRetrieveResponse(cid=cid,document={"0":""}, exists=False)
+    if not is_document_cid(cid):
+        return JSONResponse(status_code=415, content={
+            "detail": f"{cid} is not a JSON document, use /retrieve/stream/{cid}"})
+    # weak: the envelope carries retrieved_at, only the document is identical
+    etag = f'W/"{cid}"'
+    blobs = get_blobs()
+    if _etag_matches(if_none_match, etag) and blobs.exists(cid):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    data = blobs.get(cid)
+    if data is None:
         return IPFSRetrieveResponse(cid=cid,document={"0":""}, exists=False)
+    if framed:
+        body = _frame_retrieve(cid, data)
+    else:
+        body = IPFSRetrieveResponse(cid=cid, document=json.loads(data),
+                                    exists=True).model_dump_json().encode()
+    return Response(content=body, media_type="application/json", headers=_cache_headers(etag))
 
-def _gen_ifps_hash(checksum):
-    return "cid_"+checksum
+def _frame_retrieve(cid:str, data:bytes) -> bytes:
+    """
+    IPFSRetrieveResponse JSON built around the stored document bytes.
+    Documents are written by store_cid as JSON, so they are embedded as is.
+    """
+    return b"".join((b'{"cid":', json.dumps(cid).encode(), b',"document":', data,
+                     b',"retrieved_at":"', datetime.now().isoformat().encode(),
+                     b'","exists":true}'))
 
-def start():
+def _cache_headers(etag:str) -> dict:
+    return {"ETag": etag, "Cache-Control": IMMUTABLE}
+
+def _etag_matches(if_none_match:Optional[str], etag:str) -> bool:
+    """If-None-Match uses the weak comparison: W/ prefixes are ignored"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+@app.get("/raw/{cid}")
+def raw_cid(cid:str, if_none_match:Annotated[Optional[str], Header()] = None):
     """
-    Docstring for start
+    The stored document bytes, sent from the file when the backend keeps one
+
+    :param cid: CID of the document
+    :type cid: str
+    :param if_none_match: answer 304 when it matches the document ETag
+    """
+    if not is_cid(cid):
+        return Response(status_code=404)
+    etag = f'"{cid}"'
+    blobs = get_blobs()
+    if _etag_matches(if_none_match, etag) and blobs.exists(cid):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    if isinstance(blobs, FileBlobStore):
+        path = blobs.path(cid)
+        if path is None:
+            return Response(status_code=404)
+        return FileResponse(path, media_type="application/json", headers=_cache_headers(etag))
+    with blobs.view(cid) as view:
+        if view is None:
+            return Response(status_code=404)
+        body = bytes(view)
+    return Response(content=body, media_type="application/json", headers=_cache_headers(etag))
+
+@app.post("/store/stream", response_model=IPFSStoreResponse)
+async def store_stream(request:Request):
+    """
+    Stores a request body of any size as a Merkle DAG and returns its root CID.
+    The body is read as it arrives, at most one chunk is buffered.
+
+    :param request: raw request, the body is the content
+    """
+    builder = dag.DAGBuilder(get_blobs(), chunk_size=dag.CHUNKSIZE, fanout=dag.FANOUT)
+    async for part in request.stream():
+        if part:
+            # chunk writes hit the disk, keep them off the event loop
+            await asyncio.to_thread(builder.write, part)
+    cid = await asyncio.to_thread(builder.finish)
+    return IPFSStoreResponse(cid=cid, size_bytes=builder.size,
+                             deduplicated=builder.new_blocks == 0)
+
+@app.get("/retrieve/stream/{cid}")
+def retrieve_stream(cid:str, range_:Annotated[Optional[str], Header(alias="Range")] = None,
+                    if_none_match:Annotated[Optional[str], Header()] = None):
+    """
+    Streams the content under a root CID chunk by chunk, honouring a single byte Range
+
+    :param cid: root CID from /store/stream, other CIDs are streamed as one chunk
+    :param range_: "bytes=start-end", "bytes=start-" or "bytes=-suffix"
+    :param if_none_match: answer 304 when it matches the content ETag
+    """
+    if not is_cid(cid):
+        return Response(status_code=404)
+    etag = f'"{cid}"'
+    blobs = get_blobs()
+    if _etag_matches(if_none_match, etag) and blobs.exists(cid):
+        return Response(status_code=304, headers=_cache_headers(etag))
+    try:
+        total = dag.size(blobs, cid)
+    except dag.DAGError:
+        total = None
+    if total is None:
+        return Response(status_code=404)
+    headers = {**_cache_headers(etag), "Accept-Ranges": "bytes"}
+    try:
+        span = _parse_range(range_, total)
+    except ValueError:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{total}"})
+    if span is None:
+        offset, end, status = 0, total, 200
+    else:
+        (offset, end), status = span, 206
+        headers["Content-Range"] = f"bytes {offset}-{end - 1}/{total}"
+    headers["Content-Length"] = str(end - offset)
+    return StreamingResponse(dag.read(blobs, cid, offset, end), status_code=status,
+                             media_type="application/octet-stream", headers=headers)
+
+def _parse_range(header:Optional[str], total:int) -> Optional[tuple[int, int]]:
+    """
+    [start, end) asked by a Range header, None when the whole content is sent.
+    Headers that can't be parsed or ask for several ranges are ignored.
+
+    :raises ValueError: when the range is not satisfiable
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    if not all(part.isdigit() for part in (first, last) if part) or not (first or last):
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or total == 0:
+            raise ValueError("Empty suffix range")
+        return max(total - suffix, 0), total
+    offset = int(first)
+    if last and int(last) < offset:
+        return None
+    if offset >= total:
+        raise ValueError("Range outside the content")
+    return offset, min(int(last) + 1, total) if last else total
+
+def start(workers:int = STORAGEWORKERS):
+    """
+    Starts the storage service with `workers` processes sharing the DB files
+
+    :param workers: number of uvicorn worker processes
     """
-    uvicorn.run(app, port=STORAGEPORT, host=ADDHOST)
+    if workers > 1:
+        # workers import the app themselves, so it has to be given as an import string
+        uvicorn.run("src.services.storage.main:app", port=STORAGEPORT, host=ADDHOST,
+                    workers=workers)
+    else:
+        uvicorn.run(app, port=STORAGEPORT, host=ADDHOST)
@@ -0,0 +1,298 @@
+"""
+Tests for the storage service endpoints, called directly on temporary stores
+"""
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import types
+import pytest
+from . import main
+from .db_lmdb import DB
+from .blobstore import FileBlobStore, PackBlobStore
+from fastapi.responses import FileResponse
+from src.core.constants import BATCHMAXITEMS
+from src.core.crypto import canonical_json_cid, verify_cid
+from src.core.models import (IPFSStoreRequest, IPFSRetrieveResponse,
+                             DIDRegistryRegisterRequest, DIDRegistryRegisterBatchRequest,
+                             DIDRegistryResolveBatchRequest, IPFSStoreBatchRequest,
+                             IPFSStoreBatchResponse, IPFSRetrieveBatchRequest,
+                             IPFSRetrieveBatchResponse)
+
+@pytest.fixture(params=["file", "pack"])
+def storage(request, monkeypatch):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db = DB(path=os.path.join(tmpdir, "store.db"), index_path=os.path.join(tmpdir, "index.db"))
+        if request.param == "pack":
+            blobs = PackBlobStore(os.path.join(tmpdir, "blobs"), sync=False)
+        else:
+            blobs = FileBlobStore(tmpdir)
+        monkeypatch.setattr(main, "get_db", lambda: db)
+        monkeypatch.setattr(main, "get_blobs", lambda: blobs)
+        yield types.SimpleNamespace(db=db, blobs=blobs)
+        blobs.close()
+        db.close()
+
+def test_store_and_retrieve(storage):
+    stored = main.store_cid(IPFSStoreRequest(document={"foo": "bar"}))
+    assert stored.cid.startswith("bagaaiera")
+    assert not stored.deduplicated
+    assert json.loads(storage.blobs.get(stored.cid)) == {"foo": "bar"}
+    retrieved = IPFSRetrieveResponse.model_validate_json(main.retrieve_cid(stored.cid).body)
+    assert retrieved.exists
+    assert retrieved.document == {"foo": "bar"}
+    assert not main.retrieve_cid("cid_missing").exists
+
+def test_list_endpoint_pages(storage):
+    storage.db.put_many([(f"claim_{i}", f"cid_{i}") for i in range(3)])
+    page = main.list_keys(prefix="claim_", after=None, limit=2, keys_only=False)
+    assert [e.did for e in page.entries] == ["claim_0", "claim_1"]
+    assert page.entries[0].doc_cid == "cid_0"
+    assert page.next == "claim_1"
+    page = main.list_keys(prefix="claim_", after=page.next, limit=2, keys_only=True)
+    assert [e.did for e in page.entries] == ["claim_2"]
+    assert page.entries[0].doc_cid is None
+    assert page.next is None
+
+def test_resolve_raw(storage):
+    storage.db.put("did:raw", "cid_raw")
+    resp = main.resolve("did:raw", raw=True)
+    assert resp.status_code == 200
+    assert resp.body == b"cid_raw"
+    assert main.resolve("did:none", raw=True).status_code == 404
+    assert main.resolve("did:raw").doc_cid == "cid_raw"
+
+def test_framed_retrieve_matches_model(storage):
+    document = {"id": "did:verity:x", "nested": {"list": [1, 2, "é"]}}
+    cid = main.store_cid(IPFSStoreRequest(document=document)).cid
+    framed = main.retrieve_cid(cid)
+    assert framed.media_type == "application/json"
+    parsed = IPFSRetrieveResponse.model_validate_json(framed.body)
+    unframed = IPFSRetrieveResponse.model_validate_json(main.retrieve_cid(cid, framed=False).body)
+    assert parsed == unframed.model_copy(update={"retrieved_at": parsed.retrieved_at})
+    assert parsed.document == document
+
+def test_raw_returns_stored_bytes(storage):
+    cid = main.store_cid(IPFSStoreRequest(document={"foo": "bar"})).cid
+    resp = main.raw_cid(cid)
+    if isinstance(resp, FileResponse):
+        with open(resp.path, "rb") as f:
+            body = f.read()
+    else:
+        body = resp.body
+    assert json.loads(body) == {"foo": "bar"}
+    assert main.raw_cid("cid_missing").status_code == 404
+
+def test_plain_file_names_are_not_served(storage):
+    if isinstance(storage.blobs, FileBlobStore):
+        with open(os.path.join(storage.blobs.root, "settings.txt"), "w", encoding="utf-8") as f:
+            f.write("secret")
+    assert main.raw_cid("settings.txt").status_code == 404
+    assert not main.retrieve_cid("settings.txt").exists
+    assert main.retrieve_stream("settings.txt").status_code == 404
+    resp = main.retrieve_batch(IPFSRetrieveBatchRequest(cids=["settings.txt"]))
+    assert IPFSRetrieveBatchResponse.model_validate_json(resp.body).found == 0
+
+def test_retrieve_cache_headers_and_304(storage):
+    cid = main.store_cid(IPFSStoreRequest(document={"foo": "bar"})).cid
+    resp = main.retrieve_cid(cid)
+    assert resp.headers["etag"] == f'W/"{cid}"'
+    assert "immutable" in resp.headers["cache-control"]
+    for header in (f'W/"{cid}"', f'"{cid}"', f'"other", W/"{cid}"', "*"):
+        not_modified = main.retrieve_cid(cid, if_none_match=header)
+        assert not_modified.status_code == 304
+        assert not_modified.body == b""
+        assert not_modified.headers["etag"] == f'W/"{cid}"'
+    assert main.retrieve_cid(cid, if_none_match='"other"').status_code == 200
+    missing = main.retrieve_cid("cid_missing", if_none_match='"cid_missing"')
+    assert not missing.exists
+
+def test_raw_strong_etag_and_304(storage):
+    cid = main.store_cid(IPFSStoreRequest(document={"foo": "bar"})).cid
+    resp = main.raw_cid(cid)
+    assert resp.headers["etag"] == f'"{cid}"'
+    assert "immutable" in resp.headers["cache-control"]
+    assert main.raw_cid(cid, if_none_match=f'"{cid}"').status_code == 304
+
+def test_register_from_several_event_loops(storage):
+    async def register(did):
+        response = await main.register(DIDRegistryRegisterRequest(did=did, doc_cid="cid_x"))
+        return response.status, main.get_coalescer()
+
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(asyncio.run(
+        register(f"did:loop:{i}")))) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [status for status, _ in results] == ["success"] * 4
+    # one coalescer per loop, its timer and futures never cross loops
+    assert len({id(coalescer) for _, coalescer in results}) == 4
+    assert all(storage.db.get(f"did:loop:{i}") == "cid_x" for i in range(4))
+
+def test_register_and_resolve_batch(storage):
+    items = [DIDRegistryRegisterRequest(did=f"did:b:{i}", doc_cid=f"cid_{i}") for i in range(300)]
+    items.append(DIDRegistryRegisterRequest(did="did:b:bad", doc_cid=""))
+    registered = main.register_batch(DIDRegistryRegisterBatchRequest(items=items))
+    assert (registered.succeeded, registered.failed) == (300, 1)
+    assert registered.results[-1].status == "error" and registered.results[-1].message
+    assert registered.results[0].status == "success"
+
+    resolved = main.resolve_batch(DIDRegistryResolveBatchRequest(
+        dids=["did:b:0", "did:b:299", "did:b:bad", "did:b:none"]))
+    assert resolved.found == 2
+    assert [r.doc_cid for r in resolved.results] == ["cid_0", "cid_299", None, None]
+    assert [r.status for r in resolved.results] == ["success", "success", "error", "error"]
+
+def test_batch_size_is_capped():
+    with pytest.raises(ValueError):
+        DIDRegistryResolveBatchRequest(dids=["did"] * (BATCHMAXITEMS + 1))
+
+def test_store_and_retrieve_batch(storage):
+    docs = [{"n": i} for i in range(50)] + [{"n": 0}]
+    stored = main.store_batch(IPFSStoreBatchRequest(documents=docs))
+    assert isinstance(stored, IPFSStoreBatchResponse)
+    assert stored.deduplicated == 1
+    assert stored.results[0].cid == stored.results[-1].cid
+    cids = [r.cid for r in stored.results[:50]]
+
+    resp = main.retrieve_batch(IPFSRetrieveBatchRequest(cids=cids + ["cid_missing"]))
+    page = IPFSRetrieveBatchResponse.model_validate_json(resp.body)
+    assert page.found == 50
+    assert [r.document for r in page.results[:50]] == docs[:50]
+    assert not page.results[-1].exists
+
+def test_batch_ndjson_streams(storage):
+    accept = "application/json;q=0.5, application/x-ndjson"
+    resp = main.store_batch(IPFSStoreBatchRequest(documents=[{"a": 1}, {"b": 2}]), accept=accept)
+    assert resp.media_type == main.NDJSON
+    lines = _drain(resp).splitlines()
+    cids = [json.loads(line)["cid"] for line in lines]
+    assert len(cids) == 2
+
+    resp = main.retrieve_batch(IPFSRetrieveBatchRequest(cids=cids + ["cid_missing"]),
+                               accept=main.NDJSON)
+    results = [IPFSRetrieveResponse.model_validate_json(line)
+               for line in _drain(resp).splitlines()]
+    assert [r.document for r in results[:2]] == [{"a": 1}, {"b": 2}]
+    assert [r.exists for r in results] == [True, True, False]
+
+def test_store_deduplicates(storage):
+    first = main.store_cid(IPFSStoreRequest(document={"foo": "bar"}))
+    again = main.store_cid(IPFSStoreRequest(document={"foo": "bar"}))
+    assert again.cid == first.cid
+    assert again.deduplicated
+
+def test_store_cid_is_canonical(storage):
+    first = main.store_cid(IPFSStoreRequest(document={"a": 1, "b": [1, 2]}))
+    reordered = main.store_cid(IPFSStoreRequest(document={"b": [1, 2], "a": 1}))
+    assert reordered.cid == first.cid
+    assert reordered.deduplicated
+    assert storage.blobs.get(first.cid) == b'{"a":1,"b":[1,2]}'
+    assert verify_cid(first.cid, storage.blobs.get(first.cid))
+
+def test_legacy_cid_still_retrievable(storage):
+    data = json.dumps({"old": "doc"}).encode()
+    legacy = "cid_" + hashlib.sha256(data).hexdigest()
+    storage.blobs.put(legacy, data)
+    resp = main.retrieve_cid(legacy)
+    assert IPFSRetrieveResponse.model_validate_json(resp.body).document == {"old": "doc"}
+    assert verify_cid(legacy, data)
+
+def test_concurrent_identical_stores_and_retrieves(storage):
+    document = {"payload": "z" * 200_000}
+    cid = main.store_cid(IPFSStoreRequest(document={"warm": "up"})).cid
+    main.retrieve_cid(cid)
+    results = {"stored": [], "retrieved": [], "errors": []}
+    barrier = threading.Barrier(16)
+
+    def storer():
+        barrier.wait()
+        for _ in range(5):
+            results["stored"].append(main.store_cid(IPFSStoreRequest(document=document)))
+
+    def retriever(target):
+        barrier.wait()
+        for _ in range(20):
+            try:
+                resp = main.retrieve_cid(target())
+                if isinstance(resp, IPFSRetrieveResponse):
+                    assert not resp.exists
+                else:
+                    parsed = IPFSRetrieveResponse.model_validate_json(resp.body)
+                    results["retrieved"].append(parsed.document == document)
+            except Exception as e: # pylint: disable=broad-exception-caught
+                results["errors"].append(e)
+
+    expected = canonical_json_cid(document)[0]
+    threads = [threading.Thread(target=storer) for _ in range(8)]
+    threads += [threading.Thread(target=retriever, args=(lambda: expected,)) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not results["errors"]
+    assert all(results["retrieved"])
+    assert {r.cid for r in results["stored"]} == {expected}
+    assert sum(not r.deduplicated for r in results["stored"]) >= 1
+    assert sum(r.deduplicated for r in results["stored"]) >= 30
+    if isinstance(storage.blobs, PackBlobStore):
+        assert sum(not r.deduplicated for r in results["stored"]) == 1
+
+class _Body:
+    """Just enough of a starlette Request for store_stream"""
+    def __init__(self, data, part):
+        self.data = data
+        self.part = part
+
+    async def stream(self):
+        for i in range(0, len(self.data), self.part):
+            yield self.data[i:i + self.part]
+        yield b""
+
+def _drain(resp):
+    async def collect():
+        return b"".join([part async for part in resp.body_iterator])
+    return asyncio.run(collect())
+
+def test_store_stream_and_ranges(storage, monkeypatch):
+    monkeypatch.setattr(main.dag, "CHUNKSIZE", 1000)
+    monkeypatch.setattr(main.dag, "FANOUT", 4)
+    data = os.urandom(25_000)
+    stored = asyncio.run(main.store_stream(_Body(data, 3333)))
+    assert stored.size_bytes == len(data)
+    assert not stored.deduplicated
+    assert asyncio.run(main.store_stream(_Body(data, 999))).deduplicated
+
+    full = main.retrieve_stream(stored.cid)
+    assert full.status_code == 200
+    assert full.headers["content-length"] == str(len(data))
+    assert _drain(full) == data
+
+    part = main.retrieve_stream(stored.cid, range_="bytes=1500-12345")
+    assert part.status_code == 206
+    assert part.headers["content-range"] == f"bytes 1500-12345/{len(data)}"
+    assert _drain(part) == data[1500:12346]
+    assert _drain(main.retrieve_stream(stored.cid, range_="bytes=-10")) == data[-10:]
+    assert _drain(main.retrieve_stream(stored.cid, range_="bytes=24990-")) == data[24990:]
+    assert main.retrieve_stream(stored.cid, range_="bytes=9-3").status_code == 200
+    assert main.retrieve_stream(stored.cid, range_="bytes=25000-").status_code == 416
+    assert main.retrieve_stream(stored.cid, if_none_match=f'"{stored.cid}"').status_code == 304
+    assert main.retrieve_stream("cid_missing").status_code == 404
+
+def test_streamed_content_is_not_framed_as_json(storage, monkeypatch):
+    monkeypatch.setattr(main.dag, "CHUNKSIZE", 1000)
+    data = os.urandom(2500)
+    root = asyncio.run(main.store_stream(_Body(data, 1000))).cid
+    leaf = main.dag._links(storage.blobs, root)[0][0]
+    for cid in (root, leaf):
+        resp = main.retrieve_cid(cid)
+        assert resp.status_code == 415
+        assert f"/retrieve/stream/{cid}" in json.loads(resp.body)["detail"]
+    resp = main.retrieve_batch(IPFSRetrieveBatchRequest(cids=[root, leaf]))
+    page = IPFSRetrieveBatchResponse.model_validate_json(resp.body)
+    assert page.found == 0
+    assert _drain(main.retrieve_stream(root)) == data
@@ -0,0 +1,107 @@
+"""
+Maintenance tools for the storage service
+
+usage: python -m src.services.storage.tools migrate --store store.db --index index.db \
+           --dest registry.db
+       python -m src.services.storage.tools compact --root blobs
+"""
+import argparse
+import lmdb as tool
+from .db_lmdb import DB, LAYOUT_SINGLE, MAPSIZE
+from .blobstore import PackBlobStore, PACKROOT
+
+MIGRATE_BATCH = 10_000
+
+
+def _copy_table(src_env, dest_env, dest_dbi, batch:int=MIGRATE_BATCH) -> int:
+    """Copy every record of src_env main db into dest_dbi, one write txn per batch"""
+    count = 0
+    with src_env.begin(write=False) as src:
+        cursor = src.cursor()
+        pending = []
+        for key, value in cursor:
+            pending.append((key, value))
+            if len(pending) >= batch:
+                count += _write(dest_env, dest_dbi, pending)
+                pending = []
+        if pending:
+            count += _write(dest_env, dest_dbi, pending)
+    return count
+
+
+def _write(env, dbi, pairs) -> int:
+    with env.begin(write=True) as txn:
+        for key, value in pairs:
+            txn.put(key, value, db=dbi)
+    return len(pairs)
+
+
+def migrate_split_to_single(store_path:str, index_path:str, dest_path:str,
+                            batch:int=MIGRATE_BATCH) -> tuple[int, int]:
+    """
+    Copy a split layout DB (store.db + index.db) into a new single layout DB
+
+    The source is opened read only and left untouched. The destination map starts
+    as large as both source maps together, so the copy never fills it.
+
+    :param store_path: path of the split value table
+    :param index_path: path of the split key index
+    :param dest_path: path of the single layout DB to create
+    :param batch: records per write transaction
+    :return: (values copied, keys copied)
+    :rtype: tuple[int, int]
+    """
+    store = tool.open(store_path, readonly=True, create=False)
+    index = tool.open(index_path, readonly=True, create=False)
+    map_size = store.info()["map_size"] + index.info()["map_size"]
+    dest = DB(path=dest_path, layout=LAYOUT_SINGLE, map_size=max(map_size, MAPSIZE))
+    try:
+        values = _copy_table(store, dest.db, dest.store_dbi, batch)
+        keys = _copy_table(index, dest.db, dest.index_dbi, batch)
+    finally:
+        store.close()
+        index.close()
+        dest.close()
+    return values, keys
+
+
+def compact_pack(root:str=PACKROOT) -> dict:
+    """
+    Compact a pack blob store, the storage service using it should be stopped
+
+    :param root: pack blob store directory
+    :return: PackBlobStore.compact statistics
+    """
+    blobs = PackBlobStore(root)
+    try:
+        return blobs.compact()
+    finally:
+        blobs.close()
+
+
+def main(argv=None):
+    """
+    Entry point of the maintenance tools
+    """
+    parser = argparse.ArgumentParser(description="Storage maintenance tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    mig = sub.add_parser("migrate", help="copy a split layout DB into a single layout DB")
+    mig.add_argument("--store", default="store.db", help="split layout value table")
+    mig.add_argument("--index", default="index.db", help="split layout key index")
+    mig.add_argument("--dest", required=True, help="single layout DB to create")
+    mig.add_argument("--batch", type=int, default=MIGRATE_BATCH, help="records per transaction")
+    comp = sub.add_parser("compact", help="rewrite the live documents of a pack blob store")
+    comp.add_argument("--root", default=PACKROOT, help="pack blob store directory")
+    args = parser.parse_args(argv)
+    if args.command == "migrate":
+        values, keys = migrate_split_to_single(args.store, args.index, args.dest, args.batch)
+        print(f"migrated {values} values and {keys} keys into {args.dest}")
+    elif args.command == "compact":
+        stats = compact_pack(args.root)
+        print(f"compacted {stats['blobs']} blobs: {stats['segments_before']} segments / "
+              f"{stats['bytes_before']} bytes -> {stats['segments_after']} segments / "
+              f"{stats['bytes_after']} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 """
 Docstring for verifier
 """
+import asyncio
 import tempfile
 import os
 from datetime import datetime
@@ -8,10 +9,10 @@ import logging
 from typing import Dict, Optional, TypedDict, List
 from fastapi import FastAPI, HTTPException, APIRouter,Form, File, UploadFile
 from pydantic import BaseModel
-from src.middleware import retrieve, resolve
+from src.middleware import aretrieve, aresolve
 from src.core.models import (VerityClaim, DemoDIDDocument,
 VerificationMethod, IPFSRetrieveResponse,DIDRegistryResolveResponse)
-from src.core.crypto import verify, hexhash
+from src.core.crypto import verify, hexhash, is_cid
 from src.core.exceptions import (VerityVerifierError, VerityValidationError)
 
 
@@ -74,7 +75,7 @@ async def verify_claim_chain(claim_cid: str,
         resq_dict:ResponseDict= {}
         tmp_dict: TempDict = {}
         # Step 1: Retrieve the claim from storage
-        resq_dict['claim_resp'] = retrieve(claim_cid)
+        resq_dict['claim_resp'] = await aretrieve(claim_cid)
         if not resq_dict['claim_resp'].exists:
             result.error_message = f"Claim not found: {claim_cid}"
             return result
@@ -93,7 +94,7 @@ async def verify_claim_chain(claim_cid: str,
         result.issuer = {"did": issuer_did}
 
         # Step 3: Resolve DID to CID
-        resq_dict['did_resp'] = resolve(issuer_did)
+        resq_dict['did_resp'] = await aresolve(issuer_did)
         if resq_dict['did_resp'].status != "success" or not resq_dict['did_resp'].doc_cid:
             result.error_message = f"DID resolution failed: {issuer_did}"
             return result
@@ -101,7 +102,7 @@ async def verify_claim_chain(claim_cid: str,
         result.steps["did_resolved"] = True
 
         # Step 4: Retrieve DID Document
-        diddoc_resp = retrieve(resq_dict['did_resp'].doc_cid)
+        diddoc_resp = await aretrieve(resq_dict['did_resp'].doc_cid)
         if not diddoc_resp.exists:
             result.error_message = f"DID Document not found: {resq_dict['did_resp'].doc_cid}"
             return result
@@ -126,8 +127,9 @@ async def verify_claim_chain(claim_cid: str,
         claim.verification_url = None
         message_to_verify = claim.model_dump_json()
         # Step 6: Check all verification methods in DID Document
-        signature_valid, authorized_method = vm_verification(diddoc.verification_method,
-        signature, message_to_verify)
+        # key recovery is CPU bound, keep it off the event loop
+        signature_valid, authorized_method = await asyncio.to_thread(
+            vm_verification, diddoc.verification_method, signature, message_to_verify)
 
         if not signature_valid:
             result.error_message = "Signature does not match any authorized key in DID Document"
@@ -168,16 +170,15 @@ def vm_verification(verification_method:List[VerificationMethod], signature, mes
 async def verify_by_claim(claim_id:str):
     """Simple api for fast verification"""
     is_claim = claim_id.startswith("claim_")
-    is_cid = claim_id.startswith("cid_")
     try:
         if is_claim:
-            res = resolve(claim_id)
+            res = await aresolve(claim_id)
             if not res.doc_cid:
                 raise VerityVerifierError("doc cid unavailable")
             result = await verify_claim_chain(res.doc_cid)
             if result.steps["claim_retrieved"]:
                 return result
-        elif is_cid:
+        elif is_cid(claim_id):
             return await verify_claim_chain(claim_id)
     except VerityVerifierError as e:
         raise HTTPException(status_code=404, detail=f"Claim not found: {claim_id}") from e
@@ -193,7 +194,6 @@ async def verify_by_claim_id(
     """Verify a claim using its claim_id (requires lookup)."""
     # In real system, claim_id->CID index
     is_claim = claim_id.startswith("claim_")
-    is_cid = claim_id.startswith("cid_")
     if message:
         checksum = await generate_checksum(message=message)
     elif file:
@@ -202,13 +202,13 @@ async def verify_by_claim_id(
         raise VerityVerifierError("No content to verify")
     try:
         if is_claim:
-            res = resolve(claim_id)
+            res = await aresolve(claim_id)
             if not res.doc_cid:
                 raise VerityVerifierError("doc cid unavailable")
             result = await verify_claim_chain(res.doc_cid, checksum)
             if result.steps["claim_retrieved"]:
                 return result
-        elif is_cid:
+        elif is_cid(claim_id):
             return await verify_claim_chain(claim_id,checksum)
     except VerityVerifierError as e:
         raise HTTPException(status_code=404, detail=f"Claim not found: {claim_id}") from e